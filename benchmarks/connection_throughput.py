@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of frame throughput over a unix socket pair.
+
+Compares the buffered ``recv_into`` receive path of BaseSocketConnection with
+the previous implementation that built every frame by concatenating the
+results of ``recv`` calls. Run with::
+
+    python benchmarks/connection_throughput.py
+"""
+from __future__ import print_function
+
+import socket
+import struct
+import threading
+import time
+
+from mcrunner.connection import BaseSocketConnection
+
+PAYLOAD_SIZES = [1024 * 4 ** i for i in range(8)]  # 1 KB to 16 MB
+TOTAL_BYTES = 64 * 1024 * 1024
+MIN_FRAMES = 8
+
+
+def legacy_receive_message(sock):
+    """
+    Receive path before switching to recv_into, kept for comparison.
+    """
+    def receive_data(num):
+        result = b''
+
+        while len(result) < num:
+            data = sock.recv(num - len(result))
+            if not data:
+                return None
+
+            result += data
+
+        return result
+
+    raw_length = receive_data(4)
+    if not raw_length:
+        return None
+
+    return receive_data(struct.unpack('>I', raw_length)[0])
+
+
+def run(payload_size, receive):
+    frames = max(TOTAL_BYTES // payload_size, MIN_FRAMES)
+    payload = b'x' * payload_size
+
+    sender_sock, receiver_sock = socket.socketpair()
+    sender = BaseSocketConnection(sender_sock)
+
+    def send():
+        for _ in range(frames):
+            sender.send_message(payload)
+
+    thread = threading.Thread(target=send)
+
+    start = time.time()
+    thread.start()
+
+    for _ in range(frames):
+        frame = receive(receiver_sock)
+        assert len(frame) == payload_size
+
+    elapsed = time.time() - start
+
+    thread.join()
+    sender_sock.close()
+    receiver_sock.close()
+
+    return frames / elapsed, frames * payload_size / elapsed / (1024 * 1024)
+
+
+def main():
+    connections = {}
+
+    def buffered_receive(sock):
+        if sock not in connections:
+            connections[sock] = BaseSocketConnection(sock)
+
+        return connections[sock].receive_frame()
+
+    print('%10s  %14s  %12s  %14s  %12s' % (
+        'payload', 'recv_into f/s', 'MB/s', 'legacy f/s', 'MB/s'
+    ))
+
+    for payload_size in PAYLOAD_SIZES:
+        frames_per_sec, mb_per_sec = run(payload_size, buffered_receive)
+        legacy_frames_per_sec, legacy_mb_per_sec = run(payload_size, legacy_receive_message)
+
+        print('%9dK  %14.0f  %12.1f  %14.0f  %12.1f' % (
+            payload_size // 1024,
+            frames_per_sec,
+            mb_per_sec,
+            legacy_frames_per_sec,
+            legacy_mb_per_sec,
+        ))
+
+
+if __name__ == '__main__':
+    main()
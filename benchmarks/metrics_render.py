@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of rendering the Prometheus metrics of mcrunnerd.
+
+Renders the metrics of a daemon with SERVER_COUNT running servers, each with
+a resource sample and request latency histograms for the common actions,
+which is what a single scrape costs the daemon. Run with::
+
+    python benchmarks/metrics_render.py
+"""
+from __future__ import print_function
+
+import time
+
+from mcrunner.metrics import MetricsCollector
+from mcrunner.sampler import ProcessSample, ResourceSampler
+from mcrunner.server import MinecraftServer
+from mcrunner.server_status import ServerStatus
+
+SERVER_COUNT = 40
+ACTIONS = ['status', 'start', 'stop', 'restart', 'command', 'tail', 'stats', 'metrics']
+ITERATIONS = 2000
+
+
+class Process(object):
+
+    """
+    Stand-in for the Popen object of a running server.
+    """
+
+    pid = 1
+
+
+def create_collector():
+    servers = {}
+    for i in range(SERVER_COUNT):
+        server = MinecraftServer('server-%d' % i, '/srv/server-%d' % i, 'spigot.jar', '-Xmx2G')
+        server.pipe = Process()
+        server.status = ServerStatus.RUNNING
+        server.launched_at = time.time() - 3600
+        server.startup_time = 20.0
+        servers[server.name] = server
+
+    sampler = ResourceSampler(servers, 5, 3600)
+    for name in servers:
+        sampler.series[name].append(ProcessSample(time.time(), 1234.5, 2 ** 31, 87, 1000, 10, 0, 0))
+
+    collector = MetricsCollector(servers, sampler)
+    for action in ACTIONS:
+        for duration in (0.0005, 0.02, 3):
+            collector.observe_request(action, duration)
+
+    return collector
+
+
+def main():
+    collector = create_collector()
+
+    start_time = time.time()
+    for _ in range(ITERATIONS):
+        body = collector.render()
+    elapsed = (time.time() - start_time) / ITERATIONS
+
+    print('%d servers: %d lines, %d bytes, %.3f ms per render' % (
+        SERVER_COUNT,
+        body.count('\n'),
+        len(body),
+        elapsed * 1000,
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,266 @@
+import codecs
+import itertools
+import logging
+import socket
 import struct
+import threading
+
+from mcrunner.protocol import (
+    RESPONSE_DATA,
+    RESPONSE_END,
+    RESPONSE_MESSAGE,
+    ResponseStatus,
+    decode_request,
+    decode_response,
+    encode_request,
+    encode_response,
+)
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('>I')
+
+RECEIVE_BUFFER_SIZE = 65536
+SEND_COALESCE_SIZE = 65536
+MAX_FRAME_SIZE = 256 * 1024 * 1024
 
 
 class BaseSocketConnection(object):
 
+    """
+    Length-prefixed framing over a stream socket. Every frame is a 4 byte
+    big-endian length followed by the payload.
+
+    Incoming data is read with ``recv_into`` into a reusable receive buffer,
+    so frames (and any further frames that arrived with the same read) are
+    parsed in place without building intermediate strings. The buffer grows
+    to fit large frames and shrinks back once they have been consumed.
+    """
+
     def __init__(self, sock_conn):
         self.sock_conn = sock_conn
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+        self._buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
 
     def send_message(self, message):
-        length = len(message)
+        if not isinstance(message, bytes):
+            message = message.encode('utf8')
+
+        header = FRAME_HEADER.pack(len(message))
+
+        with self.send_lock:
+            if len(message) < SEND_COALESCE_SIZE:
+                self.sock_conn.sendall(header + message)
+            else:
+                # avoid copying large payloads just to prepend the header
+                self.sock_conn.sendall(header)
+                self.sock_conn.sendall(message)
+
+    def receive_frame(self):
+        """
+        Receive the next frame and return its payload as a memoryview into the
+        receive buffer, or None if the connection was closed. The view is only
+        valid until the next call.
+        """
+        if not self._fill(FRAME_HEADER.size):
+            return None
+
+        length = FRAME_HEADER.unpack_from(self._buffer, self._start)[0]
+        if length > MAX_FRAME_SIZE:
+            raise socket.error('Frame of %d bytes exceeds the maximum frame size' % length)
+
+        if not self._fill(FRAME_HEADER.size + length):
+            return None
+
+        start = self._start + FRAME_HEADER.size
+        self._start = start + length
 
-        self.sock_conn.sendall(struct.pack('>I', length) + message.encode('utf8'))
+        return self._view[start:self._start]
 
     def receive_message(self):
-        raw_length = self._receive_data(4)
-        if not raw_length:
+        """
+        Receive the next frame decoded as text, or None if the connection was closed.
+        """
+        frame = self.receive_frame()
+        if frame is None:
             return None
 
-        length = struct.unpack('>I', raw_length.encode('utf8'))[0]
-        return self._receive_data(length)
+        return codecs.utf_8_decode(frame)[0]
+
+    def has_buffered_frame(self):
+        """
+        Check whether a complete frame has already been read from the socket,
+        in which case waiting for the socket to become readable would stall.
+        """
+        unread = self._end - self._start
+        if unread < FRAME_HEADER.size:
+            return False
+
+        length = FRAME_HEADER.unpack_from(self._buffer, self._start)[0]
+        return unread >= FRAME_HEADER.size + length
 
     def close(self):
+        self.closed = True
         self.sock_conn.close()
 
-    def _receive_data(self, num):
-        result = ''
+    def _fill(self, num):
+        """
+        Make sure at least ``num`` unread bytes are buffered, reading as much
+        as fits into the buffer with each call to recv_into. Returns False if
+        the connection was closed first.
+        """
+        if self._end - self._start >= num:
+            return True
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+            if len(self._buffer) > RECEIVE_BUFFER_SIZE and num <= RECEIVE_BUFFER_SIZE:
+                # don't hold on to the memory of a large frame on long lived connections
+                self._buffer = bytearray(RECEIVE_BUFFER_SIZE)
+                self._view = memoryview(self._buffer)
+
+        if self._start + num > len(self._buffer):
+            self._compact(num)
 
-        while len(result) < num:
-            data = self.sock_conn.recv(num - len(result))
+        while self._end - self._start < num:
+            received = self.sock_conn.recv_into(self._view[self._end:])
+            if not received:
+                return False
 
-            if not data:
-                return None
+            self._end += received
 
-            result += data
+        return True
 
-        return result
+    def _compact(self, num):
+        """
+        Move unread bytes to the front of the buffer, growing the buffer if it
+        can't hold ``num`` bytes.
+        """
+        unread = self._end - self._start
+
+        if num > len(self._buffer):
+            size = len(self._buffer)
+            while size < num:
+                size *= 2
+
+            buffer = bytearray(size)
+            buffer[:unread] = self._view[self._start:self._end]
+
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        else:
+            self._buffer[:unread] = self._view[self._start:self._end]
+
+        self._start = 0
+        self._end = unread
 
 
 class ClientSocketConnection(BaseSocketConnection):
-    pass
+
+    def __init__(self, sock_conn):
+        super(ClientSocketConnection, self).__init__(sock_conn)
+        self.request_ids = itertools.count(1)
+
+    def send_request(self, action, **args):
+        """
+        Send a request and return its id. Several requests can be in flight on
+        the same connection; responses carry the id of their request.
+        """
+        request_id = next(self.request_ids)
+        self.send_message(encode_request(request_id, action, **args))
+
+        return request_id
+
+    def receive_response(self):
+        """
+        Receive the next response frame as a dict, or None if the connection
+        was closed.
+        """
+        frame = self.receive_message()
+        if frame is None:
+            return None
+
+        return decode_response(frame)
 
 
 class ServerSocketConnection(BaseSocketConnection):
 
-    def close(self):
-        self.send_message('')
-        super(ServerSocketConnection, self).close()
+    def receive_request(self):
+        """
+        Receive the next request, or None if the connection was closed.
+        """
+        frame = self.receive_message()
+        if frame is None:
+            return None
+
+        return decode_request(frame)
+
+    def send_response(self, request_id, response_type, **fields):
+        self.send_message(encode_response(request_id, response_type, **fields))
+
+
+class RequestConnection(object):
+
+    """
+    View of a server connection scoped to a single request. Handlers use it to
+    send progress messages and structured data for the request, and to set the
+    final status and result that are sent when the request is finished.
+    """
+
+    def __init__(self, connection, request_id):
+        self.connection = connection
+        self.request_id = request_id
+
+        self.status = ResponseStatus.OK
+        self.result = None
+        self.finished = False
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    def child(self):
+        """
+        Return a connection for one part of this request, such as the
+        operation on a single server of a bulk request. It sends messages and
+        data under the same request id, but keeps a status of its own.
+        """
+        return RequestConnection(self.connection, self.request_id)
+
+    def send_message(self, message):
+        self._send(RESPONSE_MESSAGE, message=message)
+
+    def send_data(self, data):
+        self._send(RESPONSE_DATA, data=data)
+
+    def set_status(self, status):
+        self.status = status
+
+    def set_result(self, result):
+        self.result = result
+
+    def finish(self):
+        """
+        Send the END frame of the request.
+        """
+        if self.finished:
+            return
+
+        self.finished = True
+
+        self._send(RESPONSE_END, status=self.status.value, result=self.result)
+
+    def _send(self, response_type, **fields):
+        # A client going away must not interrupt the operation it requested
+        # (such as a server restart), so send errors are ignored here. Streaming
+        # handlers notice the disconnect through ``closed``.
+        try:
+            self.connection.send_response(self.request_id, response_type, **fields)
+        except socket.error:
+            logger.debug('Could not send response to request %s, client disconnected', self.request_id)
@@ -0,0 +1,478 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import fcntl
+import itertools
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+from mcrunner.exceptions import CommandQueueFullException, ServerNotRunningException
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 65536
+MAX_LINE_LENGTH = 65536
+SUBSCRIPTION_QUEUE_SIZE = 1000
+COMMAND_QUEUE_SIZE = 100
+COMMAND_BURST = 20
+WRITE_POLL_INTERVAL_SEC = 1.0
+
+# memory taken by a buffered line besides its content
+LINE_OVERHEAD = sys.getsizeof(b'')
+
+
+class ConsoleSubscription(object):
+
+    """
+    Bounded queue of console lines for a single subscriber.
+
+    Publishing never blocks. If the subscriber doesn't keep up and the queue is
+    full, the oldest queued lines are dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, maxlen=SUBSCRIPTION_QUEUE_SIZE):
+        self.queue = collections.deque(maxlen=maxlen)
+        self.dropped = 0
+        self.closed = False
+
+        self.condition = threading.Condition()
+
+    def put(self, line):
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+
+            self.queue.append(line)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait up to ``timeout`` seconds for lines and return all queued lines.
+        Returns an empty list if no lines arrived in time or the subscription
+        has been closed.
+        """
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+
+            lines = list(self.queue)
+            self.queue.clear()
+
+        return lines
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ConsoleBuffer(object):
+
+    """
+    Memory capped ring buffer of the most recent console lines of a server.
+
+    Lines are stored as raw bytes exactly as they were read from the server
+    process. Every line is accounted for with its length plus LINE_OVERHEAD,
+    the memory taken by the line object itself, so that a flood of empty or
+    short lines is capped as well. Once the total size of the stored lines
+    exceeds ``max_bytes``, the oldest lines are discarded.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        self.lines = collections.deque()
+        self.size = 0
+
+        # total number of lines ever appended
+        self.line_count = 0
+
+        self.subscriptions = []
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self, line):
+        """
+        Append a line (without trailing newline).
+        """
+        with self.lock:
+            self.lines.append(line)
+            self.size += len(line) + LINE_OVERHEAD
+            self.line_count += 1
+
+            while self.size > self.max_bytes and len(self.lines) > 1:
+                self.size -= len(self.lines.popleft()) + LINE_OVERHEAD
+
+            for subscription in self.subscriptions:
+                subscription.put(line)
+
+    def subscribe(self, count=0, maxlen=SUBSCRIPTION_QUEUE_SIZE):
+        """
+        Register a new subscription for lines appended from now on. Returns a
+        two-tuple of the ``count`` most recent lines and the subscription, taken
+        atomically so no line is missed or repeated.
+        """
+        subscription = ConsoleSubscription(maxlen=maxlen)
+
+        with self.lock:
+            lines = self._tail(count)
+
+            self.subscriptions.append(subscription)
+
+        return lines, subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+        subscription.close()
+
+    def get_lines(self, count=None):
+        """
+        Return up to ``count`` of the most recent lines, oldest first.
+        """
+        with self.lock:
+            if count is None:
+                return list(self.lines)
+
+            return self._tail(count)
+
+    def _tail(self, count):
+        if count <= 0:
+            return []
+
+        # walk from the newest end so this doesn't depend on the buffer length
+        lines = list(itertools.islice(reversed(self.lines), count))
+        lines.reverse()
+
+        return lines
+
+
+class OutputPump(threading.Thread):
+
+    """
+    Thread that continuously drains the stdout and stderr pipes of a server
+    process so that the process never blocks on a full pipe.
+
+    Complete lines are passed to ``on_line`` as bytes with the line ending
+    stripped. ``on_eof`` is called once all streams have been closed, which
+    happens when the server process exits.
+    """
+
+    def __init__(self, streams, on_line, on_eof=None):
+        super(OutputPump, self).__init__()
+        self.daemon = True
+
+        self.streams = streams
+        self.on_line = on_line
+        self.on_eof = on_eof
+
+    def run(self):
+        pending = dict((stream.fileno(), b'') for stream in self.streams)
+
+        try:
+            while pending:
+                try:
+                    readable, _, _ = select.select(list(pending), [], [])
+                except (OSError, select.error) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for fd in readable:
+                    data = os.read(fd, READ_CHUNK_SIZE)
+
+                    if not data:
+                        if pending[fd]:
+                            self._emit(pending[fd])
+                        del pending[fd]
+                        continue
+
+                    pending[fd] = self._split_lines(pending[fd] + data)
+        except Exception:
+            logger.exception('Error draining server output')
+        finally:
+            if self.on_eof:
+                self.on_eof()
+
+    def _split_lines(self, data):
+        lines = data.split(b'\n')
+        remainder = lines.pop()
+
+        for line in lines:
+            self._emit(line)
+
+        while len(remainder) >= MAX_LINE_LENGTH:
+            self._emit(remainder[:MAX_LINE_LENGTH])
+            remainder = remainder[MAX_LINE_LENGTH:]
+
+        return remainder
+
+    def _emit(self, line):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+
+        try:
+            self.on_line(line)
+        except Exception:
+            logger.exception('Error handling server output line')
+
+
+class CommandLimiter(object):
+
+    """
+    Token bucket limiting the rate at which commands are written to a server
+    process to ``rate`` commands per second, allowing bursts of up to
+    ``burst`` commands. A rate of 0 disables the limit.
+
+    Commands listed in ``coalesce`` (such as ``save-all``) are idempotent:
+    sending one while an identical one is still queued only waits for the
+    queued one. Coalesced commands and commands dropped because the queue
+    was full are counted in ``coalesced`` and ``dropped``.
+    """
+
+    def __init__(self, rate=0, burst=COMMAND_BURST, coalesce=(), clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.coalesce = frozenset(('%s\n' % command).encode('utf8') for command in coalesce)
+        self.clock = clock
+
+        self.tokens = float(burst)
+        self.updated_at = clock()
+
+        self.dropped = 0
+        self.coalesced = 0
+
+    def can_coalesce(self, data):
+        return data in self.coalesce
+
+    def take(self, count):
+        """
+        Take tokens for ``count`` commands. Returns 0 if they were taken, or
+        the number of seconds until enough tokens are available. Batches
+        larger than ``burst`` are let through once the bucket is full.
+        """
+        if not self.rate:
+            return 0
+
+        now = self.clock()
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        needed = min(count, self.burst)
+        if self.tokens < needed:
+            return (needed - self.tokens) / self.rate
+
+        self.tokens -= count
+
+        return 0
+
+
+class PendingCommand(object):
+
+    """
+    Command queued for delivery to a server process.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.count = data.count(b'\n')
+        self.delivered = False
+        self.error = None
+
+        self.event = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Wait up to ``timeout`` seconds for the command to be written to the
+        server process. Raises ``error`` if it can't be delivered. Returns
+        True if the command was delivered in time.
+        """
+        self.event.wait(timeout)
+
+        if self.error:
+            raise self.error
+
+        return self.delivered
+
+    def _finish(self, error=None):
+        self.delivered = error is None
+        self.error = error
+        self.event.set()
+
+
+class CommandWriter(threading.Thread):
+
+    """
+    Thread that writes queued commands to the stdin pipe of a server process.
+
+    The pipe is written without blocking, so a server that stops reading its
+    input never blocks the callers. Queued commands are written in batches
+    straight to the file descriptor, bypassing any buffering, and each one
+    is acknowledged as soon as it was written completely. At most ``maxlen``
+    commands are queued, and they are written no faster than the
+    CommandLimiter ``limiter`` allows. Priority commands, such as ``stop``,
+    are written ahead of all others and are exempt from both limits; an
+    identical priority command that is still queued is not queued again.
+    Once the pipe is broken or the writer
+    is closed, queued commands fail with ServerNotRunningException and
+    ``on_broken`` is called if the pipe broke.
+    """
+
+    def __init__(self, stream, maxlen=COMMAND_QUEUE_SIZE, on_broken=None, limiter=None):
+        super(CommandWriter, self).__init__()
+        self.daemon = True
+
+        self.stream = stream
+        self.maxlen = maxlen
+        self.on_broken = on_broken
+        self.limiter = limiter or CommandLimiter()
+
+        self.queue = collections.deque()
+        self.priority_queue = collections.deque()
+        self.closed = False
+
+        self.condition = threading.Condition()
+
+    def put(self, data, priority=False):
+        """
+        Queue bytes to be written and return their PendingCommand.
+        """
+        with self.condition:
+            if self.closed:
+                raise ServerNotRunningException
+
+            if priority:
+                for command in self.priority_queue:
+                    if command.data == data:
+                        return command
+
+                command = PendingCommand(data)
+
+                self.priority_queue.append(command)
+                self.condition.notify()
+
+                return command
+
+            if self.limiter.can_coalesce(data):
+                for command in self.queue:
+                    if command.data == data:
+                        self.limiter.coalesced += 1
+                        return command
+
+            if len(self.queue) >= self.maxlen:
+                self.limiter.dropped += 1
+                raise CommandQueueFullException
+
+            command = PendingCommand(data)
+
+            self.queue.append(command)
+            self.condition.notify()
+
+        return command
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get_queue_depth(self):
+        return len(self.queue) + len(self.priority_queue)
+
+    def run(self):
+        fd = self.stream.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        batch = []
+
+        try:
+            while True:
+                with self.condition:
+                    batch = self._take_batch()
+
+                if not batch:
+                    break
+
+                self._write_batch(fd, batch)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EPIPE:
+                logger.exception('Error writing server input')
+
+            with self.condition:
+                self.closed = True
+
+            if self.on_broken:
+                self.on_broken()
+        finally:
+            # commands left over from the last batch and the queue
+            with self.condition:
+                batch.extend(self.priority_queue)
+                batch.extend(self.queue)
+                self.priority_queue.clear()
+                self.queue.clear()
+
+            for command in batch:
+                if not command.event.is_set():
+                    command._finish(ServerNotRunningException())
+
+    def _take_batch(self):
+        # called with the condition held, waits for queued commands the rate
+        # limit allows to be written and returns them, or [] once closed
+        while not self.closed:
+            batch = list(self.priority_queue)
+            self.priority_queue.clear()
+            delay = None
+
+            while self.queue:
+                delay = self.limiter.take(self.queue[0].count)
+                if delay:
+                    break
+
+                batch.append(self.queue.popleft())
+
+            if batch:
+                return batch
+
+            self.condition.wait(delay)
+
+        return []
+
+    def _write_batch(self, fd, batch):
+        data = memoryview(b''.join(command.data for command in batch))
+        written = 0
+        end = 0
+
+        for command in batch:
+            end += len(command.data)
+
+            while written < end:
+                if self.closed:
+                    return
+
+                try:
+                    _, writable, _ = select.select([], [fd], [], WRITE_POLL_INTERVAL_SEC)
+                except (OSError, select.error) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if not writable:
+                    continue
+
+                try:
+                    written += os.write(fd, data[written:])
+                except (IOError, OSError) as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+            command._finish()
@@ -0,0 +1,830 @@
+from __future__ import absolute_import
+
+import bisect
+import collections
+import errno
+import gzip
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.log'
+COMPRESSED_SUFFIX = '.log.gz'
+INDEX_SUFFIX = '.idx'
+TOKEN_SUFFIX = '.tok'
+
+# bytes of console output between two entries of the sparse index
+INDEX_INTERVAL = 65536
+
+# (time, byte offset) of an index entry
+INDEX_ENTRY = struct.Struct('<dQ')
+
+FLUSH_INTERVAL_SEC = 1
+MAINTENANCE_INTERVAL_SEC = 60
+
+COMPRESSION_LEVEL = 6
+READ_CHUNK_SIZE = 1048576
+
+# words of console lines, matched case insensitively
+TOKEN_RE = re.compile(br'\w+')
+MAX_TOKEN_LENGTH = 64
+
+# what a search worker needs to know about a segment, which can be pickled
+SegmentSnapshot = collections.namedtuple('SegmentSnapshot', [
+    'path', 'compressed', 'size', 'index', 'tokens_path', 'blocks'
+])
+
+
+def _segment_name(start):
+    return '%013d' % int(start * 1000)
+
+
+def _format_record(when, line):
+    return ('%.3f ' % when).encode('ascii') + line + b'\n'
+
+
+def _parse_record(record):
+    when, _, line = record.rstrip(b'\n').partition(b' ')
+
+    try:
+        return float(when), line
+    except ValueError:
+        return None, None
+
+
+def _read_index(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            logger.warning('Could not read console log index %s: %s', path, e)
+        return []
+
+    return _parse_index(data)
+
+
+def _parse_index(data):
+    # a partially written last entry is ignored
+    count = len(data) // INDEX_ENTRY.size
+
+    return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def tokenize(line):
+    """
+    Return the set of lowercase words in a console line.
+    """
+    return set(token.lower() for token in TOKEN_RE.findall(line) if len(token) <= MAX_TOKEN_LENGTH)
+
+
+def write_token_index(path, postings):
+    """
+    Write the blocks of a segment each token occurs in to a token index file,
+    with one line per token in sorted order.
+    """
+    temp_path = path + '.tmp'
+
+    with open(temp_path, 'wb') as f:
+        for token in sorted(postings):
+            f.write(token + b' ' + b','.join(str(block).encode('ascii') for block in sorted(postings[token])) + b'\n')
+
+    os.rename(temp_path, path)
+
+
+def lookup_tokens(path, tokens):
+    """
+    Return the set of blocks of a segment in which all of ``tokens`` occur,
+    according to its token index file, or None if it has none. The file is
+    binary searched, so a lookup only reads a few pages of it.
+    """
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+    with f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # empty
+            return set()
+
+        try:
+            blocks = None
+
+            for token in tokens:
+                found = _find_postings(data, token)
+                blocks = found if blocks is None else blocks & found
+
+                if not blocks:
+                    break
+
+            return blocks if blocks is not None else set()
+        finally:
+            data.close()
+
+
+def _find_postings(data, token):
+    # lines before low have smaller tokens, lines from high on have larger or equal ones
+    low, high = 0, len(data)
+
+    while low < high:
+        middle = (low + high) // 2
+        start = data.rfind(b'\n', 0, middle) + 1
+        end = data.find(b'\n', start)
+
+        if data[start:data.find(b' ', start, end)] < token:
+            low = end + 1
+        else:
+            high = start
+
+    end = data.find(b'\n', low)
+    if end < 0:
+        return set()
+
+    found, _, blocks = data[low:end].partition(b' ')
+    if found != token:
+        return set()
+
+    return set(int(block) for block in blocks.split(b','))
+
+
+def search_segments(segments, terms, since=None, until=None, limit=None):
+    """
+    Return the (time, line) of the lines of the given SegmentSnapshots that
+    contain all of ``terms`` as whole words, case insensitively, written
+    between ``since`` and ``until``, up to ``limit`` lines.
+
+    Only the blocks of a segment in which all words of the terms occur are
+    read, according to the ``blocks`` of the snapshot or else its token index
+    file. Segments without a token index are read completely. This runs in
+    search worker processes, so it must not log.
+    """
+    terms = [term.encode('utf8').lower() for term in terms]
+
+    tokens = set()
+    for term in terms:
+        tokens |= tokenize(term)
+
+    matches = []
+
+    for segment in segments:
+        blocks = segment.blocks
+        if blocks is None and tokens:
+            blocks = lookup_tokens(segment.tokens_path, tokens)
+        if blocks is None:
+            blocks = range(max(len(segment.index), 1))
+
+        f, segment, blocks = _open_snapshot(segment, blocks)
+        if f is None:
+            # expired meanwhile
+            continue
+
+        with f:
+            for block in sorted(blocks):
+                index = segment.index
+
+                if since is not None and block + 1 < len(index) and index[block + 1][0] < since:
+                    continue
+                if until is not None and block < len(index) and index[block][0] > until:
+                    break
+
+                for record in _read_block(f, segment, block).splitlines():
+                    when, line = _parse_record(record)
+                    if when is None:
+                        continue
+
+                    if since is not None and when < since or until is not None and when > until:
+                        continue
+
+                    lowered = line.lower()
+                    if all(term in lowered for term in terms) and tokens <= tokenize(lowered):
+                        matches.append((when, line))
+
+                        if limit and len(matches) >= limit:
+                            return matches
+
+    return matches
+
+
+def _open_snapshot(segment, blocks):
+    """
+    Open the file of a SegmentSnapshot. If the segment was compressed since
+    the snapshot was taken, the compressed file is opened instead, and the
+    snapshot and ``blocks`` are translated to its index. Returns the file,
+    snapshot and blocks, or Nones if the segment expired.
+    """
+    try:
+        return open(segment.path, 'rb'), segment, blocks
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    if segment.compressed:
+        return None, None, None
+
+    path = segment.path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SUFFIX
+
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None, None, None
+
+    # the index is renamed into place before the compressed file
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as index_file:
+            index = _parse_index(index_file.read())
+    except (IOError, OSError) as e:
+        f.close()
+        if e.errno != errno.ENOENT:
+            raise
+        return None, None, None
+
+    if len(index) != len(segment.index):
+        # an entry for the start of the file was added in front
+        blocks = set([0]) | set(block + 1 for block in blocks)
+
+    size = os.fstat(f.fileno()).st_size
+
+    return f, SegmentSnapshot(path, True, size, index, segment.tokens_path, None), blocks
+
+
+def _read_block(f, segment, block):
+    index = segment.index
+
+    start = index[block][1] if index else 0
+    end = index[block + 1][1] if block + 1 < len(index) else segment.size
+
+    f.seek(start)
+    data = f.read(end - start)
+
+    if segment.compressed:
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+
+    return data
+
+
+def _find_offset(index, since):
+    # offset of the last indexed line written before since
+    position = bisect.bisect_left([when for when, _ in index], since)
+
+    return index[position - 1][1] if position else 0
+
+
+def _read_limited(f, limit):
+    for record in f:
+        limit -= len(record)
+        if limit < 0:
+            break
+
+        yield record
+
+
+class Segment(object):
+
+    """
+    A single file of console output holding the lines written from ``start``
+    until the start of the next segment, with its sparse index.
+
+    Every line is stored prefixed with the time it was written. The index
+    maps the time of the first line of every ``INDEX_INTERVAL`` bytes to its
+    offset in the file, dividing it into blocks. Compressed segments consist
+    of one gzip member per block, so reading them can start at any block as
+    well. The token index lists the blocks each word of the output occurs in.
+    """
+
+    def __init__(self, directory, start, compressed=False):
+        self.start = start
+        self.compressed = compressed
+
+        suffix = COMPRESSED_SUFFIX if compressed else SEGMENT_SUFFIX
+
+        self.path = os.path.join(directory, _segment_name(start) + suffix)
+        self.index_path = self.path + INDEX_SUFFIX
+
+        # the token index covers both the uncompressed and compressed file
+        self.tokens_path = os.path.join(directory, _segment_name(start) + TOKEN_SUFFIX)
+
+        self.size = 0
+        self.index = []
+
+        # blocks each token occurs in, kept in memory while the segment is written
+        self.tokens = None
+
+    def snapshot(self, blocks=None):
+        return SegmentSnapshot(self.path, self.compressed, self.size, list(self.index), self.tokens_path, blocks)
+
+
+class ConsoleLog(object):
+
+    """
+    Persistent store of the console output of a server in the directory
+    ``path``.
+
+    Lines are queued by ``append`` and written to disk in batches by
+    ``flush``, so a slow disk never holds up draining the console of the
+    server. They are stored in append-only segment files of about
+    ``segment_size`` bytes, each with a sparse time to offset index, so
+    reading a time range only reads the segments and byte ranges covering it.
+
+    ``maintain`` compresses sealed segments and deletes the oldest ones once
+    the log takes more than ``max_size`` bytes or they are older than
+    ``max_age`` seconds. It is called from a single thread.
+
+    Every segment has a token index listing the blocks each word occurs in,
+    built while the segment is written and stored once it is sealed, so a
+    search only reads the blocks that can contain a match.
+    """
+
+    def __init__(self, path, segment_size, max_size, max_age, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.index_interval = index_interval
+
+        self.segments = []
+        self.active = None
+        self.active_file = None
+        self.index_file = None
+        self.pending = []
+
+        # guards the pending lines and the segments
+        self.lock = threading.Lock()
+
+        # serializes writing to the active segment
+        self.write_lock = threading.Lock()
+
+    def load(self):
+        """
+        Find the segments written before. They are all sealed, new output is
+        written to a new segment.
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning('Could not read console log %s: %s', self.path, e)
+            return
+
+        segments = {}
+
+        for name in names:
+            base, _, suffix = name.partition('.')
+            if not base.isdigit() or '.' + suffix not in (SEGMENT_SUFFIX, COMPRESSED_SUFFIX):
+                continue
+
+            segment = Segment(self.path, int(base) / 1000.0, compressed='.' + suffix == COMPRESSED_SUFFIX)
+
+            # left over if compressing a segment was interrupted before deleting it
+            stale = segments.get(base) if segment.compressed else segment
+            if base in segments and stale:
+                _remove(stale.path)
+                _remove(stale.index_path)
+
+                if not segment.compressed:
+                    continue
+
+            try:
+                segment.size = os.path.getsize(segment.path)
+            except OSError:
+                continue
+
+            segment.index = _read_index(segment.index_path)
+            segments[base] = segment
+
+        with self.lock:
+            self.segments = sorted(segments.values(), key=lambda segment: segment.start)
+
+    def append(self, line, when):
+        """
+        Queue a console line written at ``when`` to be stored.
+        """
+        with self.lock:
+            self.pending.append((when, line))
+
+    def flush(self):
+        """
+        Write the queued lines to the active segment, starting a new segment
+        whenever it reached ``segment_size``.
+        """
+        with self.write_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+
+            if not pending:
+                return
+
+            active = self.active
+            size = active.size if active else 0
+            last_indexed = active.index[-1][1] if active and active.index else None
+            block = len(active.index) - 1 if active else -1
+
+            records = []
+            entries = []
+            tokens = []
+
+            try:
+                for when, line in pending:
+                    if self.active is None or size >= self.segment_size:
+                        self._write(records, entries, tokens)
+                        records = []
+                        entries = []
+                        tokens = []
+
+                        self._start_segment(when)
+                        size = 0
+                        last_indexed = None
+                        block = -1
+
+                    if last_indexed is None or size - last_indexed >= self.index_interval:
+                        entries.append((when, size))
+                        last_indexed = size
+                        block += 1
+
+                    record = _format_record(when, line)
+                    records.append(record)
+                    tokens.append((block, tokenize(line)))
+                    size += len(record)
+
+                self._write(records, entries, tokens)
+            except (IOError, OSError):
+                # the segment may be partially written, so output goes to a new one
+                self._close_active()
+                raise
+
+    def _start_segment(self, when):
+        self._close_active()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        segment = Segment(self.path, when)
+        while any(os.path.exists(s.path) for s in (segment, Segment(self.path, segment.start, compressed=True))):
+            segment = Segment(self.path, segment.start + 0.001)
+
+        self.active_file = open(segment.path, 'ab')
+        self.index_file = open(segment.index_path, 'ab')
+
+        segment.tokens = {}
+
+        with self.lock:
+            self.segments.append(segment)
+            self.active = segment
+
+    def _write(self, records, entries, tokens):
+        if not records:
+            return
+
+        data = b''.join(records)
+
+        self.active_file.write(data)
+        self.active_file.flush()
+
+        self.index_file.write(b''.join(INDEX_ENTRY.pack(when, offset) for when, offset in entries))
+        self.index_file.flush()
+
+        # only published once written, so readers never read past the data on disk
+        with self.lock:
+            self.active.size += len(data)
+            self.active.index = self.active.index + entries
+
+            postings = self.active.tokens
+            for block, line_tokens in tokens:
+                for token in line_tokens:
+                    postings.setdefault(token, set()).add(block)
+
+    def _close_active(self):
+        for f in (self.active_file, self.index_file):
+            if f:
+                f.close()
+
+        self.active_file = None
+        self.index_file = None
+
+        with self.lock:
+            segment = self.active
+            self.active = None
+
+        if segment is None:
+            return
+
+        try:
+            write_token_index(segment.tokens_path, segment.tokens)
+        except (IOError, OSError) as e:
+            # built again from the segment by maintain
+            logger.warning('Could not write console log token index %s: %s', segment.tokens_path, e)
+        finally:
+            segment.tokens = None
+
+    def close(self):
+        """
+        Write the queued lines and seal the active segment.
+        """
+        self.flush()
+
+        with self.write_lock:
+            self._close_active()
+
+    def get_size(self):
+        with self.lock:
+            return sum(segment.size for segment in self.segments)
+
+    def read(self, since=None, until=None):
+        """
+        Yield the (time, line) of every stored console line written between
+        ``since`` and ``until``, in the order they were written.
+        """
+        with self.lock:
+            segments = list(self.segments)
+
+        for i, segment in enumerate(segments):
+            if since is not None and i + 1 < len(segments) and segments[i + 1].start < since:
+                continue
+
+            if until is not None and segment.start > until:
+                break
+
+            for when, line in self._read_segment(segment, since):
+                if since is not None and when < since:
+                    continue
+
+                if until is not None and when > until:
+                    return
+
+                yield when, line
+
+    def _read_segment(self, segment, since):
+        with self.lock:
+            size = segment.size
+            index = segment.index
+
+        try:
+            f = open(segment.path, 'rb')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+            # compressed or expired meanwhile
+            current = self._get_segment(segment.start)
+            if not current or current is segment:
+                return
+
+            for record in self._read_segment(current, since):
+                yield record
+            return
+
+        with f:
+            offset = _find_offset(index, since) if since is not None else 0
+            f.seek(offset)
+
+            if segment.compressed:
+                records = gzip.GzipFile(fileobj=f, mode='rb')
+            else:
+                records = _read_limited(f, size - offset)
+
+            for record in records:
+                when, line = _parse_record(record)
+                if when is not None:
+                    yield when, line
+
+    def get_search_snapshots(self, terms, since=None, until=None):
+        """
+        Return SegmentSnapshots of the segments holding output written between
+        ``since`` and ``until``, to be searched for ``terms`` with
+        ``search_segments``. The blocks to read from the active segment are
+        looked up in its in-memory token index right away.
+        """
+        tokens = set()
+        for term in terms:
+            tokens |= tokenize(term.encode('utf8'))
+
+        snapshots = []
+
+        with self.lock:
+            segments = list(self.segments)
+
+            for i, segment in enumerate(segments):
+                if since is not None and i + 1 < len(segments) and segments[i + 1].start < since:
+                    continue
+                if until is not None and segment.start > until:
+                    break
+
+                blocks = None
+                if segment.tokens is not None and tokens:
+                    blocks = set(range(len(segment.index)))
+                    for token in tokens:
+                        blocks &= segment.tokens.get(token, set())
+
+                snapshots.append(segment.snapshot(blocks))
+
+        return snapshots
+
+    def search(self, terms, since=None, until=None, limit=None):
+        """
+        Return the (time, line) of stored console lines containing all of
+        ``terms`` written between ``since`` and ``until``.
+        """
+        return search_segments(self.get_search_snapshots(terms, since, until), terms, since, until, limit)
+
+    def _get_segment(self, start):
+        with self.lock:
+            for segment in self.segments:
+                if segment.start == start:
+                    return segment
+
+        return None
+
+    def maintain(self, now=None):
+        """
+        Compress sealed segments and delete expired ones.
+        """
+        now = now or time.time()
+
+        with self.lock:
+            sealed = [segment for segment in self.segments if segment is not self.active and not segment.compressed]
+
+        for segment in sealed:
+            try:
+                self._compress(segment)
+            except (IOError, OSError) as e:
+                logger.warning('Could not compress console log segment %s: %s', segment.path, e)
+
+        with self.lock:
+            unindexed = [
+                segment for segment in self.segments
+                if segment is not self.active and not os.path.exists(segment.tokens_path)
+            ]
+
+        for segment in unindexed:
+            try:
+                self._build_token_index(segment)
+            except (IOError, OSError, zlib.error) as e:
+                logger.warning('Could not index console log segment %s: %s', segment.path, e)
+
+        self._expire(now)
+
+    def _build_token_index(self, segment):
+        # for segments sealed without writing their token index, such as when mcrunnerd was killed
+        postings = {}
+        snapshot = segment.snapshot()
+
+        with open(segment.path, 'rb') as f:
+            for block in range(max(len(snapshot.index), 1)):
+                for record in _read_block(f, snapshot, block).splitlines():
+                    for token in tokenize(record.partition(b' ')[2]):
+                        postings.setdefault(token, set()).add(block)
+
+        write_token_index(segment.tokens_path, postings)
+
+    def _compress(self, segment):
+        compressed = Segment(self.path, segment.start, compressed=True)
+
+        entries = list(segment.index)
+        if not entries or entries[0][1] != 0:
+            entries.insert(0, (segment.start, 0))
+
+        temp_path = compressed.path + '.tmp'
+        temp_index_path = compressed.index_path + '.tmp'
+
+        with open(segment.path, 'rb') as source, open(temp_path, 'wb') as target:
+            for i, (when, offset) in enumerate(entries):
+                end = entries[i + 1][1] if i + 1 < len(entries) else segment.size
+
+                compressed.index.append((when, target.tell()))
+
+                # every indexed block is a gzip member of its own
+                compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+                source.seek(offset)
+                remaining = end - offset
+
+                while remaining > 0:
+                    data = source.read(min(remaining, READ_CHUNK_SIZE))
+                    if not data:
+                        break
+
+                    target.write(compressor.compress(data))
+                    remaining -= len(data)
+
+                target.write(compressor.flush())
+
+            compressed.size = target.tell()
+
+        with open(temp_index_path, 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(when, offset) for when, offset in compressed.index))
+
+        os.rename(temp_index_path, compressed.index_path)
+        os.rename(temp_path, compressed.path)
+
+        with self.lock:
+            self.segments = [compressed if s is segment else s for s in self.segments]
+
+        _remove(segment.path)
+        _remove(segment.index_path)
+
+    def _expire(self, now):
+        with self.lock:
+            segments = list(self.segments)
+            active = self.active
+
+        total = sum(segment.size for segment in segments)
+        expired = []
+
+        # the newest segment is always kept
+        for i, segment in enumerate(segments[:-1]):
+            if segment is active:
+                break
+
+            too_old = self.max_age and segments[i + 1].start < now - self.max_age
+            too_large = self.max_size and total > self.max_size
+            if not too_old and not too_large:
+                break
+
+            expired.append(segment)
+            total -= segment.size
+
+        if not expired:
+            return
+
+        with self.lock:
+            self.segments = [segment for segment in self.segments if segment not in expired]
+
+        for segment in expired:
+            logger.debug('Deleting console log segment %s', segment.path)
+
+            _remove(segment.path)
+            _remove(segment.index_path)
+            _remove(segment.tokens_path)
+
+
+class ConsoleLogWriter(threading.Thread):
+
+    """
+    Thread that writes the queued console output of every server with a
+    console log to disk each ``interval`` seconds, and compresses and expires
+    old segments every ``MAINTENANCE_INTERVAL_SEC`` seconds.
+    """
+
+    def __init__(self, servers, interval=FLUSH_INTERVAL_SEC):
+        super(ConsoleLogWriter, self).__init__()
+        self.daemon = True
+
+        self.servers = servers
+        self.interval = interval
+
+        self.stopped = threading.Event()
+
+    def run(self):
+        maintained_at = 0
+
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+            if time.time() - maintained_at >= MAINTENANCE_INTERVAL_SEC:
+                maintained_at = time.time()
+                self.maintain()
+
+    def stop(self):
+        self.stopped.set()
+
+    def flush(self):
+        for server in self.servers.values():
+            if not server.console_log:
+                continue
+
+            try:
+                server.console_log.flush()
+            except (IOError, OSError) as e:
+                logger.warning('Could not write console log of Minecraft server "%s": %s', server.name, e)
+
+    def maintain(self):
+        for server in self.servers.values():
+            if not server.console_log:
+                continue
+
+            try:
+                server.console_log.maintain()
+            except Exception:
+                logger.exception('Error maintaining console log of Minecraft server "%s"', server.name)
@@ -153,9 +153,10 @@ class Daemon(object):
         self.daemonize()
         self.run(*args, **kwargs)
 
-    def stop(self):
+    def stop(self, timeout=None):
         """
-        Stop the daemon
+        Stop the daemon, waiting up to timeout seconds (or forever if None)
+        for it to exit
         """
 
         if self.verbose >= 1:
@@ -175,15 +176,15 @@ class Daemon(object):
 
             return  # Not an error in a restart
 
-        # Try killing the daemon process
+        # Signal the daemon once, it may take a while to shut down cleanly
+        # and further signals would interrupt that
         try:
-            i = 0
-            while 1:
-                os.kill(pid, signal.SIGTERM)
+            os.kill(pid, signal.SIGTERM)
+
+            deadline = None if timeout is None else time.time() + timeout
+            while deadline is None or time.time() < deadline:
                 time.sleep(0.1)
-                i = i + 1
-                if i % 10 == 0:
-                    os.kill(pid, signal.SIGHUP)
+                os.kill(pid, 0)
         except OSError:
             err = str(sys.exc_info()[1])
             if err.find("No such process") > 0:
@@ -192,6 +193,10 @@ class Daemon(object):
             else:
                 print(err)
                 sys.exit(1)
+        else:
+            message = "Process (pid %d) did not exit within %d seconds\n"
+            sys.stderr.write(message % (pid, timeout))
+            sys.exit(1)
 
         if self.verbose >= 1:
             print("Stopped")
@@ -0,0 +1,204 @@
+from __future__ import absolute_import
+
+import collections
+import re
+import threading
+
+# number of events remembered per server
+EVENT_HISTORY_SIZE = 1000
+
+# lines of a stack trace kept in its event, the rest are only counted
+MAX_TRACE_LINES = 100
+
+JOIN = 'join'
+LEAVE = 'leave'
+CHAT = 'chat'
+LAG = 'lag'
+READY = 'ready'
+EXCEPTION = 'exception'
+PLUGIN_ENABLE = 'plugin_enable'
+PLUGIN_DISABLE = 'plugin_disable'
+
+EVENT_TYPES = (JOIN, LEAVE, CHAT, LAG, READY, EXCEPTION, PLUGIN_ENABLE, PLUGIN_DISABLE)
+
+ConsoleEvent = collections.namedtuple('ConsoleEvent', ['time', 'type', 'data', 'lines'])
+
+# A pattern is only matched against a message that starts with ``prefix`` and
+# contains ``needle``, both optional, so most lines are ruled out by a few
+# substring checks without running a regular expression.
+EventPattern = collections.namedtuple('EventPattern', ['type', 'prefix', 'needle', 'regex'])
+
+# in order of how often they show up in the console
+EVENT_PATTERNS = (
+    EventPattern(
+        CHAT, (b'<', b'[Not Secure] <'), None, re.compile(br'^(?:\[Not Secure\] )?<(?P<player>[^>]+)> (?P<message>.*)$')
+    ),
+    EventPattern(JOIN, None, b' joined the game', re.compile(br'^(?P<player>\S+) joined the game')),
+    EventPattern(LEAVE, None, b' left the game', re.compile(br'^(?P<player>\S+) left the game')),
+    EventPattern(LAG, None, b"Can't keep up!", re.compile(br'Running (?P<ms>\d+)ms(?: or (?P<ticks>\d+) ticks)?')),
+    EventPattern(
+        PLUGIN_ENABLE, b'[', b'] Enabling ',
+        re.compile(br'^\[(?P<plugin>[^\]]+)\] Enabling \S+(?: v(?P<version>\S+))?')
+    ),
+    EventPattern(
+        PLUGIN_DISABLE, b'[', b'] Disabling ',
+        re.compile(br'^\[(?P<plugin>[^\]]+)\] Disabling \S+(?: v(?P<version>\S+))?')
+    ),
+    EventPattern(READY, b'Done (', None, re.compile(br'^Done \((?P<seconds>[0-9.,]+)s\)!')),
+)
+
+# first line of a stack trace, such as "java.lang.IllegalStateException: message"
+EXCEPTION_RE = re.compile(
+    br'^(?:Exception in thread "[^"]*" )?'
+    br'(?P<exception>(?:[A-Za-z_$][\w$]*\.)+[\w$]*(?:Exception|Error|Throwable))(?:: (?P<message>.*))?$'
+)
+
+# following lines of a stack trace
+TRACE_PREFIXES = (b'\tat ', b'\t... ', b'Caused by: ', b'\tSuppressed: ', b'    at ')
+
+INT_FIELDS = ('ms', 'ticks')
+FLOAT_FIELDS = ('seconds',)
+
+NO_EVENTS = ()
+
+
+def get_message(line):
+    """
+    Strip the time and log level prefix from a console line, such as
+    ``[12:00:00 INFO]: `` or ``[12:00:00] [Server thread/INFO]: ``.
+    """
+    if line[:1] != b'[':
+        return line
+
+    end = line.find(b']: ')
+
+    return line[end + 3:] if end >= 0 else line
+
+
+def _convert_fields(fields):
+    data = {}
+
+    for key, value in fields.items():
+        if value is None:
+            data[key] = None
+        elif key in INT_FIELDS:
+            data[key] = int(value)
+        elif key in FLOAT_FIELDS:
+            data[key] = float(value.replace(b',', b'.'))
+        else:
+            data[key] = value.decode('utf8', 'replace')
+
+    return data
+
+
+class ConsoleEventParser(object):
+
+    """
+    Turns the console lines of a server into ConsoleEvents.
+
+    Every line is checked against ``EVENT_PATTERNS`` in order, and the first
+    matching pattern makes the event. The lines of a stack trace are folded
+    into a single ``exception`` event, which is emitted once a line that
+    doesn't belong to it is parsed, or by ``flush``.
+    """
+
+    def __init__(self, patterns=EVENT_PATTERNS, max_trace_lines=MAX_TRACE_LINES):
+        self.patterns = patterns
+        self.max_trace_lines = max_trace_lines
+
+        # time, data and lines of the stack trace being folded
+        self.trace = None
+
+    def parse(self, line, when):
+        """
+        Parse a console line written at ``when``. Returns a sequence of the
+        events it completed.
+        """
+        message = get_message(line)
+
+        events = NO_EVENTS
+
+        if self.trace is not None:
+            if message.startswith(TRACE_PREFIXES):
+                self._fold(line)
+                return NO_EVENTS
+
+            events = [self.flush()]
+
+        if b'Exception' in message or b'Error' in message or b'Throwable' in message:
+            match = EXCEPTION_RE.match(message)
+            if match:
+                data = _convert_fields(match.groupdict())
+                data['omitted_lines'] = 0
+
+                self.trace = (when, data, [line])
+                return events
+
+        for pattern in self.patterns:
+            if pattern.prefix and not message.startswith(pattern.prefix):
+                continue
+            if pattern.needle and pattern.needle not in message:
+                continue
+
+            match = pattern.regex.search(message)
+            if match:
+                event = ConsoleEvent(when, pattern.type, _convert_fields(match.groupdict()), [line])
+                return list(events) + [event]
+
+        return events
+
+    def _fold(self, line):
+        _, data, lines = self.trace
+
+        if len(lines) < self.max_trace_lines:
+            lines.append(line)
+        else:
+            data['omitted_lines'] += 1
+
+    def flush(self):
+        """
+        Return the event of the stack trace being folded, if any.
+        """
+        if self.trace is None:
+            return None
+
+        when, data, lines = self.trace
+        self.trace = None
+
+        return ConsoleEvent(when, EXCEPTION, data, lines)
+
+
+class EventCounters(object):
+
+    """
+    Counts of the console events of a server by type, with the most recent
+    ``history`` events.
+    """
+
+    def __init__(self, history=EVENT_HISTORY_SIZE):
+        self.counts = dict((event_type, 0) for event_type in EVENT_TYPES)
+        self.recent = collections.deque(maxlen=history)
+
+        self.lock = threading.Lock()
+
+    def add(self, event):
+        with self.lock:
+            self.counts[event.type] = self.counts.get(event.type, 0) + 1
+            self.recent.append(event)
+
+    def get_counts(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def get_recent(self, types=None, count=None):
+        """
+        Return the most recent events, oldest first, optionally only those of
+        the given types.
+        """
+        with self.lock:
+            events = list(self.recent)
+
+        if types:
+            events = [event for event in events if event.type in types]
+
+        return events[-count:] if count else events
@@ -13,5 +13,24 @@ class ServerStartException(MCRunnerException):
     pass
 
 
+class ServerAlreadyRunningException(ServerStartException):
+    pass
+
+
 class ServerNotRunningException(MCRunnerException):
     pass
+
+
+class CommandQueueFullException(MCRunnerException):
+    pass
+
+
+class CommandNotDeliveredException(MCRunnerException):
+    pass
+
+
+class ProtocolException(MCRunnerException):
+
+    def __init__(self, message, request_id=None):
+        super(ProtocolException, self).__init__(message)
+        self.request_id = request_id
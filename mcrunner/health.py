@@ -0,0 +1,212 @@
+from __future__ import absolute_import
+
+import collections
+import logging
+import signal
+import threading
+import time
+
+from mcrunner.exceptions import MCRunnerException
+from mcrunner.server_status import ServerStatus
+
+logger = logging.getLogger(__name__)
+
+# health score penalties of the individual signals, out of 100
+SILENCE_PENALTY = 25
+PROBE_PENALTY = 40
+CPU_STALLED_PENALTY = 20
+LAG_WARNING_PENALTY = 5
+MAX_LAG_PENALTY = 30
+
+LAG_WINDOW_SEC = 300
+CPU_WINDOW_SEC = 60
+CPU_STALLED_PERCENT = 1.0
+
+# time given to the JVM to write its thread dump after SIGQUIT
+THREAD_DUMP_WAIT_SEC = 2
+
+HealthReport = collections.namedtuple('HealthReport', ['time', 'score', 'problems'])
+
+
+class ServerHealth(object):
+
+    """
+    Health check state of a single server.
+    """
+
+    def __init__(self):
+        self.report = None
+        self.probe_sent_at = None
+        self.recovering = False
+        self.diagnostics_at = None
+        self.diagnostics = []
+
+
+class HealthWatchdog(threading.Thread):
+
+    """
+    Thread that checks the health of running servers with ``health_check``
+    enabled every ``interval`` seconds.
+
+    Every check scores a server from 100 down, taking off points for console
+    silence, an unanswered probe command, a stalled process according to the
+    resource sampler and recent "Can't keep up!" lag warnings. A server
+    scoring ``health_threshold`` or less is considered hung: a thread dump is
+    captured from its console with SIGQUIT and it is restarted with
+    ``restart_handler(name)``.
+    """
+
+    def __init__(self, servers, sampler, interval, restart_handler):
+        super(HealthWatchdog, self).__init__()
+        self.daemon = True
+
+        self.servers = servers
+        self.sampler = sampler
+        self.interval = interval
+        self.restart_handler = restart_handler
+
+        self.health = dict((name, ServerHealth()) for name in servers)
+
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Error checking server health')
+
+    def stop(self):
+        self.stopped.set()
+
+    def check(self):
+        """
+        Check every running server once, starting recovery of hung servers.
+        """
+        now = time.time()
+
+        for name, server in self.servers.items():
+            health = self.health[name]
+
+            if not server.health_check or health.recovering:
+                continue
+
+            if server.get_status() != ServerStatus.RUNNING:
+                health.report = None
+                health.probe_sent_at = None
+                continue
+
+            health.report = self.check_server(server, health, now)
+
+            if health.report.score <= server.health_threshold:
+                health.recovering = True
+
+                thread = threading.Thread(target=self.recover, args=(server, health))
+                thread.daemon = True
+                thread.start()
+
+    def check_server(self, server, health, now):
+        """
+        Score the health of a running server and send it a probe command if
+        its console has been silent for ``probe_interval`` seconds. Returns a
+        HealthReport.
+        """
+        score = 100
+        problems = []
+
+        last_output_at = max(server.last_output_at or 0, server.launched_at or 0)
+        silence = now - last_output_at
+
+        if silence >= server.health_silence:
+            score -= SILENCE_PENALTY
+            problems.append('no console output for %d seconds' % silence)
+
+        if health.probe_sent_at is not None and last_output_at > health.probe_sent_at:
+            health.probe_sent_at = None
+
+        if health.probe_sent_at is not None:
+            waited = now - health.probe_sent_at
+            if waited >= server.probe_timeout:
+                score -= PROBE_PENALTY
+                problems.append('no response to "%s" for %d seconds' % (server.probe_command, waited))
+        elif silence >= server.probe_interval:
+            try:
+                server.run_command(server.probe_command, wait=False, priority=True)
+            except MCRunnerException as e:
+                logger.debug('Could not send health probe to Minecraft server "%s": %r', server.name, e)
+            else:
+                health.probe_sent_at = now
+
+        cpu_percent = self._get_cpu_percent(server.name, now)
+        if cpu_percent is not None and cpu_percent < CPU_STALLED_PERCENT:
+            score -= CPU_STALLED_PENALTY
+            problems.append('%.1f%% cpu usage' % cpu_percent)
+
+        lag_warnings = [ms for warned_at, ms in list(server.lag_warnings) if warned_at >= now - LAG_WINDOW_SEC]
+        if lag_warnings:
+            score -= min(len(lag_warnings) * LAG_WARNING_PENALTY, MAX_LAG_PENALTY)
+            problems.append('%d lag warnings, up to %dms behind' % (len(lag_warnings), max(lag_warnings)))
+
+        return HealthReport(now, max(score, 0), problems)
+
+    def _get_cpu_percent(self, name, now):
+        # needs two samples of the same process within the window
+        samples = self.sampler.series[name].get_samples(since=now - CPU_WINDOW_SEC)
+        if len(samples) < 2:
+            return None
+
+        first, last = samples[0], samples[-1]
+        if last.cpu_time < first.cpu_time or last.time <= first.time:
+            return None
+
+        return (last.cpu_time - first.cpu_time) / (last.time - first.time) * 100
+
+    def recover(self, server, health):
+        """
+        Capture diagnostics of a hung server and restart it.
+        """
+        report = health.report
+
+        logger.error(
+            'Minecraft server "%s" is unhealthy (score %d: %s), restarting',
+            server.name, report.score, ', '.join(report.problems)
+        )
+
+        try:
+            health.diagnostics = self.capture_thread_dump(server)
+            health.diagnostics_at = time.time()
+
+            if health.diagnostics:
+                logger.warning(
+                    'Thread dump of Minecraft server "%s":\n%s',
+                    server.name, '\n'.join(line.decode('utf8', 'replace') for line in health.diagnostics)
+                )
+
+            self.restart_handler(server.name)
+        except Exception:
+            logger.exception('Error recovering Minecraft server "%s"', server.name)
+        finally:
+            health.report = None
+            health.probe_sent_at = None
+            health.recovering = False
+
+    def capture_thread_dump(self, server):
+        """
+        Send SIGQUIT to the server process, which makes the JVM write a thread
+        dump to its output, and return the console lines written meanwhile.
+        """
+        pipe = server.pipe
+        if not pipe:
+            return []
+
+        line_count = server.output.line_count
+
+        try:
+            pipe.send_signal(signal.SIGQUIT)
+        except OSError as e:
+            logger.warning('Could not request thread dump of Minecraft server "%s": %s', server.name, e)
+            return []
+
+        time.sleep(THREAD_DUMP_WAIT_SEC)
+
+        return server.output.get_lines(server.output.line_count - line_count)
@@ -8,11 +8,26 @@ except ImportError:
     # Python 3.x
     import configparser
 
+import json
+import os
+import re
+import select
 import socket
 import sys
 
 from mcrunner.connection import ClientSocketConnection
-from mcrunner.mcrunnerd import MCRUNNERD_COMMAND_DELIMITER
+from mcrunner.protocol import RESPONSE_DATA, RESPONSE_END, RESPONSE_MESSAGE, ResponseStatus, TAIL_DEFAULT_LINES
+
+GLOB_RE = re.compile(r'[*?[]')
+DURATION_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhdw]?)$')
+DURATION_UNITS = {
+    '': 1,
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+}
 
 
 class Controller(object):
@@ -25,6 +40,8 @@ class Controller(object):
     sock_file = None
     attached = False
     screen = None
+    json_output = False
+    label_lines = False
 
     def __init__(self, *args, **kwargs):
         self.config_file = kwargs.get('config_file', '/etc/mcrunner/mcrunner.conf')
@@ -51,56 +68,303 @@ class Controller(object):
             if section == 'mcrunner':
                 self.sock_file = config.get(section, 'url')
 
-    def send_mcrunnerd_package(self, package):
+    def connect(self):
         """
-        Send a mcrunnerd package to the mcrunnerd unix socket.
+        Connect to mcrunnerd, returning a client connection or None if the
+        socket could not be reached.
         """
         try:
             sock = self.socket_client()
         except socket.error:
             _output('Could not connect to socket - is mcrunnerd running?')
-            return
+            return None
+
+        return ClientSocketConnection(sock)
 
-        connection = ClientSocketConnection(sock)
+    def send_request(self, action, **args):
+        """
+        Send a single request to mcrunnerd and print its responses as they
+        arrive. Returns the final ResponseStatus of the request, or None if the
+        request did not complete.
+        """
+        connection = self.connect()
+        if not connection:
+            return None
+
+        status = None
 
         try:
-            connection.send_message(package)
+            connection.send_request(action, **args)
         except Exception as e:
-            _output('Error sending mcrunnerd package: %s' % e)
+            _output('Error sending mcrunnerd request: %s' % e)
         else:
-            while True:
-                data = connection.receive_message()
-                if not data:
-                    break
+            try:
+                while True:
+                    response = connection.receive_response()
+                    if not response:
+                        break
+
+                    self.output_response(response)
 
-                _output(data)
+                    if response['type'] == RESPONSE_END:
+                        status = ResponseStatus(response['status'])
+                        break
+            except KeyboardInterrupt:
+                pass
 
         finally:
             connection.close()
 
+        return status
+
+    def output_response(self, response):
+        """
+        Print a response frame, either as raw JSON or in human readable form.
+        """
+        if self.json_output:
+            _output(json.dumps(response, sort_keys=True))
+        elif response['type'] == RESPONSE_MESSAGE:
+            _output(response['message'])
+        elif response['type'] == RESPONSE_DATA:
+            data = response['data']
+
+            # output of several servers is told apart by prefixing the server name
+            prefix = '[%s] ' % data['server'] if self.label_lines and 'server' in data else ''
+
+            for line in data.get('lines', []):
+                _output(prefix + line)
+
+            if data.get('dropped'):
+                _output('[%d lines dropped]' % data['dropped'])
+
     def handle_mcrunnerd_action(self, action):
         """
         Handle simple actions and send to mcrunnerd instance.
         """
-        self.send_mcrunnerd_package('%s' % action)
+        return self.send_request(action)
 
     def handle_server_action(self, action, server, command=None):
         """
         Handle server actions/commands and send to mcrunnerd instance.
         """
+        args = {'server': server}
         if command:
-            self.send_mcrunnerd_package('{action}{delimiter}{server}{delimiter}{command}'.format(
-                action=action,
-                server=server,
-                command=command,
-                delimiter=MCRUNNERD_COMMAND_DELIMITER
-            ))
+            args['command'] = command
+
+        return self.send_request(action, **args)
+
+    def run_command(self, server, command, capture=False, terminator=None, quiet_period=None):
+        """
+        Send a console command to a server, printing its output if ``capture``
+        is true. Output is captured until a line matches the regular
+        expression ``terminator`` or no line was written for ``quiet_period``
+        seconds.
+        """
+        args = {'server': server, 'command': command}
+        if capture:
+            args['capture'] = True
+        if terminator:
+            args['terminator'] = terminator
+        if quiet_period is not None:
+            args['quiet_period'] = quiet_period
+
+        return self.send_request('command', **args)
+
+    def run_commands(self, servers, commands, capture=False, terminator=None, quiet_period=None):
+        """
+        Send a list of console commands to several servers at once. ``servers``
+        can contain server names and glob patterns such as ``lobby-*`` or
+        ``*``. Captured output is printed prefixed with the server name.
+        """
+        args = {'servers': servers, 'commands': commands}
+        if capture:
+            args['capture'] = True
+        if terminator:
+            args['terminator'] = terminator
+        if quiet_period is not None:
+            args['quiet_period'] = quiet_period
+
+        self.label_lines = True
+
+        return self.send_request('command', **args)
+
+    def handle_lifecycle_action(self, action, servers=None, all_servers=False):
+        """
+        Start, stop or restart several servers at once. ``servers`` can contain
+        server names and glob patterns such as ``lobby-*``.
+        """
+        if all_servers:
+            return self.send_request(action, all=True)
+
+        return self.send_request(action, servers=servers)
+
+    def tail_console(self, server, lines=TAIL_DEFAULT_LINES, follow=False):
+        """
+        Print recent console output of a server, optionally following new output.
+        """
+        return self.send_request('tail', server=server, lines=lines, follow=follow)
+
+    def get_stats(self, server, since=None):
+        """
+        Print resource usage of a server, optionally limited to the last
+        ``since`` seconds.
+        """
+        args = {'server': server}
+        if since:
+            args['since'] = since
+
+        return self.send_request('stats', **args)
+
+    def get_logs(self, server, since=None, until=None):
+        """
+        Print the stored console output of a server written between ``since``
+        and ``until`` seconds ago.
+        """
+        args = {'server': server}
+        if since:
+            args['since'] = since
+        if until:
+            args['until'] = until
+
+        return self.send_request('logs', **args)
+
+    def search_logs(self, servers, terms, since=None):
+        """
+        Print the stored console lines of servers containing all of ``terms``,
+        optionally limited to the last ``since`` seconds. ``servers`` can
+        contain server names and glob patterns. Lines are printed prefixed
+        with the server name.
+        """
+        args = {'servers': servers, 'terms': terms}
+        if since:
+            args['since'] = since
+
+        self.label_lines = True
+
+        return self.send_request('grep', **args)
+
+    def get_events(self, server, types=None, count=None):
+        """
+        Print the console event counts of a server and its most recent
+        events, optionally only those of the given types.
+        """
+        args = {'server': server}
+        if types:
+            args['types'] = types
+        if count is not None:
+            args['count'] = count
+
+        return self.send_request('events', **args)
+
+    def get_plugins(self, servers):
+        """
+        Print the plugins of servers and how they changed since each server
+        was started. ``servers`` can contain server names and glob patterns.
+        """
+        return self.send_request('plugins', servers=servers)
+
+    def attach(self, server):
+        """
+        Attach to the console of a server over a single persistent connection.
+        Console output is printed as it arrives and every line typed is sent to
+        the server as a command request pipelined on the same connection.
+        Detach with Ctrl-D or Ctrl-C.
+        """
+        connection = self.connect()
+        if not connection:
+            return None
+
+        stdin_fd = sys.stdin.fileno()
+        pending = b''
+        command_messages = {}
+        status = ResponseStatus.OK
+
+        try:
+            tail_id = connection.send_request('tail', server=server, lines=TAIL_DEFAULT_LINES, follow=True)
+
+            self.attached = True
+
+            while self.attached:
+                if connection.has_buffered_frame():
+                    readable = [connection.sock_conn]
+                else:
+                    readable, _, _ = select.select([connection.sock_conn, stdin_fd], [], [])
+
+                if connection.sock_conn in readable:
+                    response = connection.receive_response()
+                    if not response:
+                        break
+
+                    if response['id'] == tail_id:
+                        self.output_response(response)
+
+                        if response['type'] == RESPONSE_END:
+                            status = ResponseStatus(response['status'])
+                            break
+                    elif response['type'] == RESPONSE_MESSAGE:
+                        command_messages.setdefault(response['id'], []).append(response['message'])
+                    elif response['type'] == RESPONSE_END:
+                        # only report commands that failed, successful ones show up in the console
+                        messages = command_messages.pop(response['id'], [])
+                        if response['status'] != ResponseStatus.OK.value:
+                            for message in messages:
+                                _output(message)
+
+                if stdin_fd in readable:
+                    data = os.read(stdin_fd, 4096)
+                    if not data:
+                        break
+
+                    lines = (pending + data).split(b'\n')
+                    pending = lines.pop()
+
+                    for line in lines:
+                        line = line.strip()
+                        if line:
+                            connection.send_request('command', server=server, command=line.decode('utf8'))
+        except KeyboardInterrupt:
+            pass
+        except socket.error as e:
+            _output('Error communicating with mcrunnerd: %s' % e)
+            status = None
+        finally:
+            self.attached = False
+            connection.close()
+
+        return status
+
+
+def parse_duration(value):
+    """
+    Parse a duration such as ``90``, ``30m``, ``2h`` or ``1d`` into seconds.
+    Returns None if the value is not a valid duration.
+    """
+    match = DURATION_RE.match(value)
+    if not match:
+        return None
+
+    amount, unit = match.groups()
+
+    return float(amount) * DURATION_UNITS[unit]
+
+
+def read_commands(path):
+    """
+    Read console commands from a file, one per line, or from stdin if
+    ``path`` is ``-``. Blank lines and lines starting with ``#`` are skipped.
+    Returns None if the file could not be read.
+    """
+    try:
+        if path == '-':
+            lines = sys.stdin.readlines()
         else:
-            self.send_mcrunnerd_package('{action}{delimiter}{server}'.format(
-                action=action,
-                server=server,
-                delimiter=MCRUNNERD_COMMAND_DELIMITER
-            ))
+            with open(path) as f:
+                lines = f.readlines()
+    except (IOError, OSError) as e:
+        _output('Could not read commands from %s: %s' % (path, e))
+        return None
+
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
 
 
 def _output(string):
@@ -110,35 +374,217 @@ def _output(string):
 def main():
     controller = Controller()
 
+    if len(sys.argv) > 1 and sys.argv[1] == '--json':
+        controller.json_output = True
+        del sys.argv[1]
+
     if len(sys.argv) == 1:
 
-        _output('Usage: %s <command> [arguments]' % sys.argv[0])
+        _output('Usage: %s [--json] <command> [arguments]' % sys.argv[0])
         sys.exit(2)
 
-    if sys.argv[1] == 'status':
-        controller.handle_mcrunnerd_action(sys.argv[1])
+    if sys.argv[1] in ('status', 'health', 'metrics'):
+        status = controller.handle_mcrunnerd_action(sys.argv[1])
     elif sys.argv[1] in ('start', 'stop', 'restart'):
-        if len(sys.argv) == 2:
+        servers = sys.argv[2:]
+        all_servers = servers == ['--all']
+
+        if not servers or ('--all' in servers and not all_servers):
+            _output('Usage: %s %s <server_name|pattern>... | --all' % (sys.argv[0], sys.argv[1]))
+            sys.exit(2)
+
+        if all_servers:
+            status = controller.handle_lifecycle_action(sys.argv[1], all_servers=True)
+        else:
+            status = controller.handle_lifecycle_action(sys.argv[1], servers=servers)
+    elif sys.argv[1] == 'command':
+        usage = (
+            'Usage: %s %s [--no-output] [--until <pattern>] [--wait <seconds>] '
+            '<server_name|pattern> <command>... | -s <server_name|pattern> [-s ...] <command>... '
+            '| --file <path|-> <server_name|pattern>...'
+        ) % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        capture = True
+        terminator = None
+        quiet_period = None
+        command_file = None
+        servers = []
+
+        while args and args[0].startswith('-'):
+            option = args.pop(0)
+            if option == '--no-output':
+                capture = False
+            elif option == '--until' and args:
+                terminator = args.pop(0)
+            elif option == '--wait' and args and parse_duration(args[0]) is not None:
+                quiet_period = parse_duration(args.pop(0))
+            elif option == '--file' and args:
+                command_file = args.pop(0)
+            elif option == '-s' and args:
+                servers.append(args.pop(0))
+            else:
+                _output(usage)
+                sys.exit(2)
+
+        if not args and not (command_file and servers):
+            _output(usage)
+            sys.exit(2)
+
+        if command_file:
+            # with a file, all arguments name servers
+            servers += args
+            commands = read_commands(command_file)
+            if commands is None:
+                sys.exit(1)
+
+            if not commands:
+                _output('No commands in %s' % command_file)
+                sys.exit(2)
+        else:
+            if not servers:
+                servers = [args.pop(0)]
+
+            if not args:
+                _output('Usage: %s %s %s <command>' % (sys.argv[0], sys.argv[1], servers[0]))
+                sys.exit(2)
+
+            # the words of an unquoted command
+            commands = [' '.join(args)]
+
+        if len(servers) == 1 and len(commands) == 1 and not GLOB_RE.search(servers[0]):
+            status = controller.run_command(
+                servers[0], commands[0], capture=capture, terminator=terminator, quiet_period=quiet_period
+            )
+        else:
+            status = controller.run_commands(
+                servers, commands, capture=capture, terminator=terminator, quiet_period=quiet_period
+            )
+    elif sys.argv[1] == 'attach':
+        if len(sys.argv) != 3:
             _output('Usage: %s %s <server_name>' % (sys.argv[0], sys.argv[1]))
             sys.exit(2)
 
-        server = sys.argv[2]
+        status = controller.attach(sys.argv[2])
+    elif sys.argv[1] == 'crashes':
+        if len(sys.argv) != 3:
+            _output('Usage: %s %s <server_name>' % (sys.argv[0], sys.argv[1]))
+            sys.exit(2)
 
-        controller.handle_server_action(sys.argv[1], server)
-    elif sys.argv[1] == 'command':
-        if len(sys.argv) == 2:
-            _output('Usage: %s %s <server_name> <command>' % (sys.argv[0], sys.argv[1]))
+        status = controller.handle_server_action(sys.argv[1], sys.argv[2])
+    elif sys.argv[1] == 'plugins':
+        if len(sys.argv) < 3:
+            _output('Usage: %s %s <server_name|pattern>...' % (sys.argv[0], sys.argv[1]))
+            sys.exit(2)
+
+        status = controller.get_plugins(sys.argv[2:])
+    elif sys.argv[1] == 'grep':
+        usage = 'Usage: %s %s [--since <duration>] <server_name|pattern> <term>...' % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        since = None
+
+        if args and args[0] == '--since':
+            since = parse_duration(args[1]) if len(args) > 1 else None
+            if not since:
+                _output(usage)
+                sys.exit(2)
+            args = args[2:]
+
+        if len(args) < 2:
+            _output(usage)
+            sys.exit(2)
+
+        status = controller.search_logs([args[0]], args[1:], since=since)
+    elif sys.argv[1] == 'events':
+        usage = 'Usage: %s %s [-n <count>] [--type <type>]... <server_name>' % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        count = None
+        types = []
+
+        while args and args[0].startswith('-'):
+            option = args.pop(0)
+            if option == '-n' and args and args[0].isdigit():
+                count = int(args.pop(0))
+            elif option == '--type' and args:
+                types.append(args.pop(0))
+            else:
+                _output(usage)
+                sys.exit(2)
+
+        if len(args) != 1:
+            _output(usage)
             sys.exit(2)
 
-        if len(sys.argv) == 3:
-            _output('Usage: %s %s %s <command>' % (sys.argv[0], sys.argv[1], sys.argv[2]))
+        status = controller.get_events(args[0], types=types, count=count)
+    elif sys.argv[1] == 'tail':
+        usage = 'Usage: %s %s [-f] [-n <lines>] <server_name>' % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        follow = False
+        lines = TAIL_DEFAULT_LINES
+
+        while args and args[0].startswith('-'):
+            option = args.pop(0)
+            if option == '-f':
+                follow = True
+            elif option == '-n' and args and args[0].isdigit():
+                lines = int(args.pop(0))
+            else:
+                _output(usage)
+                sys.exit(2)
+
+        if len(args) != 1:
+            _output(usage)
             sys.exit(2)
 
-        controller.handle_server_action(sys.argv[1], sys.argv[2], command=sys.argv[3])
+        status = controller.tail_console(args[0], lines=lines, follow=follow)
+    elif sys.argv[1] == 'stats':
+        usage = 'Usage: %s %s [--since <duration>] <server_name>' % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        since = None
+
+        if args and args[0] == '--since':
+            since = parse_duration(args[1]) if len(args) > 1 else None
+            if not since:
+                _output(usage)
+                sys.exit(2)
+            args = args[2:]
+
+        if len(args) != 1:
+            _output(usage)
+            sys.exit(2)
+
+        status = controller.get_stats(args[0], since=since)
+    elif sys.argv[1] == 'logs':
+        usage = 'Usage: %s %s [--since <duration>] [--until <duration>] <server_name>' % (sys.argv[0], sys.argv[1])
+
+        args = sys.argv[2:]
+        durations = {}
+
+        while args and args[0] in ('--since', '--until'):
+            option = args.pop(0)
+            duration = parse_duration(args.pop(0)) if args else None
+            if not duration:
+                _output(usage)
+                sys.exit(2)
+
+            durations[option[2:]] = duration
+
+        if len(args) != 1:
+            _output(usage)
+            sys.exit(2)
+
+        status = controller.get_logs(args[0], **durations)
     else:
         _output("Unknown command: %s" % sys.argv[1])
         sys.exit(2)
 
+    if status != ResponseStatus.OK:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     main()
@@ -9,28 +9,70 @@ except ImportError:
     import configparser
 
 import atexit
+import collections
+import fnmatch
 import logging
 import logging.handlers
+import multiprocessing
 import os
 import pwd
+import re
+import signal
 import socket
 import sys
+import threading
+import time
 
 from mcrunner import __version__
-from mcrunner.connection import ServerSocketConnection
+from mcrunner.connection import RequestConnection, ServerSocketConnection
+from mcrunner.console_log import ConsoleLog, ConsoleLogWriter, search_segments
 from mcrunner.daemon import Daemon
+from mcrunner.events import CHAT, EVENT_TYPES, EXCEPTION, LAG, PLUGIN_DISABLE, PLUGIN_ENABLE, READY
 from mcrunner.exceptions import (
+    CommandNotDeliveredException,
+    CommandQueueFullException,
     ConfigException,
     MCRunnerException,
+    ProtocolException,
+    ServerAlreadyRunningException,
     ServerNotRunningException,
     ServerStartException,
 )
-from mcrunner.server import MinecraftServer
+from mcrunner.health import HealthWatchdog
+from mcrunner.metrics import MetricsCollector, MetricsHTTPServer
+from mcrunner.protocol import ResponseStatus, TAIL_DEFAULT_LINES
+from mcrunner.sampler import ProcessSample, ResourceSampler, summarize_samples
+from mcrunner.scheduler import MB, StartScheduler, read_memory_total
+from mcrunner.server import MinecraftServer, SERVER_TERMINATE_TIMEOUT_SEC
 from mcrunner.server_status import ServerStatus
+from mcrunner.supervisor import Supervisor
+from mcrunner.watcher import create_watcher
 
 logger = logging.getLogger(__name__)
 
-MCRUNNERD_COMMAND_DELIMITER = '|+|'
+TAIL_POLL_INTERVAL_SEC = 1.0
+
+# console lines sent per data frame of a logs request
+LOGS_CHUNK_LINES = 500
+
+# matching console lines returned per server by a grep request
+GREP_MAX_MATCHES = 1000
+
+# actions handled by MCRunner.handle_request, the only ones whose handling
+# time is recorded so clients can't create any number of metric series
+REQUEST_ACTIONS = (
+    'status', 'start', 'stop', 'restart', 'command', 'stats', 'health', 'crashes', 'events', 'plugins', 'metrics',
+    'logs', 'grep', 'tail',
+)
+
+# characters that make a server name a glob pattern
+GLOB_RE = re.compile(r'[*?[]')
+
+# time allowed for the daemon to exit on top of shutting down the servers
+DAEMON_STOP_MARGIN_SEC = 5
+
+# recent console events returned by an events request
+EVENTS_DEFAULT_COUNT = 20
 
 
 class MCRunner(Daemon):
@@ -44,14 +86,42 @@ class MCRunner(Daemon):
     """
 
     CONFIG_DEFAULTS = {
-        'user': None
+        'user': None,
+        'backlog': '16',
+        'shutdown_timeout': '75',
+        'max_parallel_operations': '4',
+        'memory_reserve': '1024',
+        'sample_interval': '5',
+        'sample_retention': '604800',
+        'metrics_port': '0',
+        'health_check_interval': '10',
+        'data_dir': None,
+        'search_workers': '4',
     }
 
     log_file = None
     user = None
     sock_file = None
+    backlog = 16
+    shutdown_timeout = 75
+    max_parallel_operations = 4
+    memory_reserve = 1024
+    sample_interval = 5
+    sample_retention = 604800
+    metrics_port = 0
+    health_check_interval = 10
+    data_dir = None
+    search_workers = 4
 
     servers = None
+    scheduler = None
+    sampler = None
+    metrics = None
+    supervisor = None
+    health = None
+    watcher = None
+    console_log_writer = None
+    search_pool = None
 
     def __init__(self, *args, **kwargs):
         self.config_file = kwargs.pop('config_file', '/etc/mcrunner/mcrunner.conf')
@@ -74,13 +144,23 @@ class MCRunner(Daemon):
         """
         self.servers = {}
 
-        config = configparser.ConfigParser(defaults=self.CONFIG_DEFAULTS)
+        config = configparser.ConfigParser(defaults=self.CONFIG_DEFAULTS, allow_no_value=True)
         config.read(self.config_file)
 
         for section in config.sections():
             if section == 'mcrunnerd':
                 self.log_file = config.get(section, 'logfile')
                 self.user = config.get(section, 'user')
+                self.backlog = config.getint(section, 'backlog')
+                self.shutdown_timeout = config.getint(section, 'shutdown_timeout')
+                self.max_parallel_operations = config.getint(section, 'max_parallel_operations')
+                self.memory_reserve = config.getint(section, 'memory_reserve')
+                self.sample_interval = config.getint(section, 'sample_interval')
+                self.sample_retention = config.getint(section, 'sample_retention')
+                self.metrics_port = config.getint(section, 'metrics_port')
+                self.health_check_interval = config.getint(section, 'health_check_interval')
+                self.data_dir = config.get(section, 'data_dir')
+                self.search_workers = config.getint(section, 'search_workers')
             elif section == 'mcrunner':
                 self.sock_file = config.get(section, 'url')
             elif section.startswith('server:'):
@@ -98,13 +178,84 @@ class MCRunner(Daemon):
                         elif v.lower() in ('true', 'yes', 'on'):
                             items_dict[k] = True
 
-                self.servers[name] = MinecraftServer(
+                server = MinecraftServer(
                     name,
                     items_dict.pop('path'),
                     items_dict.pop('jar'),
                     items_dict.pop('opts'),
                     **items_dict
                 )
+                server.add_status_listener(self.handle_server_status)
+                server.restart_handler = self.handle_plugin_update
+                server.crash_handler = self.handle_crash
+                server.clean_exit_handler = self.handle_clean_exit
+
+                self.servers[name] = server
+
+        if self.data_dir:
+            for name, server in self.servers.items():
+                server.plugin_manifest.store_path = os.path.join(self.data_dir, name, 'plugins.json')
+                server.plugin_manifest.load()
+
+                server.console_log = ConsoleLog(
+                    os.path.join(self.data_dir, name, 'console'),
+                    server.console_log_segment_size,
+                    server.console_log_max_size,
+                    server.console_log_max_age
+                )
+                server.console_log.load()
+
+        self.scheduler = StartScheduler(self.get_memory_budget())
+        self.sampler = ResourceSampler(self.servers, self.sample_interval, self.sample_retention)
+        self.metrics = MetricsCollector(self.servers, self.sampler)
+        self.supervisor = Supervisor(self.start_minecraft_server)
+        self.health = HealthWatchdog(
+            self.servers, self.sampler, self.health_check_interval, self.restart_minecraft_server
+        )
+        self.console_log_writer = ConsoleLogWriter(self.servers)
+
+    def handle_server_status(self, server, status):
+        """
+        Called whenever the status of a server changes.
+        """
+        if status == ServerStatus.RUNNING:
+            self.scheduler.ready(server.name)
+        elif status == ServerStatus.STOPPED:
+            # also covers servers that crashed or were stopped from the console
+            self.scheduler.release(server.name)
+
+    def handle_plugin_update(self, server):
+        """
+        Restart a server after one of its plugins changed. The start goes
+        through the scheduler like any other, so the server keeps its memory
+        commitment.
+        """
+        self.restart_minecraft_server(server.name)
+
+    def handle_crash(self, server, crash):
+        """
+        Called when a server exited unexpectedly. Whether and when it is
+        restarted is up to the supervisor.
+        """
+        self.supervisor.handle_crash(server, crash)
+
+    def handle_clean_exit(self, server, when):
+        """
+        Called when a server exited with code 0 without being stopped through
+        mcrunnerd, which isn't counted as a crash.
+        """
+        self.supervisor.handle_clean_exit(server, when)
+
+    def get_memory_budget(self):
+        """
+        Memory in bytes that started servers may commit: the total memory of
+        the host minus ``memory_reserve`` megabytes kept for the system.
+        """
+        total = read_memory_total()
+        if total is None:
+            return None
+
+        return max(total - self.memory_reserve * MB, 0)
 
     def socket_server(self):
         """
@@ -117,7 +268,7 @@ class MCRunner(Daemon):
 
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         sock.bind(self.sock_file)
-        sock.listen(1)
+        sock.listen(self.backlog)
 
         return sock
 
@@ -138,11 +289,57 @@ class MCRunner(Daemon):
         Return a string representation of all server statuses.
         """
         response = []
+        result = []
 
         for server_name, server in self.servers.items():
-            response.append('%s: %s' % (server_name, server.get_status().value))
+            queue_status = self.scheduler.get_queue_status(server_name)
+
+            if queue_status:
+                position, waited = queue_status
+
+                response.append('%s: %s (position %d, waiting %d seconds)' % (
+                    server_name, ServerStatus.QUEUED.value, position, waited
+                ))
+                result.append({
+                    'name': server_name,
+                    'status': ServerStatus.QUEUED.value,
+                    'queue_position': position,
+                    'queue_wait': round(waited, 1),
+                })
+                continue
+
+            status = server.get_status()
+            server_result = {
+                'name': server_name,
+                'status': status.value,
+            }
+
+            crash = server.crashes[-1] if server.crashes else None
+
+            if status == ServerStatus.RUNNING and server.startup_time is not None:
+                response.append('%s: %s (started in %.1f seconds)' % (server_name, status.value, server.startup_time))
+                server_result['startup_time'] = round(server.startup_time, 1)
+            elif status == ServerStatus.STOPPED and crash and crash.time >= (server.launched_at or 0):
+                details = ['exited with code %s' % crash.returncode]
+                server_result['exit_code'] = crash.returncode
+
+                state = self.supervisor.get_state(server_name)
+                if state and state.crash_loop:
+                    details.append('crash loop, not restarting')
+                    server_result['crash_loop'] = True
+                elif state and state.restart_at:
+                    restart_in = max(state.restart_at - time.time(), 0)
+                    details.append('restarting in %d seconds' % restart_in)
+                    server_result['restart_in'] = round(restart_in, 1)
+
+                response.append('%s: %s (%s)' % (server_name, status.value, ', '.join(details)))
+            else:
+                response.append('%s: %s' % (server_name, status.value))
+
+            result.append(server_result)
 
         connection.send_message('\n'.join(response))
+        connection.set_result({'servers': result})
 
     def start_minecraft_server(self, name, connection=None):
         """
@@ -151,13 +348,50 @@ class MCRunner(Daemon):
         server = self.servers.get(name)
         if not server:
             if connection:
+                connection.set_status(ResponseStatus.NOT_FOUND)
                 connection.send_message('Minecraft server "%s" not defined.' % name)
             return
 
+        if self.scheduler.get_queue_status(name):
+            if connection:
+                connection.set_status(ResponseStatus.ALREADY_RUNNING)
+                connection.send_message('Minecraft server "%s" already queued to start.' % name)
+            return
+
+        if not self.scheduler.acquire(name, server.heap_size, connection=connection):
+            if connection:
+                if server.get_status() == ServerStatus.STOPPED:
+                    # the queued start was cancelled by a stop
+                    connection.set_status(ResponseStatus.NOT_RUNNING)
+                    connection.send_message('Start of Minecraft server "%s" cancelled.' % name)
+                else:
+                    connection.set_status(ResponseStatus.ALREADY_RUNNING)
+                    connection.send_message('Minecraft server "%s" already running.' % name)
+            return
+
         try:
             server.start(connection=connection)
+        except ServerAlreadyRunningException:
+            # the commitment made above now covers the running server, it's
+            # released once the server stops
+            self.scheduler.ready(name)
+
+            if connection:
+                connection.set_status(ResponseStatus.ALREADY_RUNNING)
+            return
         except ServerStartException:
-            pass
+            self.scheduler.release(name)
+
+            if connection:
+                connection.set_status(ResponseStatus.ERROR)
+            return
+
+        if not server.wait_until_ready(server.start_timeout, connection=connection):
+            # don't hold back queued starts for a server that may never be ready
+            self.scheduler.ready(name)
+
+            if connection:
+                connection.set_status(ResponseStatus.ERROR)
 
     def stop_minecraft_server(self, name, connection=None):
         """
@@ -166,6 +400,31 @@ class MCRunner(Daemon):
         server = self.servers.get(name)
         if not server:
             if connection:
+                connection.set_status(ResponseStatus.NOT_FOUND)
+                connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        if self.scheduler.cancel(name):
+            if connection:
+                connection.send_message('Queued start of Minecraft server "%s" cancelled.' % name)
+            return
+
+        try:
+            server.stop(connection=connection)
+        except ServerNotRunningException:
+            if connection:
+                connection.set_status(ResponseStatus.NOT_RUNNING)
+        finally:
+            self.scheduler.release(name)
+
+    def restart_minecraft_server(self, name, connection=None):
+        """
+        Stop a server of a given name if it is running, then start it.
+        """
+        server = self.servers.get(name)
+        if not server:
+            if connection:
+                connection.set_status(ResponseStatus.NOT_FOUND)
                 connection.send_message('Minecraft server "%s" not defined' % name)
             return
 
@@ -174,54 +433,703 @@ class MCRunner(Daemon):
         except ServerNotRunningException:
             pass
 
-    def send_command(self, name, command, connection):
+        self.scheduler.release(name)
+
+        server.restart_count += 1
+
+        self.start_minecraft_server(name, connection=connection)
+
+    def resolve_servers(self, patterns):
+        """
+        Expand server names and glob patterns (such as ``lobby-*``) into a list
+        of unique server names in configuration order. Patterns that match no
+        server are kept as-is so that they are reported as not defined.
+        """
+        names = []
+
+        for pattern in patterns:
+            matches = [name for name in self.servers if fnmatch.fnmatchcase(name, pattern)]
+
+            for name in matches or [pattern]:
+                if name not in names:
+                    names.append(name)
+
+        return names
+
+    def run_lifecycle_action(self, action, names, connection):
+        """
+        Start, stop or restart the given servers, running up to
+        ``max_parallel_operations`` of them at the same time. The result of each
+        server is streamed to the client as soon as it completes.
+        """
+        handler = {
+            'start': self.start_minecraft_server,
+            'stop': self.stop_minecraft_server,
+            'restart': self.restart_minecraft_server,
+        }[action]
+
+        pending = collections.deque(names)
+        statuses = {}
+
+        def worker():
+            while True:
+                try:
+                    name = pending.popleft()
+                except IndexError:
+                    return
+
+                server_connection = connection.child()
+
+                # acting on a server by hand overrides any automatic restart
+                self.supervisor.reset(name)
+
+                try:
+                    handler(name, connection=server_connection)
+                except Exception:
+                    logger.exception('Error during %s of Minecraft server "%s"', action, name)
+                    server_connection.set_status(ResponseStatus.ERROR)
+
+                statuses[name] = server_connection.status
+                connection.send_data({'server': name, 'status': server_connection.status.value})
+
+        workers = []
+        for _ in range(min(self.max_parallel_operations, len(names)) - 1):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+
+        try:
+            worker()
+        finally:
+            for thread in workers:
+                thread.join()
+
+        _set_bulk_status(connection, names, statuses)
+
+    def broadcast_commands(self, names, commands, connection, capture=False, terminator=None, quiet_period=None):
         """
-        Send command string to server of a given name.
+        Send the same commands to several servers at once, see send_command.
+        Unlike lifecycle actions, all servers are handled concurrently, since
+        sending commands only waits for the servers to read them.
+
+        Nothing is sent if any server named without a glob pattern is not
+        defined, since that usually means the arguments were mixed up.
+        """
+        undefined = [name for name in names if name not in self.servers and not GLOB_RE.search(name)]
+        if undefined:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            for name in undefined:
+                connection.send_message('Minecraft server "%s" not defined' % name)
+            connection.send_message('No commands sent')
+            return
+
+        statuses = {}
+        results = {}
+
+        def send(name):
+            server_connection = connection.child()
+
+            try:
+                self.send_command(
+                    name,
+                    commands,
+                    server_connection,
+                    capture=capture,
+                    terminator=terminator,
+                    quiet_period=quiet_period
+                )
+            except Exception:
+                logger.exception('Error sending commands to Minecraft server "%s"', name)
+                server_connection.set_status(ResponseStatus.ERROR)
+
+            statuses[name] = server_connection.status
+            results[name] = server_connection.result
+
+        threads = []
+        for name in names[1:]:
+            thread = threading.Thread(target=send, args=(name,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            if names:
+                send(names[0])
+        finally:
+            for thread in threads:
+                thread.join()
+
+        _set_bulk_status(connection, names, statuses)
+
+        if capture:
+            for server_result in connection.result['servers']:
+                server_result['lines'] = (results[server_result['name']] or {}).get('lines', [])
+
+    def send_command(self, name, commands, connection, capture=False, terminator=None, quiet_period=None):
+        """
+        Send a list of command strings to server of a given name. If
+        ``capture`` is true, the console output of the commands is sent back
+        instead of a confirmation, see MinecraftServer.run_commands.
         """
         server = self.servers.get(name)
         if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
             connection.send_message('Minecraft server "%s" not defined' % name)
             return
 
-        logger.info('Sending command to server "%s": "%s"', name, command)
+        if terminator:
+            try:
+                terminator = re.compile(terminator.encode('utf8'))
+            except re.error as e:
+                connection.set_status(ResponseStatus.BAD_REQUEST)
+                connection.send_message('Invalid output terminator "%s": %s' % (terminator, e))
+                return
+
+        for command in commands:
+            logger.info('Sending command to server "%s": "%s"', name, command)
 
         try:
-            server.run_command(command, connection=connection)
+            lines = server.run_commands(
+                commands,
+                connection=connection,
+                capture=capture,
+                quiet_period=quiet_period,
+                terminator=terminator
+            )
         except ServerNotRunningException:
             message = 'Minecraft server "%s" not running' % name
 
             logger.warning(message)
+            connection.set_status(ResponseStatus.NOT_RUNNING)
             connection.send_message(message)
-        else:
-            connection.send_message('Sent command to Minecraft server "%s": "%s"' % (name, command))
+            return
+        except CommandQueueFullException:
+            message = 'Too many commands waiting for Minecraft server "%s", command not sent' % name
+
+            logger.warning(message)
+            connection.set_status(ResponseStatus.ERROR)
+            connection.send_message(message)
+            return
+        except CommandNotDeliveredException:
+            message = 'Minecraft server "%s" did not read command within %s seconds, it is still queued' % (
+                name, server.command_delivery_timeout
+            )
+
+            logger.warning(message)
+            connection.set_status(ResponseStatus.ERROR)
+            connection.send_message(message)
+            return
+
+        if not capture:
+            if len(commands) == 1:
+                connection.send_message('Sent command to Minecraft server "%s": "%s"' % (name, commands[0]))
+            else:
+                connection.send_message('Sent %d commands to Minecraft server "%s"' % (len(commands), name))
+            return
+
+        lines = _decode_lines(lines)
+        if lines:
+            connection.send_data({'server': name, 'lines': lines})
+
+        connection.set_result({'server': name, 'commands': commands, 'lines': lines})
+
+    def get_stats(self, name, since, connection):
+        """
+        Send the resource usage samples of a server taken within the last
+        ``since`` seconds (all retained samples if None), with a summary.
+        """
+        server = self.servers.get(name)
+        if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        samples = self.sampler.series[name].get_samples(since=time.time() - since if since else None)
+
+        connection.set_result({
+            'server': name,
+            'fields': list(ProcessSample._fields),
+            'samples': [list(sample) for sample in samples],
+        })
+
+        if not samples:
+            connection.send_message('No resource usage samples of Minecraft server "%s"' % name)
+            return
+
+        connection.send_message('\n'.join(_format_stats(name, summarize_samples(samples))))
+
+    def get_crashes(self, name, connection):
+        """
+        Send the exit codes and last console lines of the recent crashes of a
+        server.
+        """
+        server = self.servers.get(name)
+        if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        crashes = list(server.crashes)
+
+        connection.set_result({
+            'server': name,
+            'crashes': [
+                {
+                    'time': crash.time,
+                    'exit_code': crash.returncode,
+                    'uptime': crash.uptime,
+                    'lines': _decode_lines(crash.lines),
+                }
+                for crash in crashes
+            ],
+        })
+
+        if not crashes:
+            connection.send_message('No crashes of Minecraft server "%s"' % name)
+            return
+
+        connection.send_message('\n'.join(_format_crashes(name, crashes)))
+
+    def get_events(self, name, types, count, connection):
+        """
+        Send the console event counts of a server with its ``count`` most
+        recent events, optionally only those of the given ``types``.
+        """
+        server = self.servers.get(name)
+        if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        unknown = [event_type for event_type in types or [] if event_type not in EVENT_TYPES]
+        if unknown:
+            connection.set_status(ResponseStatus.BAD_REQUEST)
+            connection.send_message(
+                'Unknown event types: %s (known: %s)' % (', '.join(unknown), ', '.join(EVENT_TYPES))
+            )
+            return
+
+        counts = server.events.get_counts()
+        events = server.events.get_recent(types, count)
+
+        connection.set_result({
+            'server': name,
+            'counts': counts,
+            'events': [
+                {
+                    'time': event.time,
+                    'type': event.type,
+                    'data': event.data,
+                    'lines': _decode_lines(event.lines),
+                }
+                for event in events
+            ],
+        })
+
+        connection.send_message('\n'.join(_format_events(name, counts, events)))
+
+    def get_plugins(self, names, connection):
+        """
+        Send the plugin jars of the given servers with their versions and
+        digests, and how they differ from the plugins loaded by the last
+        start of each server.
+        """
+        results = []
+
+        for name in names:
+            server = self.servers.get(name)
+            if not server:
+                connection.set_status(ResponseStatus.NOT_FOUND)
+                connection.send_message('Minecraft server "%s" not defined' % name)
+                continue
+
+            manifest = server.plugin_manifest
+            manifest.refresh()
+
+            plugins = manifest.diff()
+
+            results.append({
+                'name': name,
+                'started_at': manifest.started_at,
+                'plugins': [
+                    {
+                        'name': plugin,
+                        'version': entry.version if entry else None,
+                        'digest': entry.digest if entry else None,
+                        'size': entry.size if entry else None,
+                        'mtime': entry.mtime if entry else None,
+                        'started_version': started_entry.version if started_entry else None,
+                        'started_digest': started_entry.digest if started_entry else None,
+                        'state': state,
+                    }
+                    for plugin, entry, started_entry, state in plugins
+                ],
+            })
+
+            connection.send_message('\n'.join(_format_plugins(name, manifest.started_at, plugins)))
+
+        connection.set_result({'servers': results})
+
+    def get_health(self, connection):
+        """
+        Send the result of the last health check of every server.
+        """
+        response = []
+        result = []
+
+        for server_name, server in self.servers.items():
+            health = self.health.health[server_name]
+            report = health.report
+
+            server_result = {
+                'name': server_name,
+                'score': report.score if report else None,
+                'problems': report.problems if report else [],
+                'diagnostics_at': health.diagnostics_at,
+                'diagnostics': _decode_lines(health.diagnostics),
+            }
+            result.append(server_result)
+
+            if not server.health_check:
+                response.append('%s: not checked' % server_name)
+            elif health.recovering:
+                response.append('%s: restarting' % server_name)
+            elif not report:
+                response.append('%s: %s' % (server_name, server.get_status().value))
+            elif report.problems:
+                response.append('%s: %d (%s)' % (server_name, report.score, ', '.join(report.problems)))
+            else:
+                response.append('%s: %d' % (server_name, report.score))
+
+        connection.send_message('\n'.join(response))
+        connection.set_result({'servers': result})
+
+    def tail_console(self, name, count, follow, connection):
+        """
+        Send the most recent console lines of a server and, if following, keep
+        streaming new lines until the client disconnects.
+        """
+        server = self.servers.get(name)
+        if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        if not follow:
+            lines = server.output.get_lines(count)
+            if lines:
+                connection.send_data({'lines': _decode_lines(lines)})
+            return
+
+        lines, subscription = server.output.subscribe(count)
 
-    def handle_socket_data(self, data, connection):
+        try:
+            if lines:
+                connection.send_data({'lines': _decode_lines(lines)})
+
+            self._stream_console(subscription, connection)
+        except socket.error:
+            logger.debug('Console subscriber for server "%s" disconnected', name)
+        finally:
+            server.output.unsubscribe(subscription)
+
+    def _stream_console(self, subscription, connection):
         """
-        Handles socket data from an mcrunner client and returns a two-tuple
-        of a bool indicating whether a response is warranted and the message string
-        of the response if any.
+        Send lines published to a console subscription to the client until the
+        subscription or the client connection is closed.
         """
-        parts = data.split(MCRUNNERD_COMMAND_DELIMITER)
+        dropped = 0
+
+        while not subscription.closed and not connection.closed:
+            lines = subscription.get(timeout=TAIL_POLL_INTERVAL_SEC)
+
+            if subscription.dropped > dropped:
+                connection.send_data({'dropped': subscription.dropped - dropped})
+                dropped = subscription.dropped
+
+            if lines:
+                connection.send_data({'lines': _decode_lines(lines)})
+
+    def get_logs(self, name, since, until, connection):
+        """
+        Send the console lines of a server stored in its console log between
+        ``since`` and ``until`` seconds ago (from the oldest stored line, up to
+        now if None).
+        """
+        server = self.servers.get(name)
+        if not server:
+            connection.set_status(ResponseStatus.NOT_FOUND)
+            connection.send_message('Minecraft server "%s" not defined' % name)
+            return
+
+        if not server.console_log:
+            connection.set_status(ResponseStatus.ERROR)
+            connection.send_message('Console output of Minecraft server "%s" is not stored, set data_dir' % name)
+            return
+
+        # include lines still waiting to be written
+        server.console_log.flush()
+
+        now = time.time()
+        count = 0
+        lines = []
+
+        for _, line in server.console_log.read(
+            since=now - since if since else None,
+            until=now - until if until else None
+        ):
+            lines.append(line)
+
+            if len(lines) >= LOGS_CHUNK_LINES:
+                connection.send_data({'lines': _decode_lines(lines)})
+                count += len(lines)
+                lines = []
+
+        if lines:
+            connection.send_data({'lines': _decode_lines(lines)})
+            count += len(lines)
+
+        connection.set_result({'server': name, 'lines': count})
+
+        if not count:
+            connection.send_message('No console output of Minecraft server "%s" in that time range' % name)
+
+    def search_logs(self, names, terms, since, connection):
+        """
+        Send the stored console lines of the given servers written within the
+        last ``since`` seconds (all stored output if None) that contain all of
+        ``terms``. Several servers are searched in parallel by the search
+        worker processes.
+        """
+        if not self.data_dir:
+            connection.set_status(ResponseStatus.ERROR)
+            connection.send_message('Console output is not stored, set data_dir')
+            return
+
+        since = time.time() - since if since else None
+        searches = []
+
+        for name in names:
+            server = self.servers.get(name)
+            if not server:
+                connection.set_status(ResponseStatus.NOT_FOUND)
+                connection.send_message('Minecraft server "%s" not defined' % name)
+                continue
+
+            # include lines still waiting to be written
+            server.console_log.flush()
+
+            searches.append((name, server.console_log.get_search_snapshots(terms, since)))
+
+        if self.search_pool and len(searches) > 1:
+            pending = [
+                (name, self.search_pool.apply_async(search_segments, (snapshots, terms, since, None, GREP_MAX_MATCHES)))
+                for name, snapshots in searches
+            ]
+            results = [(name, result.get()) for name, result in pending]
+        else:
+            results = [
+                (name, search_segments(snapshots, terms, since, None, GREP_MAX_MATCHES))
+                for name, snapshots in searches
+            ]
+
+        counts = {}
+
+        for name, matches in results:
+            counts[name] = len(matches)
+
+            for i in range(0, len(matches), LOGS_CHUNK_LINES):
+                connection.send_data({
+                    'server': name,
+                    'lines': [_format_match(when, line) for when, line in matches[i:i + LOGS_CHUNK_LINES]],
+                })
 
-        if parts[0] == 'status':
+            if len(matches) >= GREP_MAX_MATCHES:
+                connection.send_message(
+                    'Showing the first %d matches in the console output of Minecraft server "%s"' % (len(matches), name)
+                )
+
+        connection.set_result({'terms': terms, 'matches': counts})
+
+        if counts and not any(counts.values()):
+            connection.send_message('No console output matching "%s"' % ' '.join(terms))
+
+    def handle_request(self, action, args, connection):
+        """
+        Dispatch a single client request to its handler. Handlers report
+        progress and results through the request scoped ``connection``.
+        """
+        if action == 'status':
             self.get_status(connection)
-        elif parts[0] == 'start':
-            self.start_minecraft_server(parts[1], connection=connection)
-        elif parts[0] == 'stop':
-            self.stop_minecraft_server(parts[1], connection=connection)
-        elif parts[0] == 'restart':
-            self.stop_minecraft_server(parts[1], connection=connection)
-            self.start_minecraft_server(parts[1], connection=connection)
-        elif parts[0] == 'command':
-            self.send_command(parts[1], parts[2], connection)
+        elif action in ('start', 'stop', 'restart'):
+            if args.get('all'):
+                targets = list(self.servers)
+            elif 'servers' in args:
+                targets = self.resolve_servers(args['servers'])
+            else:
+                targets = [args['server']]
+
+            self.run_lifecycle_action(action, targets, connection)
+        elif action == 'command':
+            commands = args['commands'] if 'commands' in args else [args['command']]
+            if not commands:
+                connection.set_status(ResponseStatus.BAD_REQUEST)
+                connection.send_message('No commands given')
+                return
+
+            quiet_period = args.get('quiet_period')
+            options = {
+                'capture': bool(args.get('capture')),
+                'terminator': args.get('terminator'),
+                'quiet_period': float(quiet_period) if quiet_period is not None else None,
+            }
+
+            if 'servers' in args:
+                self.broadcast_commands(self.resolve_servers(args['servers']), commands, connection, **options)
+            else:
+                self.send_command(args['server'], commands, connection, **options)
+        elif action == 'stats':
+            since = args.get('since')
+            self.get_stats(args['server'], float(since) if since else None, connection)
+        elif action == 'health':
+            self.get_health(connection)
+        elif action == 'crashes':
+            self.get_crashes(args['server'], connection)
+        elif action == 'events':
+            self.get_events(
+                args['server'], args.get('types'), int(args.get('count', EVENTS_DEFAULT_COUNT)), connection
+            )
+        elif action == 'plugins':
+            self.get_plugins(self.resolve_servers(args['servers']), connection)
+        elif action == 'metrics':
+            connection.send_message(self.metrics.render().rstrip('\n'))
+        elif action == 'logs':
+            since = args.get('since')
+            until = args.get('until')
+            self.get_logs(
+                args['server'], float(since) if since else None, float(until) if until else None, connection
+            )
+        elif action == 'grep':
+            since = args.get('since')
+            self.search_logs(
+                self.resolve_servers(args['servers']), args['terms'], float(since) if since else None, connection
+            )
+        elif action == 'tail':
+            self.tail_console(
+                args['server'],
+                int(args.get('lines', TAIL_DEFAULT_LINES)),
+                bool(args.get('follow')),
+                connection
+            )
+        else:
+            connection.set_status(ResponseStatus.BAD_REQUEST)
+            connection.send_message('Unknown action: %s' % action)
 
     def on_exit(self):
         """
         Exit signal handler, attempt to shut down all Minecraft servers.
+
+        Servers are stopped concurrently and must be down within the
+        configured shutdown timeout, after which they are terminated.
         """
-        for server_name, server in self.servers.items():
-            if server.get_status() == ServerStatus.RUNNING:
-                self.stop_minecraft_server(server_name)
+        # a second signal would abort the shutdown half way
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_IGN)
+
+        self.health.stop()
+        self.supervisor.stop()
+
+        if self.watcher:
+            try:
+                self.watcher.stop()
+            except Exception:
+                logger.exception('Error stopping the plugin watcher')
+
+        self.stop_all_servers()
+
+        # after the servers stopped, so their last output is stored too
+        self.console_log_writer.stop()
+        self.close_console_logs()
+
+        if self.search_pool:
+            self.search_pool.terminate()
+
+    def stop(self, timeout=None):
+        """
+        Stop the daemon, waiting for it to shut down all servers.
+        """
+        if timeout is None:
+            timeout = self.shutdown_timeout + SERVER_TERMINATE_TIMEOUT_SEC + DAEMON_STOP_MARGIN_SEC
+
+        super(MCRunner, self).stop(timeout=timeout)
+
+    def stop_all_servers(self):
+        """
+        Stop all running servers concurrently within the shutdown timeout.
+        """
+        running = [
+            (server_name, server) for server_name, server in self.servers.items()
+            if server.get_status() != ServerStatus.STOPPED
+        ]
+        if not running:
+            return
+
+        logger.info('Stopping %d Minecraft servers...', len(running))
+
+        deadline = time.time() + self.shutdown_timeout
+        progress = {'stopped': 0, 'total': len(running)}
+        progress_lock = threading.Lock()
+
+        threads = []
+        for server_name, server in running:
+            thread = threading.Thread(
+                target=self._shutdown_server,
+                args=(server_name, server, deadline, progress, progress_lock)
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0) + SERVER_TERMINATE_TIMEOUT_SEC)
+
+        remaining = [server_name for server_name, server in running if server.pipe]
+        if remaining:
+            logger.error('Minecraft servers still running after shutdown: %s', ', '.join(remaining))
+        else:
+            logger.info('All Minecraft servers stopped.')
+
+    def close_console_logs(self):
+        for name, server in self.servers.items():
+            if not server.console_log:
+                continue
+
+            try:
+                server.console_log.close()
+            except (IOError, OSError) as e:
+                logger.warning('Could not write console log of Minecraft server "%s": %s', name, e)
+
+    def _shutdown_server(self, name, server, deadline, progress, progress_lock):
+        start_time = time.time()
+
+        # leave time for terminating the server if it doesn't stop gracefully
+        timeout = max(deadline - start_time - SERVER_TERMINATE_TIMEOUT_SEC, 1)
+
+        try:
+            server.stop(timeout=timeout)
+        except ServerNotRunningException:
+            pass
+        except Exception:
+            logger.exception('Error stopping Minecraft server "%s"', name)
+            return
+
+        with progress_lock:
+            progress['stopped'] += 1
+            logger.info(
+                'Minecraft server "%s" shut down in %.1f seconds (%d/%d)',
+                name, time.time() - start_time, progress['stopped'], progress['total']
+            )
 
     def set_uid(self):
         """
@@ -254,6 +1162,82 @@ class MCRunner(Daemon):
             logger.error('Could not switch to user %s' % self.user)
             sys.exit(1)
 
+    def start_connection_thread(self, connection):
+        """
+        Handle a client connection on its own thread so that slow server operations
+        (such as waiting for a server to stop) don't block other clients.
+        """
+        thread = threading.Thread(target=self.handle_connection, args=(connection,))
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+    def handle_connection(self, connection):
+        """
+        Receive requests from a client connection until the client closes it.
+        Every request is handled on its own thread, so a client can pipeline
+        several requests and receive their responses out of order.
+        """
+        logger.debug('Established socket connection')
+
+        try:
+            while True:
+                try:
+                    request = connection.receive_request()
+                except ProtocolException as e:
+                    logger.warning('Invalid request: %s', e)
+
+                    request_connection = RequestConnection(connection, e.request_id)
+                    request_connection.set_status(ResponseStatus.BAD_REQUEST)
+                    request_connection.send_message(str(e))
+                    request_connection.finish()
+                    continue
+
+                if request is None:
+                    break
+
+                self.start_request_thread(request, connection)
+        except socket.error:
+            logger.exception('Error during socket connection')
+        finally:
+            logger.debug('Closing socket connection')
+            try:
+                connection.close()
+            except socket.error:
+                pass
+
+    def start_request_thread(self, request, connection):
+        thread = threading.Thread(target=self.handle_connection_request, args=(request, connection))
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+    def handle_connection_request(self, request, connection):
+        request_connection = RequestConnection(connection, request.id)
+
+        logger.debug('Handling request %s: %s', request.id, request.action)
+
+        start_time = time.time()
+
+        try:
+            self.handle_request(request.action, request.args, request_connection)
+        except (KeyError, ValueError) as e:
+            request_connection.set_status(ResponseStatus.BAD_REQUEST)
+            request_connection.send_message('Invalid arguments for action "%s": %s' % (request.action, e))
+        except socket.error:
+            logger.debug('Client disconnected during request %s', request.id)
+        except Exception:
+            logger.exception('Error handling request %s: %s', request.id, request.action)
+            request_connection.set_status(ResponseStatus.ERROR)
+        finally:
+            request_connection.finish()
+
+            # streaming requests such as following the console are left out
+            if request.action in REQUEST_ACTIONS and not request.args.get('follow'):
+                self.metrics.observe_request(request.action, time.time() - start_time)
+
     def run(self):
         """
         Main daemon runloop function. Handles receiving and responding to MCRunner
@@ -269,6 +1253,24 @@ class MCRunner(Daemon):
             self._log_and_output('exception', 'Could not start mcrunnerd: %s' % str(e))
             return
 
+        if self.data_dir and self.search_workers > 0:
+            # before starting other threads, as the workers are forked
+            self.search_pool = multiprocessing.Pool(self.search_workers)
+
+        if self.sample_interval > 0:
+            self.sampler.start()
+
+        if self.health_check_interval > 0:
+            self.health.start()
+
+        if self.metrics_port > 0:
+            self.start_metrics_server()
+
+        self.start_plugin_watcher()
+
+        if self.data_dir:
+            self.console_log_writer.start()
+
         self._log_and_output('info', 'mcrunnerd (%s) started.' % __version__)
 
         while True:
@@ -276,19 +1278,7 @@ class MCRunner(Daemon):
                 logger.debug('Awaiting socket connection')
                 conn, client_address = sock.accept()
 
-                connection = ServerSocketConnection(conn)
-
-                logger.debug('Established socket connection')
-
-                try:
-                    data = connection.receive_message()
-
-                    logger.debug('Handling socket data')
-                    self.handle_socket_data(data, connection)
-                    logger.debug('Socket data handled')
-                finally:
-                    logger.debug('Closing socket connection')
-                    connection.close()
+                self.start_connection_thread(ServerSocketConnection(conn))
             except socket.error:
                 self._log_and_output('exception', 'Error during socket connection')
             except SystemExit:
@@ -297,6 +1287,41 @@ class MCRunner(Daemon):
 
         self._log_and_output('info', 'mcrunnerd (%s) stopped.' % __version__)
 
+    def start_plugin_watcher(self):
+        """
+        Watch the plugins directories of all servers with
+        ``restart_on_plugin_update`` enabled, sharing a single watcher thread.
+        """
+        servers = [server for server in self.servers.values() if server.restart_on_plugin_update]
+        if not servers:
+            return
+
+        self.watcher = create_watcher()
+
+        for server in servers:
+            path = os.path.join(server.path, 'plugins')
+
+            if self.watcher.watch(path, server.plugin_monitor.file_changed):
+                logger.info('Watching plugins of Minecraft server "%s" for changes', server.name)
+
+        self.watcher.start()
+
+    def start_metrics_server(self):
+        """
+        Serve the metrics over HTTP on ``metrics_port``, bound to the loopback
+        interface only.
+        """
+        try:
+            metrics_server = MetricsHTTPServer(('127.0.0.1', self.metrics_port), self.metrics)
+        except socket.error as e:
+            self._log_and_output('error', 'Could not start metrics listener on port %d: %s' % (self.metrics_port, e))
+            return None
+
+        metrics_server.start()
+        logger.info('Serving metrics on http://127.0.0.1:%d/metrics', self.metrics_port)
+
+        return metrics_server
+
     def _log_and_output(self, level, message):
         if level in ['debug', 'info', 'warning', 'error', 'exception']:
             getattr(logger, level)(message)
@@ -307,6 +1332,148 @@ class MCRunner(Daemon):
             _output(message)
 
 
+def _set_bulk_status(connection, names, statuses):
+    # a single failure reason is passed on as is, mixed ones become an error
+    failed = set(status for status in statuses.values() if status != ResponseStatus.OK)
+    if len(failed) == 1:
+        connection.set_status(failed.pop())
+    elif failed:
+        connection.set_status(ResponseStatus.ERROR)
+
+    connection.set_result({'servers': [
+        {'name': name, 'status': statuses[name].value} for name in names if name in statuses
+    ]})
+
+
+def _format_stats(name, summary):
+    lines = ['%s: %d samples since %s' % (
+        name, summary['samples'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary['since']))
+    )]
+
+    if summary['cpu_percent'] is not None:
+        lines.append('cpu: %.1f%% average, %.1f%% peak' % (summary['cpu_percent'], summary['max_cpu_percent']))
+
+    lines.append('rss: %s current, %s peak' % (_format_size(summary['rss']), _format_size(summary['max_rss'])))
+    lines.append('threads: %d' % summary['threads'])
+
+    if summary['cpu_percent'] is not None:
+        lines.append('context switches: %.1f/s voluntary, %.1f/s involuntary' % (
+            summary['voluntary_switches_per_sec'], summary['involuntary_switches_per_sec']
+        ))
+        lines.append('io: %s/s read, %s/s write' % (
+            _format_size(summary['read_bytes_per_sec']), _format_size(summary['write_bytes_per_sec'])
+        ))
+
+    return lines
+
+
+def _format_crashes(name, crashes):
+    lines = ['Recent crashes of Minecraft server "%s":' % name]
+
+    for crash in crashes:
+        description = '%s: exited with code %s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(crash.time)), crash.returncode
+        )
+        if crash.uptime is not None:
+            description += ' after %.1f seconds' % crash.uptime
+
+        lines.append(description)
+        lines.extend('    %s' % line for line in _decode_lines(crash.lines))
+
+    return lines
+
+
+def _format_events(name, counts, events):
+    lines = ['Console events of Minecraft server "%s": %s' % (
+        name, ', '.join('%d %s' % (counts.get(event_type, 0), event_type) for event_type in EVENT_TYPES)
+    )]
+
+    for event in events:
+        lines.append('%s %s %s' % (
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.time)), event.type, _describe_event(event)
+        ))
+
+    return lines
+
+
+def _describe_event(event):
+    data = event.data
+
+    if event.type == CHAT:
+        return '<%s> %s' % (data['player'], data['message'])
+    elif event.type == LAG:
+        description = '%dms behind' % data['ms']
+        if data.get('ticks') is not None:
+            description += ' (%d ticks)' % data['ticks']
+        return description
+    elif event.type == READY:
+        return 'after %ss' % data['seconds']
+    elif event.type == EXCEPTION:
+        description = data['exception']
+        if data.get('message'):
+            description += ': %s' % data['message']
+        more = len(event.lines) - 1 + data.get('omitted_lines', 0)
+        if more:
+            description += ' (%d more lines)' % more
+        return description
+    elif event.type in (PLUGIN_ENABLE, PLUGIN_DISABLE):
+        return ' '.join(part for part in (data['plugin'], data.get('version')) if part)
+
+    return data.get('player', '')
+
+
+def _format_plugins(name, started_at, plugins):
+    if started_at is None:
+        lines = ['Plugins of Minecraft server "%s", not started yet:' % name]
+    else:
+        changed = len([state for _, _, _, state in plugins if state != 'unchanged'])
+        lines = ['Plugins of Minecraft server "%s", %d changed since start at %s:' % (
+            name, changed, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))
+        )]
+
+    rows = []
+    for plugin, entry, started_entry, state in plugins:
+        description = state if state not in (None, 'unchanged') else ''
+        if state == 'changed' and started_entry.version != entry.version:
+            description = 'changed from %s' % (started_entry.version or 'unknown version')
+
+        rows.append((
+            plugin,
+            (entry.version or '-') if entry else '-',
+            entry.digest[:12] if entry else '-',
+            description,
+        ))
+
+    widths = [max([len(row[i]) for row in rows] or [0]) for i in range(3)]
+
+    for row in rows:
+        lines.append(('    %-*s  %-*s  %-*s  %s' % (
+            widths[0], row[0], widths[1], row[1], widths[2], row[2], row[3]
+        )).rstrip())
+
+    if not rows:
+        lines.append('    no plugins')
+
+    return lines
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+
+    return '%.1f GB' % size
+
+
+def _format_match(when, line):
+    return '%s %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)), line.decode('utf8', 'replace'))
+
+
+def _decode_lines(lines):
+    return [line.decode('utf8', 'replace') for line in lines]
+
+
 def _output(string):
     sys.stdout.write('%s\n' % string)
 
@@ -0,0 +1,273 @@
+from __future__ import absolute_import
+
+import bisect
+import logging
+import threading
+import time
+
+try:
+    # Python 2.x
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # Python 3.x
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from mcrunner.events import EVENT_TYPES
+from mcrunner.server_status import ServerStatus
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# name, type and help text of every metric, in the order they are rendered
+SERVER_METRICS = [
+    ('mcrunner_server_status', 'gauge', 'Current status of the server, 1 for the status it is in.'),
+    ('mcrunner_server_uptime_seconds', 'gauge', 'Seconds since the server process was launched.'),
+    ('mcrunner_server_startup_seconds', 'gauge', 'Seconds the last start took from launch until ready.'),
+    ('mcrunner_server_starts_total', 'counter', 'Number of times the server was started.'),
+    ('mcrunner_server_restarts_total', 'counter', 'Number of restarts of the server.'),
+    ('mcrunner_server_crashes_total', 'counter', 'Number of unexpected exits of the server process.'),
+    ('mcrunner_server_console_lines_total', 'counter', 'Number of console lines written by the server.'),
+    ('mcrunner_server_console_events_total', 'counter', 'Number of console events of the server by type.'),
+    ('mcrunner_server_command_queue_depth', 'gauge', 'Number of commands waiting to be written to the server.'),
+    ('mcrunner_server_commands_dropped_total', 'counter', 'Number of commands rejected because the queue was full.'),
+    ('mcrunner_server_commands_coalesced_total', 'counter', 'Number of commands merged into an identical queued one.'),
+    ('mcrunner_server_cpu_seconds_total', 'counter', 'CPU time used by the current server process.'),
+    ('mcrunner_server_resident_memory_bytes', 'gauge', 'Resident memory of the server process.'),
+    ('mcrunner_server_threads', 'gauge', 'Number of threads of the server process.'),
+]
+
+REQUEST_METRIC = 'mcrunner_request_duration_seconds'
+
+
+class Histogram(object):
+
+    """
+    Prometheus style histogram of observed values with fixed bucket bounds.
+
+    The exposition lines are cached and only rendered again after a new
+    value was observed.
+    """
+
+    def __init__(self, buckets=REQUEST_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+        self.rendered = None
+        self.lock = threading.Lock()
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.rendered = None
+
+    def render(self, name, labels):
+        """
+        Return the exposition lines of the histogram. ``labels`` is the
+        rendered label set without braces.
+        """
+        with self.lock:
+            if self.rendered is not None:
+                return self.rendered
+
+            lines = []
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+
+            cumulative += self.counts[-1]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, cumulative))
+            lines.append('%s_sum{%s} %s' % (name, labels, _format_value(self.sum)))
+            lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+
+            self.rendered = '\n'.join(lines)
+
+            return self.rendered
+
+
+class MetricsCollector(object):
+
+    """
+    Collects daemon metrics and renders them in the Prometheus text
+    exposition format.
+
+    Server metrics are read from the server objects and the resource sampler
+    when rendering, so nothing is computed between scrapes. Everything but
+    the values themselves is rendered once up front, and request latency
+    histograms are only rendered again when they changed.
+    """
+
+    def __init__(self, servers, sampler):
+        self.servers = servers
+        self.sampler = sampler
+
+        # per server, the beginning of each metric line up to its value
+        self.prefixes = {}
+        self.status_lines = {}
+        self.event_prefixes = {}
+        for name in servers:
+            labels = 'server="%s"' % _escape(name)
+
+            self.prefixes[name] = dict(
+                (metric, '%s{%s} ' % (metric, labels)) for metric, _, _ in SERVER_METRICS
+            )
+            self.status_lines[name] = dict(
+                (status, [
+                    'mcrunner_server_status{%s,status="%s"} %d' % (labels, other.value.lower(), other == status)
+                    for other in ServerStatus
+                ])
+                for status in ServerStatus
+            )
+            self.event_prefixes[name] = dict(
+                (event_type, 'mcrunner_server_console_events_total{%s,type="%s"} ' % (labels, event_type))
+                for event_type in EVENT_TYPES
+            )
+
+        self.request_latency = {}
+        self.lock = threading.Lock()
+
+    def observe_request(self, action, duration):
+        """
+        Record the time it took to handle a request of the given action.
+        """
+        histogram = self.request_latency.get(action)
+        if histogram is None:
+            with self.lock:
+                histogram = self.request_latency.setdefault(action, Histogram())
+
+        histogram.observe(duration)
+
+    def render(self):
+        now = time.time()
+        values = dict((metric, []) for metric, _, _ in SERVER_METRICS)
+
+        for name, server in self.servers.items():
+            prefixes = self.prefixes[name]
+
+            values['mcrunner_server_status'].extend(self.status_lines[name][server.get_status()])
+
+            pipe = server.pipe
+            if pipe and server.launched_at:
+                values['mcrunner_server_uptime_seconds'].append(
+                    prefixes['mcrunner_server_uptime_seconds'] + _format_value(now - server.launched_at)
+                )
+
+            if server.startup_time is not None:
+                values['mcrunner_server_startup_seconds'].append(
+                    prefixes['mcrunner_server_startup_seconds'] + _format_value(server.startup_time)
+                )
+
+            values['mcrunner_server_starts_total'].append(
+                prefixes['mcrunner_server_starts_total'] + str(server.start_count)
+            )
+            values['mcrunner_server_restarts_total'].append(
+                prefixes['mcrunner_server_restarts_total'] + str(server.restart_count)
+            )
+            values['mcrunner_server_crashes_total'].append(
+                prefixes['mcrunner_server_crashes_total'] + str(server.crash_count)
+            )
+            values['mcrunner_server_console_lines_total'].append(
+                prefixes['mcrunner_server_console_lines_total'] + str(server.output.line_count)
+            )
+
+            event_counts = server.events.get_counts()
+            values['mcrunner_server_console_events_total'].extend(
+                self.event_prefixes[name][event_type] + str(event_counts.get(event_type, 0))
+                for event_type in EVENT_TYPES
+            )
+
+            values['mcrunner_server_command_queue_depth'].append(
+                prefixes['mcrunner_server_command_queue_depth'] + str(server.get_command_queue_depth())
+            )
+            values['mcrunner_server_commands_dropped_total'].append(
+                prefixes['mcrunner_server_commands_dropped_total'] + str(server.command_limiter.dropped)
+            )
+            values['mcrunner_server_commands_coalesced_total'].append(
+                prefixes['mcrunner_server_commands_coalesced_total'] + str(server.command_limiter.coalesced)
+            )
+
+            sample = self.sampler.series[name].latest() if pipe else None
+            if sample:
+                values['mcrunner_server_cpu_seconds_total'].append(
+                    prefixes['mcrunner_server_cpu_seconds_total'] + _format_value(sample.cpu_time)
+                )
+                values['mcrunner_server_resident_memory_bytes'].append(
+                    prefixes['mcrunner_server_resident_memory_bytes'] + str(sample.rss)
+                )
+                values['mcrunner_server_threads'].append(
+                    prefixes['mcrunner_server_threads'] + str(sample.threads)
+                )
+
+        lines = []
+        for metric, metric_type, help_text in SERVER_METRICS:
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, metric_type))
+            lines.extend(values[metric])
+
+        lines.append('# HELP %s Time taken to handle mcrunnerd requests.' % REQUEST_METRIC)
+        lines.append('# TYPE %s histogram' % REQUEST_METRIC)
+
+        for action, histogram in sorted(self.request_latency.items()):
+            lines.append(histogram.render(REQUEST_METRIC, 'action="%s"' % _escape(action)))
+
+        lines.append('')
+
+        return '\n'.join(lines)
+
+
+class MetricsHTTPServer(HTTPServer):
+
+    """
+    HTTP server answering ``GET /metrics`` with the rendered metrics of a
+    MetricsCollector.
+    """
+
+    def __init__(self, address, collector):
+        HTTPServer.__init__(self, address, MetricsRequestHandler)
+        self.collector = collector
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.collector.render().encode('utf8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from %s: %s', self.client_address[0], format % args)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+
+    return str(value)
@@ -0,0 +1,431 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+import zipfile
+
+from mcrunner.server_status import ServerStatus
+
+logger = logging.getLogger(__name__)
+
+DIGEST_CHUNK_SIZE = 1048576
+
+# descriptors of Bukkit, Paper and BungeeCord plugins
+PLUGIN_DESCRIPTORS = ('plugin.yml', 'paper-plugin.yml', 'bungee.yml')
+PLUGIN_VERSION_RE = re.compile(r'^version:\s*[\'"]?(.*?)[\'"]?\s*$')
+
+ManifestEntry = collections.namedtuple('ManifestEntry', ['size', 'mtime', 'inode', 'digest', 'version'])
+
+
+def digest_file(path):
+    """
+    Return the hex SHA-256 digest of the content of a file. The file is
+    mapped into memory and hashed in one go, or read in chunks if it can't
+    be mapped, such as when it is empty.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            while True:
+                chunk = f.read(DIGEST_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                digest.update(chunk)
+        else:
+            try:
+                digest.update(data)
+            finally:
+                data.close()
+
+    return digest.hexdigest()
+
+
+def read_plugin_version(path):
+    """
+    Return the version declared in the plugin descriptor of a jar, or None
+    if it has none.
+    """
+    try:
+        jar = zipfile.ZipFile(path)
+    except (zipfile.BadZipfile, IOError, OSError):
+        return None
+
+    try:
+        for descriptor in PLUGIN_DESCRIPTORS:
+            try:
+                data = jar.read(descriptor)
+            except KeyError:
+                continue
+
+            for line in data.decode('utf8', 'replace').splitlines():
+                match = PLUGIN_VERSION_RE.match(line)
+                if match:
+                    return match.group(1)
+    except (zipfile.BadZipfile, IOError, OSError):
+        pass
+    finally:
+        jar.close()
+
+    return None
+
+
+def is_complete_jar(path):
+    """
+    Check that a jar was written completely by reading its zip central
+    directory, which is stored at the end of the file.
+    """
+    try:
+        jar = zipfile.ZipFile(path)
+    except (zipfile.BadZipfile, IOError, OSError):
+        return False
+
+    jar.close()
+
+    return True
+
+
+def list_jars(path):
+    """
+    Return the paths of the jars in a plugins directory.
+    """
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+
+    return sorted(os.path.join(path, name) for name in names if name.endswith('.jar'))
+
+
+class PluginManifest(object):
+
+    """
+    Manifest of the plugin jars in the directory ``path``, with the size,
+    modification time, inode, content digest and plugin version of each jar
+    keyed by file name.
+
+    Digests are only computed again when the size, modification time or
+    inode of a jar changed, so refreshing the manifest of an unchanged
+    directory costs one stat per jar. The manifest as it was when the
+    server was last started is kept in ``started`` to tell which plugins
+    changed since. If ``store_path`` is set, the manifest is kept in that
+    JSON file across restarts of mcrunnerd.
+    """
+
+    def __init__(self, path, store_path=None):
+        self.path = path
+        self.store_path = store_path
+
+        self.plugins = {}
+        self.started = {}
+        self.started_at = None
+        self.dirty = False
+
+        self.lock = threading.RLock()
+
+    def load(self):
+        """
+        Load the manifest from ``store_path``.
+        """
+        if not self.store_path:
+            return
+
+        try:
+            with open(self.store_path) as f:
+                data = json.load(f)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                logger.warning('Could not read plugin manifest %s: %s', self.store_path, e)
+            return
+        except ValueError as e:
+            logger.warning('Invalid plugin manifest %s: %s', self.store_path, e)
+            return
+
+        with self.lock:
+            self.plugins = _load_entries(data.get('plugins'))
+            self.started = _load_entries(data.get('started'))
+            self.started_at = data.get('started_at')
+            self.dirty = False
+
+    def save(self):
+        """
+        Write the manifest to ``store_path`` if it changed.
+        """
+        with self.lock:
+            if not self.store_path or not self.dirty:
+                return
+
+            data = {
+                'plugins': _dump_entries(self.plugins),
+                'started': _dump_entries(self.started),
+                'started_at': self.started_at,
+            }
+
+            temp_path = '%s.tmp' % self.store_path
+
+            try:
+                directory = os.path.dirname(self.store_path)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+
+                with open(temp_path, 'w') as f:
+                    json.dump(data, f, sort_keys=True)
+
+                os.rename(temp_path, self.store_path)
+            except (IOError, OSError) as e:
+                logger.warning('Could not write plugin manifest %s: %s', self.store_path, e)
+                return
+
+            self.dirty = False
+
+    def update(self, path, stat=None):
+        """
+        Bring the entry of a single jar up to date and return it, or None if
+        the jar doesn't exist.
+        """
+        name = os.path.basename(path)
+
+        with self.lock:
+            try:
+                stat = stat or os.stat(path)
+            except OSError:
+                self.remove(name)
+                return None
+
+            entry = self.plugins.get(name)
+            if entry and (entry.size, entry.mtime, entry.inode) == (stat.st_size, stat.st_mtime, stat.st_ino):
+                return entry
+
+            entry = ManifestEntry(
+                stat.st_size, stat.st_mtime, stat.st_ino, digest_file(path), read_plugin_version(path)
+            )
+
+            self.plugins[name] = entry
+            self.dirty = True
+
+            return entry
+
+    def remove(self, name):
+        with self.lock:
+            if self.plugins.pop(name, None):
+                self.dirty = True
+
+    def refresh(self):
+        """
+        Bring the manifest up to date with the plugins directory and save it.
+        """
+        paths = list_jars(self.path)
+        names = set(os.path.basename(path) for path in paths)
+
+        with self.lock:
+            for name in list(self.plugins):
+                if name not in names:
+                    self.remove(name)
+
+            for path in paths:
+                try:
+                    self.update(path)
+                except (IOError, OSError) as e:
+                    logger.warning('Could not read plugin %s: %s', path, e)
+
+            self.save()
+
+    def mark_started(self):
+        """
+        Remember the current manifest as the plugins loaded by a server start.
+        """
+        with self.lock:
+            self.refresh()
+
+            self.started = dict(self.plugins)
+            self.started_at = time.time()
+            self.dirty = True
+
+            self.save()
+
+    def get_started_digest(self, name):
+        entry = self.started.get(name)
+
+        return entry.digest if entry else None
+
+    def diff(self):
+        """
+        Compare the manifest to the one at the last start. Returns a sorted
+        list of (name, entry, started_entry, state) tuples, where state is
+        one of ``added``, ``removed``, ``changed`` or ``unchanged``, or None
+        if the server was never started.
+        """
+        with self.lock:
+            plugins = dict(self.plugins)
+            started = dict(self.started)
+            started_at = self.started_at
+
+        result = []
+
+        for name in sorted(set(plugins) | set(started)):
+            entry = plugins.get(name)
+            started_entry = started.get(name)
+
+            if started_at is None:
+                state = None
+            elif not started_entry:
+                state = 'added'
+            elif not entry:
+                state = 'removed'
+            elif entry.digest != started_entry.digest:
+                state = 'changed'
+            else:
+                state = 'unchanged'
+
+            result.append((name, entry, started_entry, state))
+
+        return result
+
+
+def _load_entries(entries):
+    return dict((name, ManifestEntry(**entry)) for name, entry in (entries or {}).items())
+
+
+def _dump_entries(entries):
+    return dict((name, entry._asdict()) for name, entry in entries.items())
+
+
+class PluginUpdateMonitor(object):
+
+    """
+    Decides when changes to the plugin jars of a server call for a restart.
+
+    File change notifications are passed to ``file_changed``. They are
+    collected until no jar changed for ``plugin_quiet_period`` seconds, so
+    a deploy of several plugins, each written in many steps, is handled as
+    one. Jars that were modified less than the quiet period ago, or whose zip
+    central directory can't be read yet, are checked again later. Once all
+    changed jars settled, the server is restarted with
+    ``server.handle_plugin_update()`` if it is running and the content of any
+    of them differs from the ``plugin_manifest`` of the server at its last
+    start.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.manifest = server.plugin_manifest
+        self.quiet_period = server.plugin_quiet_period
+
+        self.pending = set()
+        self.changed = set()
+        self.deadline = None
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def file_changed(self, path):
+        """
+        Called whenever a file in the plugins directory was created, modified
+        or deleted.
+        """
+        if not path.endswith('.jar'):
+            return
+
+        with self.lock:
+            self.pending.add(path)
+            self.deadline = time.time() + self.quiet_period
+
+            if not self.timer:
+                self._schedule(self.quiet_period)
+
+    def _schedule(self, delay):
+        self.timer = threading.Timer(delay, self._handle_quiet)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _handle_quiet(self):
+        with self.lock:
+            remaining = self.deadline - time.time()
+            if remaining > 0:
+                self._schedule(remaining)
+                return
+
+            self.timer = None
+
+            paths = self.pending
+            self.pending = set()
+
+        try:
+            self.check(paths)
+        except Exception:
+            logger.exception('Error checking plugin changes of Minecraft server "%s"', self.server.name)
+
+    def check(self, paths, now=None):
+        """
+        Check the given changed jars, restarting the server once all changed
+        jars settled and any of them has new content.
+        """
+        now = now or time.time()
+        unsettled = set()
+
+        for path in paths:
+            name = os.path.basename(path)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # deleted
+                self.manifest.remove(name)
+                if self.manifest.get_started_digest(name):
+                    self.changed.add(name)
+                else:
+                    self.changed.discard(name)
+                continue
+
+            if now - stat.st_mtime < self.quiet_period:
+                unsettled.add(path)
+                continue
+
+            if not is_complete_jar(path):
+                # checked again once it is written to
+                logger.warning('Plugin "%s" of Minecraft server "%s" is not a complete jar', path, self.server.name)
+                continue
+
+            entry = self.manifest.update(path, stat)
+            if entry and entry.digest != self.manifest.get_started_digest(name):
+                self.changed.add(name)
+            else:
+                # changed back
+                self.changed.discard(name)
+
+        self.manifest.save()
+
+        with self.lock:
+            if unsettled:
+                self.pending.update(unsettled)
+                self.deadline = now + self.quiet_period
+
+                if not self.timer:
+                    self._schedule(self.quiet_period)
+
+            if self.pending or self.timer:
+                return
+
+            changed = self.changed
+            self.changed = set()
+
+        if not changed:
+            logger.debug('Plugins of Minecraft server "%s" unchanged, not restarting', self.server.name)
+            return
+
+        if self.server.get_status() != ServerStatus.RUNNING:
+            return
+
+        logger.info('Plugins of Minecraft server "%s" changed: %s', self.server.name, ', '.join(sorted(changed)))
+
+        self.server.handle_plugin_update()
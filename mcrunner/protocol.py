@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+import collections
+import json
+
+from enum import Enum
+
+from mcrunner.exceptions import ProtocolException
+
+PROTOCOL_VERSION = 1
+
+# Response frame types. Every request is answered with any number of MESSAGE
+# (human readable progress) and DATA (structured payload) frames, followed by
+# exactly one END frame carrying the final status of the request.
+RESPONSE_MESSAGE = 'message'
+RESPONSE_DATA = 'data'
+RESPONSE_END = 'end'
+
+# number of console lines sent by a tail request that doesn't ask for a count
+TAIL_DEFAULT_LINES = 10
+
+
+class ResponseStatus(Enum):
+    OK = 'ok'
+    ERROR = 'error'
+    BAD_REQUEST = 'bad_request'
+    NOT_FOUND = 'not_found'
+    NOT_RUNNING = 'not_running'
+    ALREADY_RUNNING = 'already_running'
+
+
+Request = collections.namedtuple('Request', ['id', 'action', 'args'])
+
+
+def encode_request(request_id, action, **args):
+    return json.dumps({
+        'v': PROTOCOL_VERSION,
+        'id': request_id,
+        'action': action,
+        'args': args,
+    })
+
+
+def decode_request(frame):
+    """
+    Decode a request frame into a Request, raising ProtocolException if the
+    frame is not a valid request of a supported protocol version.
+    """
+    payload = _decode_frame(frame)
+
+    action = payload.get('action')
+    args = payload.get('args', {})
+
+    if not action or not isinstance(args, dict):
+        raise ProtocolException('Malformed request', payload.get('id'))
+
+    return Request(payload.get('id'), action, args)
+
+
+def encode_response(request_id, response_type, **fields):
+    fields.update({
+        'v': PROTOCOL_VERSION,
+        'id': request_id,
+        'type': response_type,
+    })
+
+    return json.dumps(fields)
+
+
+def decode_response(frame):
+    payload = _decode_frame(frame)
+
+    if payload.get('type') not in (RESPONSE_MESSAGE, RESPONSE_DATA, RESPONSE_END):
+        raise ProtocolException('Malformed response', payload.get('id'))
+
+    return payload
+
+
+def _decode_frame(frame):
+    if not frame:
+        raise ProtocolException('Empty frame')
+
+    if isinstance(frame, bytes):
+        frame = frame.decode('utf8')
+
+    try:
+        payload = json.loads(frame)
+    except ValueError:
+        raise ProtocolException('Frame is not valid JSON')
+
+    if not isinstance(payload, dict):
+        raise ProtocolException('Frame is not a JSON object')
+
+    if payload.get('v') != PROTOCOL_VERSION:
+        raise ProtocolException('Unsupported protocol version: %s' % payload.get('v'), payload.get('id'))
+
+    return payload
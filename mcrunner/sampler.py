@@ -0,0 +1,256 @@
+from __future__ import absolute_import
+
+import array
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROC_PATH = '/proc'
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+ProcessSample = collections.namedtuple('ProcessSample', [
+    'time',
+    'cpu_time',
+    'rss',
+    'threads',
+    'voluntary_switches',
+    'involuntary_switches',
+    'read_bytes',
+    'write_bytes',
+])
+
+# array typecode used to store each field of a sample
+SAMPLE_TYPECODES = ProcessSample(
+    time='d',
+    cpu_time='d',
+    rss='q',
+    threads='i',
+    voluntary_switches='q',
+    involuntary_switches='q',
+    read_bytes='q',
+    write_bytes='q',
+)
+
+# fields that only ever increase while the process is running
+COUNTER_FIELDS = ('cpu_time', 'voluntary_switches', 'involuntary_switches', 'read_bytes', 'write_bytes')
+
+
+def read_process_sample(pid, proc_path=PROC_PATH):
+    """
+    Read the resource usage of a process from ``/proc/<pid>/stat``, ``status``
+    and ``io``. Returns a ProcessSample, or None if the process is gone.
+    I/O counters are reported as 0 if ``io`` can't be read.
+    """
+    base = '%s/%d' % (proc_path, pid)
+
+    try:
+        with open('%s/stat' % base) as f:
+            stat = f.read()
+
+        with open('%s/status' % base) as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except (IOError, OSError):
+        return None
+
+    # the command name in parentheses may contain spaces, fields start after it
+    fields = stat[stat.rindex(')') + 2:].split()
+
+    io = {}
+    try:
+        with open('%s/io' % base) as f:
+            io = dict(line.split(':', 1) for line in f if ':' in line)
+    except (IOError, OSError) as e:
+        logger.debug('Could not read I/O counters of process %d: %s', pid, e)
+
+    return ProcessSample(
+        time=time.time(),
+        cpu_time=(int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS),
+        rss=int(fields[21]) * PAGE_SIZE,
+        threads=int(fields[17]),
+        voluntary_switches=int(status.get('voluntary_ctxt_switches', 0)),
+        involuntary_switches=int(status.get('nonvoluntary_ctxt_switches', 0)),
+        read_bytes=int(io.get('read_bytes', 0)),
+        write_bytes=int(io.get('write_bytes', 0)),
+    )
+
+
+class SampleSeries(object):
+
+    """
+    Fixed-size time series of process samples.
+
+    Every field is kept in its own typed array, so a sample takes about 60
+    bytes no matter how many are stored. The arrays grow until ``capacity``
+    samples are held, after which the oldest sample is overwritten.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        self.columns = [array.array(typecode) for typecode in SAMPLE_TYPECODES]
+        self.start = 0
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns)
+
+    def append(self, sample):
+        with self.lock:
+            if len(self) < self.capacity:
+                for column, value in zip(self.columns, sample):
+                    column.append(value)
+            else:
+                for column, value in zip(self.columns, sample):
+                    column[self.start] = value
+
+                self.start = (self.start + 1) % self.capacity
+
+    def latest(self):
+        """
+        Return the most recent sample, or None if there are none.
+        """
+        with self.lock:
+            count = len(self)
+            if not count:
+                return None
+
+            return ProcessSample(*[column[(self.start - 1) % count] for column in self.columns])
+
+    def get_samples(self, since=None):
+        """
+        Return the samples taken at or after the timestamp ``since`` (all
+        samples if None), oldest first.
+        """
+        with self.lock:
+            count = len(self)
+            first = self._find(since) if since is not None else 0
+
+            return [
+                ProcessSample(*[column[(self.start + i) % count] for column in self.columns])
+                for i in range(first, count)
+            ]
+
+    def _find(self, timestamp):
+        # binary search for the first sample not older than timestamp
+        times = self.columns[0]
+        count = len(times)
+
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if times[(self.start + middle) % count] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+class ResourceSampler(threading.Thread):
+
+    """
+    Thread that samples the resource usage of every running server process
+    each ``interval`` seconds, keeping ``retention`` seconds of samples per
+    server. It also checks whether the processes are still alive, see
+    MinecraftServer.check_exit.
+    """
+
+    def __init__(self, servers, interval, retention):
+        super(ResourceSampler, self).__init__()
+        self.daemon = True
+
+        self.servers = servers
+        self.interval = interval
+
+        capacity = max(int(retention // interval), 1) if interval > 0 else 1
+        self.series = dict((name, SampleSeries(capacity)) for name in servers)
+
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                logger.exception('Error sampling server resource usage')
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self):
+        """
+        Take one sample of every running server.
+        """
+        for name, server in self.servers.items():
+            pipe = server.pipe
+            if not pipe or server.check_exit():
+                continue
+
+            sample = read_process_sample(pipe.pid)
+            if sample:
+                self.series[name].append(sample)
+
+
+def summarize_samples(samples):
+    """
+    Summarize a list of samples of one process: average and peak CPU usage in
+    percent of one core, current and peak RSS, current thread count and the
+    rates of context switches and I/O per second. Rates need at least two
+    samples and are None otherwise.
+    """
+    last = samples[-1]
+
+    summary = {
+        'samples': len(samples),
+        'since': samples[0].time,
+        'rss': last.rss,
+        'max_rss': max(sample.rss for sample in samples),
+        'threads': last.threads,
+        'cpu_percent': None,
+        'max_cpu_percent': None,
+        'voluntary_switches_per_sec': None,
+        'involuntary_switches_per_sec': None,
+        'read_bytes_per_sec': None,
+        'write_bytes_per_sec': None,
+    }
+
+    rates = [
+        _rate(previous, sample)
+        for previous, sample in zip(samples, samples[1:])
+        if sample.time > previous.time
+    ]
+    rates = [rate for rate in rates if rate]
+    if not rates:
+        return summary
+
+    elapsed = sum(rate['elapsed'] for rate in rates)
+    for field in COUNTER_FIELDS[1:]:
+        summary[field + '_per_sec'] = sum(rate[field] for rate in rates) / elapsed
+
+    summary['cpu_percent'] = sum(rate['cpu_time'] for rate in rates) / elapsed * 100
+    summary['max_cpu_percent'] = max(rate['cpu_time'] / rate['elapsed'] for rate in rates) * 100
+
+    return summary
+
+
+def _rate(previous, sample):
+    # counters start over when the server is restarted, skip that interval
+    if sample.cpu_time < previous.cpu_time:
+        return None
+
+    rate = {'elapsed': sample.time - previous.time}
+    for field in COUNTER_FIELDS:
+        rate[field] = max(getattr(sample, field) - getattr(previous, field), 0)
+
+    return rate
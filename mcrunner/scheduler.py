@@ -0,0 +1,203 @@
+from __future__ import absolute_import
+
+import collections
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MEMINFO_PATH = '/proc/meminfo'
+
+HEAP_OPTION_RE = re.compile(r'^-Xm([sx])(\d+)([kmgt]?)$', re.IGNORECASE)
+SIZE_MULTIPLIERS = {
+    '': 1,
+    'k': 1024,
+    'm': 1024 ** 2,
+    'g': 1024 ** 3,
+    't': 1024 ** 4,
+}
+
+MB = 1024 * 1024
+
+QueuedStart = collections.namedtuple('QueuedStart', ['name', 'heap_size', 'queued_at'])
+
+
+def parse_heap_size(opts):
+    """
+    Return the maximum heap size in bytes set by the JVM options in ``opts``
+    (``-Xmx``, or ``-Xms`` if no maximum is set), or None if neither is set.
+    Like the JVM, the last occurrence of an option wins.
+    """
+    sizes = {}
+
+    for opt in (opts or '').split():
+        match = HEAP_OPTION_RE.match(opt)
+        if match:
+            kind, value, unit = match.groups()
+            sizes[kind.lower()] = int(value) * SIZE_MULTIPLIERS[unit.lower()]
+
+    return sizes.get('x', sizes.get('s'))
+
+
+def read_memory_total(path=MEMINFO_PATH):
+    """
+    Return the total memory of the host in bytes as reported by /proc/meminfo,
+    or None if it can't be read.
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    # the value is always reported in kB
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError) as e:
+        logger.warning('Could not read total memory from %s: %s', path, e)
+
+    return None
+
+
+class StartScheduler(object):
+
+    """
+    Admission control for server starts based on heap size.
+
+    Every started server commits its maximum heap size against a memory
+    ``budget``. A start that would exceed the budget waits in a FIFO queue
+    until enough memory is released by servers being stopped. Queued starts
+    are also staggered: they are let through one at a time, each once the
+    servers started before it are ready. A server is always admitted if
+    nothing else is committed, so a server larger than the budget can still
+    run on its own. With a budget of None starts are never queued.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+        self.committed = {}
+        self.starting = set()
+        self.queue = []
+
+        self.condition = threading.Condition()
+
+    @property
+    def committed_size(self):
+        return sum(self.committed.values())
+
+    def acquire(self, name, heap_size, connection=None):
+        """
+        Wait until the server of the given name can be started and commit its
+        heap size. Returns False without waiting if the server already holds a
+        commitment or is already queued, and once its queued start is
+        cancelled.
+        """
+        entry = QueuedStart(name, heap_size or 0, time.time())
+
+        with self.condition:
+            if name in self.committed or self._find(name):
+                return False
+
+            self.queue.append(entry)
+            admitted = self._can_start(entry, staggered=False)
+
+        if not admitted:
+            message = 'Minecraft server "%s" queued, waiting for %d MB of memory (%d of %d MB committed)...' % (
+                name,
+                entry.heap_size // MB,
+                self.committed_size // MB,
+                self.budget // MB,
+            )
+            logger.info(message)
+            if connection:
+                connection.send_message(message)
+
+        with self.condition:
+            try:
+                while not self._can_start(entry, staggered=not admitted):
+                    if self._find(name) is not entry:
+                        logger.info('Queued start of Minecraft server "%s" cancelled', name)
+                        return False
+
+                    self.condition.wait()
+            finally:
+                if self._find(name) is entry:
+                    self.queue.remove(entry)
+
+                # the next start in line may fit now
+                self.condition.notify_all()
+
+            self.committed[name] = entry.heap_size
+            self.starting.add(name)
+
+        if not admitted:
+            logger.info('Minecraft server "%s" left the start queue after %.1f seconds',
+                        name, time.time() - entry.queued_at)
+
+        return True
+
+    def cancel(self, name):
+        """
+        Remove the queued start of the server of the given name, if any. The
+        waiting ``acquire`` returns False. Returns whether a start was queued.
+        """
+        with self.condition:
+            entry = self._find(name)
+            if entry is None:
+                return False
+
+            self.queue.remove(entry)
+            self.condition.notify_all()
+
+        return True
+
+    def ready(self, name):
+        """
+        Mark the server of the given name as done starting, letting the next
+        queued start through.
+        """
+        with self.condition:
+            if name in self.starting:
+                self.starting.discard(name)
+                self.condition.notify_all()
+
+    def release(self, name):
+        """
+        Release the memory committed by the server of the given name.
+        """
+        with self.condition:
+            self.starting.discard(name)
+
+            if self.committed.pop(name, None) is not None:
+                self.condition.notify_all()
+
+    def get_queue_status(self, name):
+        """
+        Return a (position, seconds waited) tuple for a server waiting in the
+        start queue, or None if it isn't queued. Positions start at 1.
+        """
+        with self.condition:
+            for position, entry in enumerate(self.queue, 1):
+                if entry.name == name:
+                    return position, time.time() - entry.queued_at
+
+        return None
+
+    def _find(self, name):
+        for entry in self.queue:
+            if entry.name == name:
+                return entry
+
+        return None
+
+    def _can_start(self, entry, staggered):
+        if not self.queue or self.queue[0] is not entry:
+            return False
+
+        if staggered and self.starting:
+            return False
+
+        if self.budget is None or not entry.heap_size or not self.committed:
+            return True
+
+        return self.committed_size + entry.heap_size <= self.budget
@@ -1,6 +1,12 @@
 from __future__ import absolute_import
 
+import collections
+import functools
 import logging
+import os
+import re
+import threading
+import time
 
 try:
     # Python 2.x
@@ -9,12 +15,65 @@ except ImportError:
     # Python 3.x
     import subprocess
 
-from mcrunner.exceptions import ServerNotRunningException, ServerStartException
+from mcrunner.console import COMMAND_BURST, CommandLimiter, CommandWriter, ConsoleBuffer, OutputPump
+from mcrunner.events import LAG, ConsoleEventParser, EventCounters
+from mcrunner.exceptions import (
+    CommandNotDeliveredException,
+    ConfigException,
+    MCRunnerException,
+    ServerAlreadyRunningException,
+    ServerNotRunningException,
+    ServerStartException,
+)
+from mcrunner.plugins import PluginManifest, PluginUpdateMonitor
+from mcrunner.scheduler import parse_heap_size
 from mcrunner.server_status import ServerStatus
+from mcrunner.supervisor import RESTART_NEVER, RESTART_POLICIES
 
 logger = logging.getLogger(__name__)
 
 SERVER_STOP_TIMEOUT_SEC = 60
+SERVER_TERMINATE_TIMEOUT_SEC = 10
+SERVER_START_TIMEOUT_SEC = 300
+
+# number of crashes remembered per server
+CRASH_HISTORY_SIZE = 10
+
+CrashRecord = collections.namedtuple('CrashRecord', ['time', 'returncode', 'uptime', 'lines'])
+
+# Logged by vanilla, Spigot and Forge servers once the worlds are loaded
+DEFAULT_READY_PATTERN = r'Done \([0-9.,]+s\)!'
+
+# number of lag warnings remembered per server
+LAG_WARNING_HISTORY_SIZE = 100
+
+# Commands that have the same effect when sent twice in a row
+DEFAULT_COALESCE_COMMANDS = '\n'.join(['save-all', 'save-all flush', 'whitelist reload'])
+
+
+def _synchronized(func):
+    """
+    Serialize calls of the decorated method on the server's lifecycle lock.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _convert_option(default, value):
+    """
+    Convert a raw config string to the type of the attribute default it overrides.
+    """
+    if isinstance(value, str) and not isinstance(default, bool):
+        if isinstance(default, int):
+            return int(value)
+        elif isinstance(default, float):
+            return float(value)
+
+    return value
 
 
 class MinecraftServer(object):
@@ -30,10 +89,48 @@ class MinecraftServer(object):
     opts = None
 
     restart_on_plugin_update = False
+    plugin_quiet_period = 10
+    console_buffer_size = 1048576
+    console_log_segment_size = 16777216
+    console_log_max_size = 1073741824
+    console_log_max_age = 2592000
+    ready_patterns = DEFAULT_READY_PATTERN
+    start_timeout = SERVER_START_TIMEOUT_SEC
+    restart_policy = RESTART_NEVER
+    restart_delay = 5
+    restart_max_delay = 300
+    crash_loop_count = 5
+    crash_loop_window = 600
+    crash_log_lines = 50
+    health_check = False
+    health_threshold = 40
+    health_silence = 300
+    probe_interval = 60
+    probe_timeout = 30
+    probe_command = 'list'
+    command_quiet_period = 0.5
+    command_timeout = 5.0
+    command_queue_size = 100
+    command_delivery_timeout = 10.0
+    command_rate = 0.0
+    command_burst = COMMAND_BURST
+    coalesce_commands = DEFAULT_COALESCE_COMMANDS
 
     pipe = None
+    status = ServerStatus.STOPPED
+    launched_at = None
+    startup_time = None
+    last_output_at = None
+    start_count = 0
+    restart_count = 0
+    crash_count = 0
     output = None
-    plugin_change_observer = None
+    output_pump = None
+    console_log = None
+    command_writer = None
+    restart_handler = None
+    crash_handler = None
+    clean_exit_handler = None
 
     def __init__(self, name, path, jar, opts, **kwargs):
         self.name = name
@@ -41,9 +138,49 @@ class MinecraftServer(object):
         self.jar = jar
         self.opts = opts
 
+        self.lock = threading.RLock()
+        self.command_lock = threading.Lock()
+        self.status_condition = threading.Condition()
+        self.status_listeners = []
+
         for k, v in kwargs.items():
             if hasattr(self, k):
-                setattr(self, k, v)
+                setattr(self, k, _convert_option(getattr(self, k), v))
+
+        if self.restart_policy not in RESTART_POLICIES:
+            raise ConfigException('Invalid restart_policy for server "%s": %s' % (name, self.restart_policy))
+
+        self.output = ConsoleBuffer(self.console_buffer_size)
+        self.crashes = collections.deque(maxlen=CRASH_HISTORY_SIZE)
+
+        # (time, milliseconds behind) of recent lag warnings
+        self.lag_warnings = collections.deque(maxlen=LAG_WARNING_HISTORY_SIZE)
+
+        self.event_parser = ConsoleEventParser()
+        self.events = EventCounters()
+
+        # one regular expression per line, matched against raw console lines
+        self.ready_res = [
+            re.compile(pattern.strip().encode('utf8'))
+            for pattern in (self.ready_patterns or '').splitlines() if pattern.strip()
+        ]
+
+        self.plugin_manifest = PluginManifest(os.path.join(self.path, 'plugins'))
+        self.plugin_monitor = PluginUpdateMonitor(self)
+
+        # kept across restarts, so its counters cover the lifetime of the daemon
+        self.command_limiter = CommandLimiter(
+            self.command_rate,
+            self.command_burst,
+            [command.strip() for command in (self.coalesce_commands or '').splitlines() if command.strip()]
+        )
+
+    @property
+    def heap_size(self):
+        """
+        Maximum heap size of the server jar in bytes according to its JVM options.
+        """
+        return parse_heap_size(self.opts)
 
     def _start_jar(self, args):
         self.pipe = subprocess.Popen(
@@ -54,10 +191,187 @@ class MinecraftServer(object):
             stderr=subprocess.PIPE
         )
 
+        self.command_writer = CommandWriter(
+            self.pipe.stdin,
+            maxlen=self.command_queue_size,
+            on_broken=self._handle_input_closed,
+            limiter=self.command_limiter
+        )
+        self.command_writer.start()
+
+        self.output_pump = OutputPump(
+            [self.pipe.stdout, self.pipe.stderr],
+            self._handle_output_line,
+            functools.partial(self._handle_exit, self.pipe, self.command_writer)
+        )
+        self.output_pump.start()
+
+    def _handle_input_closed(self):
+        logger.warning('Minecraft server "%s" closed its input, commands can no longer be delivered', self.name)
+
+    def _handle_output_line(self, line):
+        self.output.append(line)
+        self.last_output_at = time.time()
+
+        if self.console_log:
+            self.console_log.append(line, self.last_output_at)
+
+        for event in self.event_parser.parse(line, self.last_output_at):
+            self._handle_event(event)
+
+        if self.status == ServerStatus.STARTING and any(ready_re.search(line) for ready_re in self.ready_res):
+            self._handle_ready()
+
+    def _handle_event(self, event):
+        self.events.add(event)
+
+        if event.type == LAG:
+            self.lag_warnings.append((event.time, event.data['ms']))
+
+    def _handle_ready(self):
+        """
+        Called when a readiness pattern shows up in the console of a starting
+        server. Records the time it took from launching the jar.
+        """
+        with self.status_condition:
+            if self.status != ServerStatus.STARTING:
+                return
+
+            if self.launched_at is not None:
+                self.startup_time = time.time() - self.launched_at
+
+        if self.startup_time is not None:
+            logger.info('Minecraft server "%s" ready after %.1f seconds', self.name, self.startup_time)
+
+        self._set_status(ServerStatus.RUNNING, from_statuses=(ServerStatus.STARTING,))
+
+    def _handle_exit(self, pipe, command_writer=None):
+        """
+        Called by the output pump once the server process closed its output,
+        which happens when it exits, or by check_exit.
+        """
+        if command_writer:
+            command_writer.close()
+
+        # a stack trace may have been the last output
+        event = self.event_parser.flush()
+        if event:
+            self._handle_event(event)
+
+        returncode = pipe.wait()
+
+        with self.status_condition:
+            # the exit may already have been handled by stop(), and a newer
+            # process may have been started since
+            if self.pipe is not pipe:
+                return
+
+            self.pipe = None
+            stopping = self.status == ServerStatus.STOPPING
+
+        crash = None
+        clean_exit = not stopping and returncode == 0
+        if clean_exit:
+            # such as after a "stop" typed into the console
+            logger.info('Minecraft server "%s" exited cleanly', self.name)
+        elif not stopping:
+            crash = self._record_crash(returncode)
+
+        self._set_status(ServerStatus.STOPPED)
+
+        if crash and self.crash_handler:
+            try:
+                self.crash_handler(self, crash)
+            except Exception:
+                logger.exception('Error in crash handler of Minecraft server "%s"', self.name)
+        elif clean_exit and self.clean_exit_handler:
+            try:
+                self.clean_exit_handler(self, time.time())
+            except Exception:
+                logger.exception('Error in exit handler of Minecraft server "%s"', self.name)
+
+    def check_exit(self):
+        """
+        Handle the exit of the server process if it exited while its output
+        is still held open, for example by a child process that inherited
+        it, so the output pump never reaches the end of it. Called
+        periodically. Returns True if the process has exited.
+        """
+        pipe = self.pipe
+        if pipe is None or pipe.poll() is None:
+            return False
+
+        logger.info('Minecraft server "%s" process exited with its output still open', self.name)
+
+        self._handle_exit(pipe, self.command_writer)
+
+        return True
+
+    def _record_crash(self, returncode):
+        """
+        Remember the exit code and the last ``crash_log_lines`` console lines of
+        a server process that exited unexpectedly. Returns the CrashRecord.
+        """
+        now = time.time()
+        lines = self.output.get_lines(self.crash_log_lines)
+
+        crash = CrashRecord(now, returncode, now - self.launched_at if self.launched_at else None, lines)
+
+        self.crash_count += 1
+        self.crashes.append(crash)
+
+        logger.warning('Minecraft server "%s" exited unexpectedly with code %s', self.name, returncode)
+        if lines:
+            logger.warning(
+                'Last console output of Minecraft server "%s":\n%s',
+                self.name, '\n'.join(line.decode('utf8', 'replace') for line in lines)
+            )
+
+        return crash
+
+    def add_status_listener(self, listener):
+        """
+        Register ``listener(server, status)`` to be called on every status change.
+        """
+        self.status_listeners.append(listener)
+
+    def _set_status(self, status, from_statuses=None):
+        """
+        Move to ``status``, but only if the current status is one of
+        ``from_statuses`` when given. Returns True if the status changed.
+        """
+        with self.status_condition:
+            if status == self.status or (from_statuses and self.status not in from_statuses):
+                return False
+
+            logger.info('Minecraft server "%s" is now %s', self.name, status.value.lower())
+
+            self.status = status
+            self.status_condition.notify_all()
+
+        for listener in self.status_listeners:
+            try:
+                listener(self, status)
+            except Exception:
+                logger.exception('Error in status listener of Minecraft server "%s"', self.name)
+
+        return True
+
+    @_synchronized
     def start(self, connection=None):
         """
-        Start the Minecraft server jar.
+        Start the Minecraft server jar. Raises ServerAlreadyRunningException
+        unless the server is stopped.
         """
+        if self.status != ServerStatus.STOPPED:
+            message = 'Minecraft server "%s" already running.' % self.name
+
+            logger.info(message)
+            if connection:
+                connection.send_message(message)
+
+            raise ServerAlreadyRunningException
+
         args = ['/usr/bin/java']
         args.extend(self.opts.split())
         args.extend([
@@ -70,6 +384,15 @@ class MinecraftServer(object):
         if connection:
             connection.send_message(message)
 
+        # the plugins the server is about to load
+        self.plugin_manifest.mark_started()
+
+        self.launched_at = time.time()
+        self.startup_time = None
+
+        # set before the output pump runs, which may see the process exit right away
+        self._set_status(ServerStatus.STARTING)
+
         try:
             self._start_jar(args)
         except OSError as e:
@@ -79,24 +402,58 @@ class MinecraftServer(object):
             if connection:
                 connection.send_message(message)
 
+            self._set_status(ServerStatus.STOPPED)
+
             raise ServerStartException(e)
 
-        message = 'Minecraft server "%s" started.' % self.name
+        self.start_count += 1
+
+        if not self.ready_res:
+            # nothing to wait for, consider the server ready right away
+            self._set_status(ServerStatus.RUNNING, from_statuses=(ServerStatus.STARTING,))
+
+    def wait_until_ready(self, timeout, connection=None):
+        """
+        Wait up to ``timeout`` seconds for a started server to finish loading.
+        Returns True if the server is running.
+        """
+        deadline = time.time() + timeout
+
+        with self.status_condition:
+            while self.status == ServerStatus.STARTING:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                self.status_condition.wait(remaining)
+
+            status = self.status
+            startup_time = self.startup_time
+
+        if status == ServerStatus.RUNNING:
+            if startup_time is None:
+                message = 'Minecraft server "%s" started.' % self.name
+            else:
+                message = 'Minecraft server "%s" started in %.1f seconds.' % (self.name, startup_time)
+        elif status == ServerStatus.STARTING:
+            message = 'Minecraft server "%s" did not finish starting within %s seconds.' % (self.name, timeout)
+        else:
+            message = 'Minecraft server "%s" exited while starting.' % self.name
+
         logger.info(message)
         if connection:
             connection.send_message(message)
 
-        if self.restart_on_plugin_update and not self.plugin_change_observer:
-            self.plugin_change_observer = self._get_plugin_change_observer()
-            if self.plugin_change_observer:
-                logger.info('Starting plugin change observer for server "%s"' % self.name)
-                self.plugin_change_observer.start()
+        return status == ServerStatus.RUNNING
 
-    def stop(self, connection=None):
+    @_synchronized
+    def stop(self, connection=None, timeout=SERVER_STOP_TIMEOUT_SEC):
         """
-        Attempt to stop the running jar.
+        Attempt to stop the running jar. If it doesn't exit within ``timeout``
+        seconds it is terminated, and killed if it ignores the termination.
         """
-        if not self.pipe:
+        pipe = self.pipe
+        if not pipe:
             if connection:
                 connection.send_message('Minecraft server "%s" not running.' % self.name)
 
@@ -107,25 +464,51 @@ class MinecraftServer(object):
         if connection:
             connection.send_message(message)
 
-        self.run_command('stop')
+        self._set_status(ServerStatus.STOPPING)
+
+        try:
+            self.run_command('stop', wait=False, priority=True)
+        except MCRunnerException as e:
+            # the process is terminated below if it doesn't exit
+            logger.warning('Could not send stop command to Minecraft server "%s": %r', self.name, e)
 
         try:
-            self.pipe.wait(timeout=SERVER_STOP_TIMEOUT_SEC)
+            pipe.wait(timeout=timeout)
         except subprocess.TimeoutExpired:
-            message = 'Server "%s" did not stop within %s seconds. Killing...' % (self.name, SERVER_STOP_TIMEOUT_SEC)
+            message = 'Server "%s" did not stop within %s seconds. Killing...' % (self.name, timeout)
             logger.info(message)
             if connection:
                 connection.send_message(message)
 
-            self.pipe.terminate()
+            self._terminate(pipe)
         else:
             message = 'Minecraft server "%s" stopped.' % self.name
             logger.info(message)
             if connection:
                 connection.send_message(message)
 
-        self.pipe = None
+        with self.status_condition:
+            if self.pipe is pipe:
+                self.pipe = None
+
+        self._set_status(ServerStatus.STOPPED)
+
+    def _terminate(self, pipe):
+        """
+        Send SIGTERM to the server process and wait for it to exit, escalating
+        to SIGKILL if it is still alive after SERVER_TERMINATE_TIMEOUT_SEC.
+        """
+        pipe.terminate()
+
+        try:
+            pipe.wait(timeout=SERVER_TERMINATE_TIMEOUT_SEC)
+        except subprocess.TimeoutExpired:
+            logger.warning('Server "%s" did not exit after SIGTERM, sending SIGKILL' % self.name)
+
+            pipe.kill()
+            pipe.wait()
 
+    @_synchronized
     def restart(self, plugin_update=False):
         """
         Restart the server.
@@ -135,6 +518,8 @@ class MinecraftServer(object):
         if plugin_update:
             logger.info('Detected plugin update, beginning automatic restart.')
 
+        self.restart_count += 1
+
         try:
             self.stop()
         except ServerNotRunningException:
@@ -143,45 +528,127 @@ class MinecraftServer(object):
 
         self.start()
 
+    def handle_plugin_update(self):
+        """
+        Called by the plugin update monitor when plugin jars changed. The
+        restart is left to ``restart_handler(server)`` if one is set, so that
+        the owner of the server can apply its own start policy.
+        """
+        if not self.restart_handler:
+            self.restart(plugin_update=True)
+            return
+
+        logger.info('Detected plugin update, beginning automatic restart.')
+        self.restart_handler(self)
+
     def get_status(self):
         """
-        Get the status of the server jar
+        Get the status of the server jar. The status is tracked as the server
+        is started and stopped, becomes ready and exits, so this never
+        communicates with the server process.
         """
-        try:
-            self.run_command('ping')
-        except ServerNotRunningException:
-            return ServerStatus.STOPPED
+        return self.status
 
-        return ServerStatus.RUNNING
+    def get_command_queue_depth(self):
+        """
+        Number of commands waiting to be written to the server process.
+        """
+        command_writer = self.command_writer
 
-    def run_command(self, command, connection=None):
+        return command_writer.get_queue_depth() if command_writer else 0
+
+    def run_command(self, command, connection=None, capture=False, quiet_period=None, terminator=None, timeout=None,
+                    wait=True, priority=False):
         """
-        Attempt to run a command on the server.
+        Attempt to run a command on the server. Commands are serialized, so
+        the output of one command is never attributed to another.
+
+        Commands are queued for delivery to the server process. Unless
+        ``wait`` is false, this waits until the command was written, raising
+        CommandNotDeliveredException if that takes longer than
+        ``command_delivery_timeout`` seconds. CommandQueueFullException is
+        raised if too many commands are waiting already.
+
+        If ``capture`` is true, the console lines written in response are
+        collected and returned. Capturing ends once the compiled regular
+        expression ``terminator`` matches a line, or when no line was written
+        for ``quiet_period`` seconds after the first one. It ends after
+        ``timeout`` seconds at the latest. Lines written by the server for
+        other reasons within that window are returned as well.
+
+        A ``priority`` command is written ahead of all queued commands,
+        regardless of the queue size and rate limit. Unless captured, it
+        doesn't wait for commands whose output is being captured either.
         """
-        if not self.pipe:
-            raise ServerNotRunningException
+        return self.run_commands(
+            [command],
+            connection=connection,
+            capture=capture,
+            quiet_period=quiet_period,
+            terminator=terminator,
+            timeout=timeout,
+            wait=wait,
+            priority=priority
+        )
 
-        try:
-            self.pipe.stdin.write('%s\n' % command)
-        except Exception:
+    def run_commands(self, commands, connection=None, capture=False, quiet_period=None, terminator=None, timeout=None,
+                     wait=True, priority=False):
+        """
+        Run several commands on the server, see run_command. The commands are
+        delivered to the server process together in a single write, and the
+        output of all of them is captured as one.
+        """
+        if priority and not capture:
+            self._write_commands(commands, wait, priority)
+            return None
+
+        with self.command_lock:
+            if not capture:
+                self._write_commands(commands, wait)
+                return None
+
+            _, subscription = self.output.subscribe()
+
+            try:
+                self._write_commands(commands, wait, priority)
+
+                return self._capture_output(
+                    subscription,
+                    self.command_quiet_period if quiet_period is None else quiet_period,
+                    terminator,
+                    self.command_timeout if timeout is None else timeout
+                )
+            finally:
+                self.output.unsubscribe(subscription)
+
+    def _write_commands(self, commands, wait=True, priority=False):
+        command_writer = self.command_writer
+        if not self.pipe or not command_writer:
             raise ServerNotRunningException
 
-    def _get_plugin_change_observer(self):
-        try:
-            from watchdog.observers import Observer
-            from mcrunner.plugin_change import PluginChangeEventHandler
-        except ImportError:
-            logger.warning('Cannot start plugin change observer, watchdog package not installed.')
-            return None
+        data = ''.join('%s\n' % command for command in commands).encode('utf8')
+        pending = command_writer.put(data, priority=priority)
 
-        path = '%s/plugins/' % self.path
-        event_handler = PluginChangeEventHandler(self)
-        observer = Observer()
+        if wait and not pending.wait(self.command_delivery_timeout):
+            raise CommandNotDeliveredException
 
-        try:
-            observer.schedule(event_handler, path, recursive=False)
-        except OSError as e:
-            logger.warning('Cannot start plugin change observer, reason: %s.' % str(e))
-            return None
+    def _capture_output(self, subscription, quiet_period, terminator, timeout):
+        deadline = time.time() + timeout
+        captured = []
+
+        while not subscription.closed:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            lines = subscription.get(timeout=min(quiet_period, remaining) if captured else remaining)
+            if not lines and captured:
+                break
+
+            for line in lines:
+                captured.append(line)
+
+                if terminator and terminator.search(line):
+                    return captured
 
-        return observer
+        return captured
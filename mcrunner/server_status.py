@@ -4,6 +4,8 @@ from enum import Enum
 
 
 class ServerStatus(Enum):
+    QUEUED = 'Queued'
     STARTING = 'Starting'
     RUNNING = 'Running'
+    STOPPING = 'Stopping'
     STOPPED = 'Stopped'
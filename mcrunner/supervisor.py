@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+
+import collections
+import logging
+import random
+import threading
+import time
+
+from mcrunner.server_status import ServerStatus
+
+logger = logging.getLogger(__name__)
+
+RESTART_NEVER = 'never'
+RESTART_ON_FAILURE = 'on-failure'
+RESTART_ALWAYS = 'always'
+
+RESTART_POLICIES = (RESTART_NEVER, RESTART_ON_FAILURE, RESTART_ALWAYS)
+
+
+def get_restart_delay(attempt, base_delay, max_delay, random=random.random):
+    """
+    Delay in seconds before restart number ``attempt`` (starting at 0) of a
+    crashed server. The delay doubles with every attempt up to ``max_delay``,
+    and is spread over the upper half of that range so servers that crashed
+    together don't all restart at the same moment.
+    """
+    delay = min(base_delay * 2 ** attempt, max_delay)
+
+    return delay / 2.0 * (1 + random())
+
+
+class SupervisedServer(object):
+
+    """
+    Restart state of a single supervised server.
+    """
+
+    def __init__(self):
+        self.crash_times = collections.deque()
+        self.generation = 0
+        self.timer = None
+        self.restart_at = None
+        self.crash_loop = False
+
+
+class Supervisor(object):
+
+    """
+    Restarts servers that exited unexpectedly according to their
+    ``restart_policy``.
+
+    Restarts are delayed with exponential backoff and jitter. A server that
+    crashes ``crash_loop_count`` times within ``crash_loop_window`` seconds is
+    in a crash loop and is left stopped until it is started by hand. The
+    actual start is left to ``start_handler(name)``, so restarts go through
+    the same scheduling as any other start.
+    """
+
+    def __init__(self, start_handler, random=random.random):
+        self.start_handler = start_handler
+        self.random = random
+
+        self.servers = collections.defaultdict(SupervisedServer)
+        self.lock = threading.Lock()
+
+    def handle_crash(self, server, crash):
+        """
+        Called when ``server`` exited unexpectedly. Schedules its restart if
+        its restart policy asks for one.
+        """
+        if server.restart_policy == RESTART_NEVER:
+            return
+
+        self._schedule_restart(server, crash.time)
+
+    def handle_clean_exit(self, server, when):
+        """
+        Called when ``server`` exited with code 0 at ``when`` without being
+        stopped through mcrunnerd. Only the ``always`` policy restarts it,
+        still subject to the backoff and crash loop detection so a server
+        that keeps exiting right away isn't restarted endlessly.
+        """
+        if server.restart_policy != RESTART_ALWAYS:
+            logger.info('Minecraft server "%s" exited cleanly, not restarting', server.name)
+            return
+
+        self._schedule_restart(server, when)
+
+    def _schedule_restart(self, server, when):
+        with self.lock:
+            state = self.servers[server.name]
+
+            state.crash_times.append(when)
+            while state.crash_times[0] < when - server.crash_loop_window:
+                state.crash_times.popleft()
+
+            self._cancel(state)
+
+            if len(state.crash_times) >= server.crash_loop_count:
+                state.crash_loop = True
+
+                logger.error(
+                    'Minecraft server "%s" crashed %d times within %d seconds, not restarting until started manually',
+                    server.name, len(state.crash_times), server.crash_loop_window
+                )
+                return
+
+            delay = get_restart_delay(
+                len(state.crash_times) - 1, server.restart_delay, server.restart_max_delay, random=self.random
+            )
+
+            state.restart_at = time.time() + delay
+            state.timer = threading.Timer(delay, self._restart, args=(server, state.generation))
+            state.timer.daemon = True
+            state.timer.start()
+
+        logger.info('Restarting Minecraft server "%s" in %.1f seconds', server.name, delay)
+
+    def _restart(self, server, generation):
+        with self.lock:
+            state = self.servers[server.name]
+
+            # cancelled after the timer fired
+            if state.generation != generation:
+                return
+
+            state.timer = None
+            state.restart_at = None
+
+        if server.get_status() != ServerStatus.STOPPED:
+            logger.info('Minecraft server "%s" already started, skipping restart', server.name)
+            return
+
+        logger.info('Automatically restarting Minecraft server "%s"', server.name)
+
+        try:
+            self.start_handler(server.name)
+        except Exception:
+            logger.exception('Error restarting Minecraft server "%s"', server.name)
+
+    def reset(self, name):
+        """
+        Cancel a pending restart of a server and forget its crashes, for
+        example because it is started or stopped by hand.
+        """
+        with self.lock:
+            state = self.servers.get(name)
+            if not state:
+                return
+
+            self._cancel(state)
+            state.crash_times.clear()
+            state.crash_loop = False
+
+    def stop(self):
+        """
+        Cancel all pending restarts.
+        """
+        with self.lock:
+            for state in self.servers.values():
+                self._cancel(state)
+
+    def get_state(self, name):
+        """
+        Return the SupervisedServer state of a server, or None if it never
+        crashed.
+        """
+        return self.servers.get(name)
+
+    def _cancel(self, state):
+        if state.timer:
+            state.timer.cancel()
+
+        state.generation += 1
+        state.timer = None
+        state.restart_at = None
@@ -1,7 +1,30 @@
+import json
+import socket
+import threading
 import unittest
 import mock
 
-from mcrunner.connection import BaseSocketConnection, ServerSocketConnection
+from mcrunner.exceptions import ProtocolException
+from mcrunner.connection import (
+    FRAME_HEADER,
+    MAX_FRAME_SIZE,
+    RECEIVE_BUFFER_SIZE,
+    SEND_COALESCE_SIZE,
+    BaseSocketConnection,
+    ClientSocketConnection,
+    RequestConnection,
+    ServerSocketConnection,
+)
+from mcrunner.protocol import (
+    PROTOCOL_VERSION,
+    RESPONSE_DATA,
+    RESPONSE_END,
+    RESPONSE_MESSAGE,
+    Request,
+    ResponseStatus,
+    encode_request,
+    encode_response,
+)
 
 
 class BaseSocketConnectionTestCase(unittest.TestCase):
@@ -15,11 +38,46 @@ class BaseSocketConnectionTestCase(unittest.TestCase):
         assert mock_sock.sendall.call_count == 1
         assert mock_sock.sendall.call_args[0] == (b'\x00\x00\x00\x0csome message',)
 
+    def test_send_message_unicode(self):
+        mock_sock = mock.MagicMock()
+        connection = BaseSocketConnection(mock_sock)
+
+        connection.send_message(u'caf\xe9')
+
+        assert mock_sock.sendall.call_args[0] == (b'\x00\x00\x00\x05caf\xc3\xa9',)
+
+    def test_send_message_large(self):
+        mock_sock = mock.MagicMock()
+        connection = BaseSocketConnection(mock_sock)
+
+        payload = b'x' * SEND_COALESCE_SIZE
+
+        connection.send_message(payload)
+
+        assert mock_sock.sendall.call_args_list == [
+            mock.call(FRAME_HEADER.pack(SEND_COALESCE_SIZE)),
+            mock.call(payload),
+        ]
+
+    def _recv_into(self, chunks):
+        chunks = list(chunks)
+
+        def recv_into(view):
+            if not chunks:
+                return 0
+
+            chunk = chunks.pop(0)
+            view[:len(chunk)] = chunk
+            return len(chunk)
+
+        return mock.MagicMock(side_effect=recv_into)
+
     def test_receive_message(self):
         mock_sock = mock.MagicMock()
-        mock_sock.recv = mock.MagicMock(side_effect=[
-            '\x00\x00\x00\x0c',
-            'some message'
+        mock_sock.recv_into = self._recv_into([
+            b'\x00\x00',
+            b'\x00\x0csome ',
+            b'message'
         ])
 
         connection = BaseSocketConnection(mock_sock)
@@ -30,10 +88,7 @@ class BaseSocketConnectionTestCase(unittest.TestCase):
 
     def test_receive_message_empty(self):
         mock_sock = mock.MagicMock()
-        mock_sock.recv = mock.MagicMock(side_effect=[
-            None,
-            ''
-        ])
+        mock_sock.recv_into = self._recv_into([])
 
         connection = BaseSocketConnection(mock_sock)
 
@@ -41,6 +96,96 @@ class BaseSocketConnectionTestCase(unittest.TestCase):
 
         assert result is None
 
+    def test_receive_message_truncated(self):
+        mock_sock = mock.MagicMock()
+        mock_sock.recv_into = self._recv_into([b'\x00\x00\x00\x0csome'])
+
+        connection = BaseSocketConnection(mock_sock)
+
+        assert connection.receive_message() is None
+
+    def test_receive_frame_too_large(self):
+        mock_sock = mock.MagicMock()
+        mock_sock.recv_into = self._recv_into([FRAME_HEADER.pack(MAX_FRAME_SIZE + 1)])
+
+        connection = BaseSocketConnection(mock_sock)
+
+        with self.assertRaises(socket.error):
+            connection.receive_frame()
+
+    def test_receive_multiple_frames_per_read(self):
+        mock_sock = mock.MagicMock()
+        mock_sock.recv_into = self._recv_into([
+            b'\x00\x00\x00\x03one\x00\x00\x00\x03two\x00\x00',
+            b'\x00\x05three',
+        ])
+
+        connection = BaseSocketConnection(mock_sock)
+
+        assert connection.receive_message() == 'one'
+        assert connection.has_buffered_frame()
+        assert connection.receive_message() == 'two'
+        assert not connection.has_buffered_frame()
+        assert connection.receive_message() == 'three'
+
+        assert mock_sock.recv_into.call_count == 2
+
+    def test_receive_over_socket(self):
+        sock_1, sock_2 = socket.socketpair()
+
+        sender = BaseSocketConnection(sock_1)
+        receiver = BaseSocketConnection(sock_2)
+
+        payloads = [b'', b'small', b'a' * (RECEIVE_BUFFER_SIZE - 3), b'b' * (RECEIVE_BUFFER_SIZE * 5 + 7), b'end']
+
+        thread = threading.Thread(target=lambda: [sender.send_message(p) for p in payloads])
+        thread.start()
+
+        try:
+            for payload in payloads:
+                assert receiver.receive_frame().tobytes() == payload
+        finally:
+            thread.join(5)
+            sender.close()
+            receiver.close()
+
+    def test_receive_frame_buffer_reuse(self):
+        mock_sock = mock.MagicMock()
+        mock_sock.recv_into = self._recv_into([
+            b'\x00\x00\x00\x03one',
+            b'\x00\x00\x00\x03two',
+        ])
+
+        connection = BaseSocketConnection(mock_sock)
+        buffer = connection._buffer
+
+        assert connection.receive_frame().tobytes() == b'one'
+        assert connection.receive_frame().tobytes() == b'two'
+
+        assert connection._buffer is buffer
+        assert connection._start == 7
+
+    def test_receive_frame_buffer_shrinks(self):
+        large = b'x' * (RECEIVE_BUFFER_SIZE * 4)
+
+        mock_sock = mock.MagicMock()
+        mock_sock.recv_into = self._recv_into([
+            FRAME_HEADER.pack(len(large)),
+            large,
+            b'\x00\x00\x00\x03one',
+        ])
+
+        connection = BaseSocketConnection(mock_sock)
+
+        frame = connection.receive_frame()
+        assert len(connection._buffer) > RECEIVE_BUFFER_SIZE
+
+        assert connection.receive_frame().tobytes() == b'one'
+        assert len(connection._buffer) == RECEIVE_BUFFER_SIZE
+
+        # the previous frame stays valid until it is released
+        assert frame.tobytes() == large
+
     def test_close(self):
         mock_sock = mock.MagicMock()
         connection = BaseSocketConnection(mock_sock)
@@ -50,15 +195,144 @@ class BaseSocketConnectionTestCase(unittest.TestCase):
         assert mock_sock.close.call_count == 1
 
 
+class ClientSocketConnectionTestCase(unittest.TestCase):
+
+    def test_send_request(self):
+        mock_sock = mock.MagicMock()
+        connection = ClientSocketConnection(mock_sock)
+        connection.send_message = mock.MagicMock()
+
+        assert connection.send_request('start', server='survival') == 1
+        assert connection.send_request('status') == 2
+
+        assert json.loads(connection.send_message.call_args_list[0][0][0]) == {
+            'v': PROTOCOL_VERSION,
+            'id': 1,
+            'action': 'start',
+            'args': {'server': 'survival'},
+        }
+
+    def test_receive_response(self):
+        connection = ClientSocketConnection(mock.MagicMock())
+        connection.receive_message = mock.MagicMock(return_value=encode_response(3, RESPONSE_END, status='ok'))
+
+        response = connection.receive_response()
+
+        assert response['id'] == 3
+        assert response['status'] == 'ok'
+
+    def test_receive_response_closed(self):
+        connection = ClientSocketConnection(mock.MagicMock())
+        connection.receive_message = mock.MagicMock(return_value=None)
+
+        assert connection.receive_response() is None
+
+
 class ServerSocketConnectionTestCase(unittest.TestCase):
 
     def test_close(self):
         mock_sock = mock.MagicMock()
         connection = ServerSocketConnection(mock_sock)
-        connection.send_message = mock.MagicMock()
 
         connection.close()
 
+        assert connection.closed
         assert mock_sock.close.call_count == 1
-        assert connection.send_message.call_count == 1
-        assert connection.send_message.call_args[0] == ('',)
+
+    def test_receive_request(self):
+        connection = ServerSocketConnection(mock.MagicMock())
+        connection.receive_message = mock.MagicMock(return_value=encode_request(7, 'stop', server='survival'))
+
+        assert connection.receive_request() == Request(7, 'stop', {'server': 'survival'})
+
+    def test_receive_request_closed(self):
+        connection = ServerSocketConnection(mock.MagicMock())
+        connection.receive_message = mock.MagicMock(return_value=None)
+
+        assert connection.receive_request() is None
+
+    def test_receive_request_empty_frame(self):
+        sock_1, sock_2 = socket.socketpair()
+        connection = ServerSocketConnection(sock_2)
+
+        try:
+            sock_1.sendall(FRAME_HEADER.pack(0))
+
+            with self.assertRaises(ProtocolException):
+                connection.receive_request()
+
+            assert not connection.closed
+        finally:
+            sock_1.close()
+            connection.close()
+
+    def test_send_response(self):
+        connection = ServerSocketConnection(mock.MagicMock())
+        connection.send_message = mock.MagicMock()
+
+        connection.send_response(7, RESPONSE_MESSAGE, message='hello')
+
+        assert json.loads(connection.send_message.call_args[0][0]) == {
+            'v': PROTOCOL_VERSION,
+            'id': 7,
+            'type': RESPONSE_MESSAGE,
+            'message': 'hello',
+        }
+
+
+class RequestConnectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = mock.MagicMock(closed=False)
+        self.request_connection = RequestConnection(self.connection, 4)
+
+    def test_send_message(self):
+        self.request_connection.send_message('hello')
+
+        assert self.connection.send_response.call_args == ((4, RESPONSE_MESSAGE), {'message': 'hello'})
+
+    def test_send_data(self):
+        self.request_connection.send_data({'lines': ['a']})
+
+        assert self.connection.send_response.call_args == ((4, RESPONSE_DATA), {'data': {'lines': ['a']}})
+
+    def test_finish(self):
+        self.request_connection.set_status(ResponseStatus.NOT_FOUND)
+        self.request_connection.set_result({'key': 'value'})
+
+        self.request_connection.finish()
+        self.request_connection.finish()
+
+        assert self.connection.send_response.call_count == 1
+        assert self.connection.send_response.call_args == ((4, RESPONSE_END), {
+            'status': 'not_found',
+            'result': {'key': 'value'},
+        })
+
+    def test_finish_disconnected(self):
+        self.connection.send_response = mock.MagicMock(side_effect=socket.error)
+
+        self.request_connection.finish()
+
+        assert self.request_connection.finished
+
+    def test_closed(self):
+        assert self.request_connection.closed is False
+
+        self.connection.closed = True
+
+        assert self.request_connection.closed is True
+
+    def test_send_message_disconnected(self):
+        self.connection.send_response = mock.MagicMock(side_effect=socket.error)
+
+        self.request_connection.send_message('hello')
+
+    def test_child(self):
+        self.request_connection.set_status(ResponseStatus.ERROR)
+
+        child = self.request_connection.child()
+        child.send_message('hello')
+
+        assert child.status == ResponseStatus.OK
+        assert self.connection.send_response.call_args == ((4, RESPONSE_MESSAGE), {'message': 'hello'})
@@ -0,0 +1,443 @@
+import os
+import threading
+import time
+import unittest
+
+import mock
+
+from mcrunner.console import (
+    CommandLimiter,
+    CommandWriter,
+    ConsoleBuffer,
+    ConsoleSubscription,
+    LINE_OVERHEAD,
+    MAX_LINE_LENGTH,
+    OutputPump,
+)
+from mcrunner.exceptions import CommandQueueFullException, ServerNotRunningException
+
+
+class ConsoleSubscriptionTestCase(unittest.TestCase):
+
+    def test_put_get(self):
+        subscription = ConsoleSubscription(maxlen=10)
+
+        subscription.put(b'one')
+        subscription.put(b'two')
+
+        assert subscription.get(timeout=0) == [b'one', b'two']
+        assert subscription.get(timeout=0) == []
+
+    def test_put_drops_oldest(self):
+        subscription = ConsoleSubscription(maxlen=2)
+
+        for line in [b'one', b'two', b'three', b'four']:
+            subscription.put(line)
+
+        assert subscription.get(timeout=0) == [b'three', b'four']
+        assert subscription.dropped == 2
+
+    def test_get_waits_for_line(self):
+        subscription = ConsoleSubscription()
+
+        timer = threading.Timer(0.05, subscription.put, args=(b'late',))
+        timer.start()
+
+        assert subscription.get(timeout=5) == [b'late']
+        timer.join()
+
+    def test_close(self):
+        subscription = ConsoleSubscription()
+        subscription.close()
+
+        assert subscription.closed
+        assert subscription.get(timeout=5) == []
+
+
+class ConsoleBufferTestCase(unittest.TestCase):
+
+    def test_append(self):
+        buf = ConsoleBuffer(1024)
+
+        buf.append(b'line 1')
+        buf.append(b'line 2')
+
+        assert len(buf) == 2
+        assert buf.size == 12 + 2 * LINE_OVERHEAD
+        assert buf.get_lines() == [b'line 1', b'line 2']
+
+    def test_append_evicts_oldest(self):
+        buf = ConsoleBuffer(8 + 2 * LINE_OVERHEAD)
+
+        buf.append(b'aaaa')
+        buf.append(b'bbbb')
+        buf.append(b'cccc')
+
+        assert buf.get_lines() == [b'bbbb', b'cccc']
+        assert buf.size == 8 + 2 * LINE_OVERHEAD
+        assert buf.line_count == 3
+
+    def test_append_empty_lines_capped(self):
+        buf = ConsoleBuffer(1024)
+
+        for _ in range(10000):
+            buf.append(b'')
+
+        assert len(buf) == 1024 // LINE_OVERHEAD
+        assert buf.size <= 1024
+
+    def test_append_keeps_oversized_line(self):
+        buf = ConsoleBuffer(4)
+
+        buf.append(b'aa')
+        buf.append(b'much longer line')
+
+        assert buf.get_lines() == [b'much longer line']
+
+    def test_get_lines_count(self):
+        buf = ConsoleBuffer(1024)
+
+        for i in range(5):
+            buf.append(('line %d' % i).encode('utf8'))
+
+        assert buf.get_lines(2) == [b'line 3', b'line 4']
+        assert buf.get_lines(10) == buf.get_lines()
+        assert buf.get_lines(0) == []
+
+    def test_subscribe(self):
+        buf = ConsoleBuffer(1024)
+
+        buf.append(b'old 1')
+        buf.append(b'old 2')
+
+        lines, subscription = buf.subscribe(count=1)
+
+        buf.append(b'new')
+
+        assert lines == [b'old 2']
+        assert subscription.get(timeout=0) == [b'new']
+
+    def test_subscribe_fan_out(self):
+        buf = ConsoleBuffer(1024)
+
+        _, slow = buf.subscribe(maxlen=1)
+        _, fast = buf.subscribe(maxlen=10)
+
+        buf.append(b'one')
+        buf.append(b'two')
+
+        assert slow.get(timeout=0) == [b'two']
+        assert slow.dropped == 1
+        assert fast.get(timeout=0) == [b'one', b'two']
+
+    def test_unsubscribe(self):
+        buf = ConsoleBuffer(1024)
+
+        _, subscription = buf.subscribe()
+        buf.unsubscribe(subscription)
+        buf.append(b'line')
+
+        assert subscription.closed
+        assert subscription.get(timeout=0) == []
+        assert buf.subscriptions == []
+
+
+class OutputPumpTestCase(unittest.TestCase):
+
+    def _run_pump(self, stdout_data, stderr_data=b''):
+        lines = []
+        eof = threading.Event()
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+
+        stdout = os.fdopen(stdout_r, 'rb')
+        stderr = os.fdopen(stderr_r, 'rb')
+
+        try:
+            pump = OutputPump([stdout, stderr], lines.append, on_eof=eof.set)
+            pump.start()
+
+            os.write(stdout_w, stdout_data)
+            os.write(stderr_w, stderr_data)
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+            pump.join(5)
+        finally:
+            stdout.close()
+            stderr.close()
+
+        assert eof.is_set()
+
+        return lines
+
+    def test_run(self):
+        lines = self._run_pump(b'first\r\nsecond\npartial', b'error\n')
+
+        assert sorted(lines) == [b'error', b'first', b'partial', b'second']
+
+    def test_run_splits_long_lines(self):
+        lines = self._run_pump(b'x' * (MAX_LINE_LENGTH + 10) + b'\n')
+
+        assert lines == [b'x' * MAX_LINE_LENGTH, b'x' * 10]
+
+    def test_run_line_handler_error(self):
+        on_line = mock.MagicMock(side_effect=ValueError)
+        eof = mock.MagicMock()
+
+        r, w = os.pipe()
+        stream = os.fdopen(r, 'rb')
+
+        pump = OutputPump([stream], on_line, on_eof=eof)
+        pump.start()
+
+        os.write(w, b'one\ntwo\n')
+        os.close(w)
+        pump.join(5)
+        stream.close()
+
+        assert on_line.call_count == 2
+        assert eof.call_count == 1
+
+
+class CommandLimiterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.limiter = CommandLimiter(rate=2, burst=3, clock=lambda: self.now)
+
+    def test_burst(self):
+        assert self.limiter.take(1) == 0
+        assert self.limiter.take(2) == 0
+        assert self.limiter.take(1) == 0.5
+
+    def test_refill(self):
+        self.limiter.take(3)
+
+        self.now += 1
+        assert self.limiter.take(2) == 0
+        assert self.limiter.take(1) == 0.5
+
+        # never refills beyond the burst size
+        self.now += 60
+        assert self.limiter.take(3) == 0
+        assert self.limiter.take(1) == 0.5
+
+    def test_large_batch(self):
+        self.limiter.take(1)
+        assert self.limiter.take(10) == 0.5
+
+        self.now += 0.5
+        assert self.limiter.take(10) == 0
+        assert self.limiter.tokens == -7
+
+    def test_unlimited(self):
+        limiter = CommandLimiter()
+
+        assert all(limiter.take(100) == 0 for _ in range(100))
+
+    def test_can_coalesce(self):
+        limiter = CommandLimiter(coalesce=['save-all', 'whitelist reload'])
+
+        assert limiter.can_coalesce(b'whitelist reload\n')
+        assert not limiter.can_coalesce(b'save-all\nsave-all\n')
+        assert not limiter.can_coalesce(b'say save-all\n')
+
+
+class CommandWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        r, w = os.pipe()
+
+        self.reader = os.fdopen(r, 'rb')
+        self.stream = os.fdopen(w, 'wb')
+        self.addCleanup(self.stream.close)
+
+    def _start_writer(self, **kwargs):
+        writer = CommandWriter(self.stream, **kwargs)
+        writer.start()
+        self.addCleanup(writer.join, 5)
+        self.addCleanup(writer.close)
+
+        return writer
+
+    def _fill_pipe(self):
+        # the writer made the pipe non-blocking
+        while True:
+            try:
+                os.write(self.stream.fileno(), b'x' * 65536)
+            except (IOError, OSError):
+                return
+
+    def test_put(self):
+        writer = self._start_writer()
+
+        first = writer.put(b'say one\n')
+        second = writer.put(b'say two\n')
+
+        assert first.wait(5)
+        assert second.wait(5)
+        assert os.read(self.reader.fileno(), 1024) == b'say one\nsay two\n'
+
+        self.reader.close()
+
+    def test_put_not_read(self):
+        writer = self._start_writer()
+
+        assert writer.put(b'list\n').wait(5)
+        self._fill_pipe()
+
+        # doesn't block while the process doesn't read its input
+        command = writer.put(b'say hi\n')
+        assert not command.wait(0.05)
+
+        while os.read(self.reader.fileno(), 65536).count(b'x') == 65536:
+            pass
+
+        assert command.wait(5)
+
+        self.reader.close()
+
+    def test_put_queue_full(self):
+        writer = self._start_writer(maxlen=2)
+
+        assert writer.put(b'list\n').wait(5)
+        self._fill_pipe()
+
+        # taken by the writer, which waits for the pipe to be writable
+        writer.put(b'one\n')
+        while writer.queue:
+            time.sleep(0.001)
+
+        writer.put(b'two\n')
+        writer.put(b'three\n')
+
+        with self.assertRaises(CommandQueueFullException):
+            writer.put(b'four\n')
+
+        assert writer.limiter.dropped == 1
+        assert writer.get_queue_depth() == 2
+
+        self.reader.close()
+
+    def test_put_priority_queue_full(self):
+        writer = self._start_writer(maxlen=1)
+
+        assert writer.put(b'list\n').wait(5)
+        self._fill_pipe()
+
+        writer.put(b'one\n')
+        while writer.queue:
+            time.sleep(0.001)
+
+        queued = writer.put(b'two\n')
+
+        with self.assertRaises(CommandQueueFullException):
+            writer.put(b'three\n')
+
+        stop = writer.put(b'stop\n', priority=True)
+        assert writer.put(b'stop\n', priority=True) is stop
+        assert writer.get_queue_depth() == 2
+
+        while os.read(self.reader.fileno(), 65536).count(b'x') == 65536:
+            pass
+
+        assert stop.wait(5)
+        assert queued.wait(5)
+
+        # written ahead of the command queued before it
+        data = b''
+        while not data.endswith(b'two\n'):
+            data += os.read(self.reader.fileno(), 65536)
+
+        assert data.endswith(b'one\nstop\ntwo\n')
+
+        self.reader.close()
+
+    def test_put_priority_rate_limited(self):
+        writer = self._start_writer(limiter=CommandLimiter(rate=1, burst=1))
+
+        assert writer.put(b'say one\n').wait(5)
+        queued = writer.put(b'say two\n')
+
+        # the bucket is empty for a second, the priority command doesn't wait
+        assert writer.put(b'stop\n', priority=True).wait(0.5)
+        assert not queued.event.is_set()
+
+        assert os.read(self.reader.fileno(), 1024) == b'say one\nstop\n'
+
+        self.reader.close()
+
+    def test_put_coalesced(self):
+        writer = self._start_writer(limiter=CommandLimiter(coalesce=['save-all']))
+
+        assert writer.put(b'list\n').wait(5)
+        self._fill_pipe()
+
+        writer.put(b'say one\n')
+        while writer.queue:
+            time.sleep(0.001)
+
+        first = writer.put(b'save-all\n')
+        assert writer.put(b'save-all\n') is first
+        assert writer.put(b'list\n') is not writer.put(b'list\n')
+
+        assert writer.limiter.coalesced == 1
+        assert writer.get_queue_depth() == 3
+
+        self.reader.close()
+
+    def test_rate_limited(self):
+        writer = self._start_writer(limiter=CommandLimiter(rate=100, burst=1))
+
+        start_time = time.time()
+        commands = [writer.put(b'say hi\n') for _ in range(6)]
+
+        for command in commands:
+            assert command.wait(5)
+
+        # the first command uses up the burst, the other five wait for tokens
+        assert time.time() - start_time >= 0.045
+        assert os.read(self.reader.fileno(), 1024) == b'say hi\n' * 6
+
+        self.reader.close()
+
+    def test_put_closed(self):
+        writer = self._start_writer()
+        writer.close()
+
+        with self.assertRaises(ServerNotRunningException):
+            writer.put(b'list\n')
+
+        self.reader.close()
+
+    def test_close_fails_pending(self):
+        writer = self._start_writer()
+
+        assert writer.put(b'list\n').wait(5)
+        self._fill_pipe()
+
+        command = writer.put(b'say hi\n')
+        writer.close()
+
+        with self.assertRaises(ServerNotRunningException):
+            command.wait(5)
+
+        self.reader.close()
+
+    def test_broken_pipe(self):
+        on_broken = mock.MagicMock()
+        writer = self._start_writer(on_broken=on_broken)
+
+        self.reader.close()
+
+        command = writer.put(b'list\n')
+
+        with self.assertRaises(ServerNotRunningException):
+            command.wait(5)
+
+        writer.join(5)
+
+        assert on_broken.call_count == 1
+        assert writer.closed
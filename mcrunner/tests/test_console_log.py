@@ -0,0 +1,379 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from mcrunner import console_log
+from mcrunner.console_log import (
+    ConsoleLog,
+    ConsoleLogWriter,
+    INDEX_ENTRY,
+    _parse_record,
+    lookup_tokens,
+    search_segments,
+    tokenize,
+    write_token_index,
+)
+
+NOW = 1500000000.0
+
+
+class ConsoleLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.log_path = os.path.join(self.path, 'console')
+
+    def _create_log(self, segment_size=1024, max_size=0, max_age=0, index_interval=64):
+        log = ConsoleLog(self.log_path, segment_size, max_size, max_age, index_interval=index_interval)
+        log.load()
+        self.addCleanup(log.close)
+
+        return log
+
+    def _append_lines(self, log, count, start=NOW, step=1.0):
+        for i in range(count):
+            log.append(('line %d' % i).encode('utf8'), start + i * step)
+
+        log.flush()
+
+    def _files(self):
+        return sorted(os.listdir(self.log_path))
+
+    def test_read(self):
+        log = self._create_log()
+
+        self._append_lines(log, 5)
+
+        assert list(log.read()) == [(NOW + i, ('line %d' % i).encode('utf8')) for i in range(5)]
+
+    def test_read_range(self):
+        log = self._create_log()
+
+        self._append_lines(log, 200)
+
+        lines = [line for _, line in log.read(since=NOW + 100, until=NOW + 102.5)]
+
+        assert lines == [b'line 100', b'line 101', b'line 102']
+
+    def test_read_not_flushed(self):
+        log = self._create_log()
+
+        log.append(b'pending', NOW)
+
+        assert list(log.read()) == []
+
+    def test_segments(self):
+        log = self._create_log(segment_size=100)
+
+        self._append_lines(log, 30)
+
+        assert len(log.segments) > 1
+        assert log.active is log.segments[-1]
+        assert all(segment.size >= 100 for segment in log.segments[:-1])
+        assert [line for _, line in log.read()] == [('line %d' % i).encode('utf8') for i in range(30)]
+
+    def test_index(self):
+        log = self._create_log(segment_size=1000000, index_interval=100)
+
+        self._append_lines(log, 100)
+
+        index = log.active.index
+
+        assert index[0] == (NOW, 0)
+        assert len(index) > 5
+        assert all(b[1] - a[1] >= 100 for a, b in zip(index, index[1:]))
+
+        with open(log.active.index_path, 'rb') as f:
+            assert len(f.read()) == len(index) * INDEX_ENTRY.size
+
+    def test_read_seeks(self):
+        log = self._create_log(segment_size=1000000, index_interval=100)
+
+        self._append_lines(log, 100)
+
+        with mock.patch('mcrunner.console_log._parse_record', side_effect=_parse_record) as parse_record:
+            lines = [line for _, line in log.read(since=NOW + 90)]
+
+        assert lines == [('line %d' % i).encode('utf8') for i in range(90, 100)]
+        # only the indexed block before line 90 is read besides the range
+        assert parse_record.call_count < 20
+
+    def test_load(self):
+        log = self._create_log(segment_size=100)
+        self._append_lines(log, 30)
+        log.close()
+
+        loaded = self._create_log(segment_size=100)
+
+        assert [segment.start for segment in loaded.segments] == [segment.start for segment in log.segments]
+        assert loaded.active is None
+        assert [line for _, line in loaded.read(since=NOW + 25)] == [
+            ('line %d' % i).encode('utf8') for i in range(25, 30)
+        ]
+
+        # new output goes to a new segment
+        loaded.append(b'after restart', NOW + 100)
+        loaded.flush()
+
+        assert len(loaded.segments) == len(log.segments) + 1
+        assert list(loaded.read(since=NOW + 50)) == [(NOW + 100, b'after restart')]
+
+    def test_load_missing(self):
+        log = self._create_log()
+
+        assert log.segments == []
+        assert list(log.read()) == []
+
+    def test_maintain_compresses(self):
+        log = self._create_log(segment_size=300)
+
+        self._append_lines(log, 60)
+
+        sealed = log.segments[:-1]
+        log.maintain(now=NOW + 60)
+
+        assert all(segment.compressed for segment in log.segments[:-1])
+        assert not log.active.compressed
+        assert len(log.segments) == len(sealed) + 1
+        assert not any(name.endswith('.log') for name in self._files()[:-2])
+
+        assert [line for _, line in log.read()] == [('line %d' % i).encode('utf8') for i in range(60)]
+        assert [line for _, line in log.read(since=NOW + 10, until=NOW + 12)] == [
+            b'line 10', b'line 11', b'line 12'
+        ]
+
+        # a valid gzip file
+        with gzip.open(log.segments[0].path) as f:
+            assert f.read().splitlines()[0] == b'1500000000.000 line 0'
+
+    def test_maintain_compressed_reload(self):
+        log = self._create_log(segment_size=300)
+        self._append_lines(log, 60)
+        log.maintain(now=NOW + 60)
+        log.close()
+
+        loaded = self._create_log(segment_size=300)
+
+        assert [segment.compressed for segment in loaded.segments[:-1]] == [True] * (len(loaded.segments) - 1)
+        assert [line for _, line in loaded.read(since=NOW + 30, until=NOW + 31)] == [b'line 30', b'line 31']
+
+    def test_load_interrupted_compression(self):
+        log = self._create_log(segment_size=300)
+        self._append_lines(log, 60)
+        segment = log.segments[0]
+        log.maintain(now=NOW + 60)
+        log.close()
+
+        # the uncompressed segment was left behind
+        with open(segment.path, 'wb') as f:
+            f.write(b'1500000000.000 line 0\n')
+
+        loaded = self._create_log(segment_size=300)
+
+        assert loaded.segments[0].compressed
+        assert not os.path.exists(segment.path)
+
+    def test_maintain_max_size(self):
+        log = self._create_log(segment_size=300, max_size=1000)
+
+        self._append_lines(log, 200)
+        log.maintain(now=NOW + 200)
+
+        assert log.get_size() <= 1000 + 300
+        assert log.active is log.segments[-1]
+        assert sorted(os.listdir(self.log_path)) == sorted(
+            os.path.basename(path) for segment in log.segments
+            for path in (segment.path, segment.index_path, segment.tokens_path) if os.path.exists(path)
+        )
+
+        lines = [line for _, line in log.read()]
+        assert lines[-1] == b'line 199'
+        assert b'line 0' not in lines
+
+    def test_maintain_max_age(self):
+        log = self._create_log(segment_size=300, max_age=50)
+
+        self._append_lines(log, 100)
+        log.maintain(now=NOW + 100)
+
+        assert log.segments[1].start >= NOW + 50
+        assert [line for _, line in log.read()][-1] == b'line 99'
+
+    def test_write_error(self):
+        log = self._create_log()
+        self._append_lines(log, 5)
+
+        log.active_file.write = mock.MagicMock(side_effect=IOError('No space left on device'))
+        log.append(b'lost', NOW + 10)
+
+        with self.assertRaises(IOError):
+            log.flush()
+
+        assert log.active is None
+
+        log.append(b'kept', NOW + 11)
+        log.flush()
+
+        assert len(log.segments) == 2
+        assert list(log.read(since=NOW + 10)) == [(NOW + 11, b'kept')]
+
+
+class TokenIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_tokenize(self):
+        assert tokenize(b'[12:00:00 INFO]: Steve_99 joined the game') == set([
+            b'12', b'00', b'info', b'steve_99', b'joined', b'the', b'game'
+        ])
+        assert tokenize(b'java.lang.NullPointerException: ' + b'x' * 65) == set([
+            b'java', b'lang', b'nullpointerexception'
+        ])
+
+    def test_lookup_tokens(self):
+        path = os.path.join(self.path, 'segment.tok')
+        postings = dict((('token%03d' % i).encode('ascii'), set([i % 7, 10])) for i in range(200))
+        postings[b'steve'] = set([1, 2, 3])
+        postings[b'joined'] = set([2, 3, 4])
+
+        write_token_index(path, postings)
+
+        for token, blocks in postings.items():
+            assert lookup_tokens(path, [token]) == blocks
+
+        assert lookup_tokens(path, [b'steve', b'joined']) == set([2, 3])
+        assert lookup_tokens(path, [b'steve', b'missing']) == set()
+        assert lookup_tokens(path, [b'a']) == set()
+        assert lookup_tokens(path, [b'zzz']) == set()
+
+    def test_lookup_tokens_empty(self):
+        path = os.path.join(self.path, 'segment.tok')
+        write_token_index(path, {})
+
+        assert lookup_tokens(path, [b'steve']) == set()
+
+    def test_lookup_tokens_missing(self):
+        assert lookup_tokens(os.path.join(self.path, 'missing.tok'), [b'steve']) is None
+
+
+class ConsoleLogSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.log = self._create_log()
+
+        for i in range(300):
+            self.log.append(('[INFO]: player%d moved' % (i % 50)).encode('utf8'), NOW + i)
+            if i == 120:
+                self.log.append(b'[WARN]: java.lang.NullPointerException: Steve', NOW + i)
+
+        self.log.flush()
+
+    def _create_log(self):
+        log = ConsoleLog(os.path.join(self.path, 'console'), 2000, 0, 0, index_interval=200)
+        log.load()
+        self.addCleanup(log.close)
+
+        return log
+
+    def test_search_active(self):
+        assert self.log.search(['steve']) == [(NOW + 120, b'[WARN]: java.lang.NullPointerException: Steve')]
+        assert self.log.search(['NullPointerException', 'steve']) == self.log.search(['steve'])
+        assert self.log.search(['steve', 'player1']) == []
+
+    def test_search_sealed(self):
+        self.log.close()
+        self.log.maintain(now=NOW + 300)
+
+        assert all(os.path.exists(segment.tokens_path) for segment in self.log.segments)
+        assert [segment.compressed for segment in self.log.segments] == [True] * len(self.log.segments)
+
+        assert self.log.search(['java.lang.NullPointerException']) == [
+            (NOW + 120, b'[WARN]: java.lang.NullPointerException: Steve')
+        ]
+        assert [when for when, _ in self.log.search(['player7'])] == [NOW + i for i in range(7, 300, 50)]
+
+    def test_search_whole_words(self):
+        assert self.log.search(['player1']) == [(NOW + i, b'[INFO]: player1 moved') for i in range(1, 300, 50)]
+
+    def test_search_since_until_limit(self):
+        assert [when for when, _ in self.log.search(['moved'], since=NOW + 100, until=NOW + 104)] == [
+            NOW + i for i in range(100, 105)
+        ]
+        assert len(self.log.search(['moved'], limit=10)) == 10
+
+    def test_search_reads_matching_blocks(self):
+        self.log.close()
+
+        with mock.patch('mcrunner.console_log._read_block', wraps=console_log._read_block) as read_block:
+            self.log.search(['steve'])
+
+        assert read_block.call_count == 1
+
+    def test_search_without_token_index(self):
+        self.log.close()
+
+        for segment in self.log.segments:
+            os.remove(segment.tokens_path)
+
+        loaded = self._create_log()
+
+        assert loaded.search(['steve']) == [(NOW + 120, b'[WARN]: java.lang.NullPointerException: Steve')]
+
+        loaded.maintain(now=NOW + 300)
+
+        assert all(os.path.exists(segment.tokens_path) for segment in loaded.segments)
+        assert loaded.search(['steve']) == [(NOW + 120, b'[WARN]: java.lang.NullPointerException: Steve')]
+
+    def test_search_segments_expired(self):
+        snapshots = self.log.get_search_snapshots(['moved'])
+        os.remove(snapshots[0].path)
+
+        assert search_segments(snapshots[:1], ['moved']) == []
+
+    def test_search_segments_compressed_meanwhile(self):
+        self.log.close()
+        snapshots = self.log.get_search_snapshots(['steve'])
+        self.log.maintain(now=NOW + 300)
+
+        assert not any(snapshot.compressed for snapshot in snapshots)
+        assert search_segments(snapshots, ['steve']) == [(NOW + 120, b'[WARN]: java.lang.NullPointerException: Steve')]
+        assert [when for when, _ in search_segments(snapshots, ['player7'])] == [NOW + i for i in range(7, 300, 50)]
+
+
+class ConsoleLogWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mock.MagicMock()
+        self.server.name = 'survival'
+
+        self.writer = ConsoleLogWriter({'survival': self.server, 'creative': mock.MagicMock(console_log=None)})
+
+    def test_flush(self):
+        self.writer.flush()
+
+        assert self.server.console_log.flush.call_count == 1
+
+    @mock.patch('mcrunner.console_log.logger')
+    def test_flush_error(self, logger):
+        self.server.console_log.flush.side_effect = IOError('No space left on device')
+
+        self.writer.flush()
+
+        assert logger.warning.call_count == 1
+
+    def test_maintain(self):
+        self.writer.maintain()
+
+        assert self.server.console_log.maintain.call_count == 1
+
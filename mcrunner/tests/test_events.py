@@ -0,0 +1,149 @@
+import unittest
+
+from mcrunner.events import (
+    CHAT,
+    EXCEPTION,
+    JOIN,
+    LAG,
+    LEAVE,
+    PLUGIN_DISABLE,
+    PLUGIN_ENABLE,
+    READY,
+    ConsoleEvent,
+    ConsoleEventParser,
+    EventCounters,
+    get_message,
+)
+
+NOW = 1500000000.0
+
+
+class ConsoleEventParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = ConsoleEventParser(max_trace_lines=3)
+
+    def _parse(self, line):
+        events = self.parser.parse(line, NOW)
+
+        assert len(events) <= 1
+
+        return events[0] if events else None
+
+    def test_get_message(self):
+        assert get_message(b'[12:00:00 INFO]: Steve joined the game') == b'Steve joined the game'
+        assert get_message(b'[12:00:00] [Server thread/INFO]: Steve joined the game') == b'Steve joined the game'
+        assert get_message(b'\tat net.minecraft.server.Main.main(Main.java:1)') == (
+            b'\tat net.minecraft.server.Main.main(Main.java:1)'
+        )
+        assert get_message(b'[no prefix') == b'[no prefix'
+
+    def test_no_event(self):
+        assert self._parse(b'[12:00:00 INFO]: Preparing spawn area: 50%') is None
+        assert self._parse(b'') is None
+
+    def test_join_leave(self):
+        event = self._parse(b'[12:00:00 INFO]: Steve joined the game')
+
+        assert event == ConsoleEvent(NOW, JOIN, {'player': 'Steve'}, [b'[12:00:00 INFO]: Steve joined the game'])
+        assert self._parse(b'[12:00:00] [Server thread/INFO]: Alex left the game').data == {'player': 'Alex'}
+        assert self._parse(b'[12:00:00] [Server thread/INFO]: Alex left the game').type == LEAVE
+
+    def test_chat(self):
+        event = self._parse(b'[12:00:00 INFO]: <Steve> has anyone seen Alex joined the game?')
+
+        assert event.type == CHAT
+        assert event.data == {'player': 'Steve', 'message': 'has anyone seen Alex joined the game?'}
+
+        assert self._parse(b'[12:00:00 INFO]: [Not Secure] <Alex> hi').data == {'player': 'Alex', 'message': 'hi'}
+
+    def test_lag(self):
+        event = self._parse(
+            b"[12:00:01 WARN]: Can't keep up! Is the server overloaded? Running 5120ms or 102 ticks behind"
+        )
+
+        assert event.type == LAG
+        assert event.data == {'ms': 5120, 'ticks': 102}
+
+        event = self._parse(
+            b"[12:00:01 WARN]: Can't keep up! Did the system time change, or is the server overloaded? "
+            b"Running 2500ms behind, skipping 50 tick(s)"
+        )
+
+        assert event.data == {'ms': 2500, 'ticks': None}
+
+    def test_ready(self):
+        event = self._parse(b'[12:00:00 INFO]: Done (12,345s)! For help, type "help"')
+
+        assert event.type == READY
+        assert event.data == {'seconds': 12.345}
+
+    def test_plugins(self):
+        event = self._parse(b'[12:00:00 INFO]: [WorldEdit] Enabling WorldEdit v7.2.6+5681')
+
+        assert event.type == PLUGIN_ENABLE
+        assert event.data == {'plugin': 'WorldEdit', 'version': '7.2.6+5681'}
+
+        event = self._parse(b'[12:00:00 INFO]: [Essentials] Disabling Essentials')
+
+        assert event.type == PLUGIN_DISABLE
+        assert event.data == {'plugin': 'Essentials', 'version': None}
+
+    def test_stack_trace(self):
+        lines = [
+            b'[12:00:00 WARN]: java.lang.IllegalStateException: Asynchronous chunk load!',
+            b'[12:00:00 WARN]: \tat org.spigotmc.AsyncCatcher.catchOp(AsyncCatcher.java:15)',
+            b'\tat net.minecraft.server.World.getChunk(World.java:100)',
+            b'Caused by: java.lang.NullPointerException',
+            b'\t... 12 more',
+        ]
+
+        for line in lines:
+            assert self._parse(line) is None
+
+        event = self.parser.parse(b'[12:00:01 INFO]: Steve joined the game', NOW + 1)[0]
+
+        assert event.time == NOW
+        assert event.type == EXCEPTION
+        assert event.data == {
+            'exception': 'java.lang.IllegalStateException',
+            'message': 'Asynchronous chunk load!',
+            'omitted_lines': 2,
+        }
+        assert event.lines == lines[:3]
+
+    def test_stack_trace_followed_by_event(self):
+        self._parse(b'[12:00:00 ERROR]: Exception in thread "main" java.lang.OutOfMemoryError: Java heap space')
+
+        events = self.parser.parse(b'[12:00:01 INFO]: Steve joined the game', NOW + 1)
+
+        assert [event.type for event in events] == [EXCEPTION, JOIN]
+        assert events[0].data['exception'] == 'java.lang.OutOfMemoryError'
+
+    def test_stack_traces_in_a_row(self):
+        self._parse(b'[12:00:00 WARN]: java.io.IOException: Broken pipe')
+
+        event = self._parse(b'[12:00:00 WARN]: java.io.IOException: Connection reset')
+
+        assert event.data['message'] == 'Broken pipe'
+        assert self.parser.flush().data['message'] == 'Connection reset'
+
+    def test_error_without_exception(self):
+        assert self._parse(b'[12:00:00 ERROR]: Error occurred while enabling Foo') is None
+        assert self._parse(b'[12:00:00 INFO]: <Steve> Error everywhere').type == CHAT
+        assert self.parser.flush() is None
+
+
+class EventCountersTestCase(unittest.TestCase):
+
+    def test_add(self):
+        counters = EventCounters(history=3)
+
+        for i, event_type in enumerate([JOIN, CHAT, CHAT, LEAVE]):
+            counters.add(ConsoleEvent(NOW + i, event_type, {}, []))
+
+        assert counters.get_counts()[CHAT] == 2
+        assert counters.get_counts()[LAG] == 0
+        assert [event.type for event in counters.get_recent()] == [CHAT, CHAT, LEAVE]
+        assert [event.time for event in counters.get_recent(count=1)] == [NOW + 3]
+        assert [event.type for event in counters.get_recent(types=[LEAVE, JOIN])] == [LEAVE]
@@ -0,0 +1,201 @@
+import signal
+import time
+import unittest
+
+import mock
+
+from mcrunner.console import ConsoleBuffer
+from mcrunner.exceptions import ServerNotRunningException
+from mcrunner.health import HealthWatchdog, ServerHealth
+from mcrunner.sampler import ProcessSample, ResourceSampler
+from mcrunner.server_status import ServerStatus
+
+NOW = 1500000000.0
+
+
+def _server(last_output_at=NOW, status=ServerStatus.RUNNING):
+    server = mock.MagicMock()
+    server.name = 'survival'
+    server.health_check = True
+    server.health_threshold = 40
+    server.health_silence = 300
+    server.probe_interval = 60
+    server.probe_timeout = 30
+    server.probe_command = 'list'
+    server.launched_at = NOW - 3600
+    server.last_output_at = last_output_at
+    server.lag_warnings = []
+    server.output = ConsoleBuffer(1024)
+    server.get_status.return_value = status
+
+    return server
+
+
+class HealthWatchdogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _server()
+        self.servers = {'survival': self.server}
+        self.sampler = ResourceSampler(self.servers, 5, 600)
+        self.restart_handler = mock.MagicMock()
+
+        self.watchdog = HealthWatchdog(self.servers, self.sampler, 10, self.restart_handler)
+        self.health = ServerHealth()
+
+    def _check(self, now=NOW):
+        return self.watchdog.check_server(self.server, self.health, now)
+
+    def test_healthy(self):
+        report = self._check()
+
+        assert report.score == 100
+        assert report.problems == []
+        assert self.server.run_command.call_count == 0
+
+    def test_silence(self):
+        report = self._check(NOW + 300)
+
+        assert report.score == 75
+        assert report.problems == ['no console output for 300 seconds']
+
+    def test_silence_since_launch(self):
+        self.server.last_output_at = None
+        self.server.launched_at = NOW
+
+        assert self._check(NOW + 10).score == 100
+
+    def test_probe(self):
+        self._check(NOW + 60)
+
+        assert self.server.run_command.call_args == (('list',), {'wait': False, 'priority': True})
+        assert self.health.probe_sent_at == NOW + 60
+
+        # the server answered
+        self.server.last_output_at = NOW + 61
+        report = self._check(NOW + 100)
+
+        assert report.score == 100
+        assert self.health.probe_sent_at is None
+
+    def test_probe_unanswered(self):
+        self._check(NOW + 60)
+
+        report = self._check(NOW + 80)
+        assert report.score == 100
+
+        report = self._check(NOW + 90)
+        assert report.score == 60
+        assert report.problems == ['no response to "list" for 30 seconds']
+        assert self.server.run_command.call_count == 1
+
+    def test_probe_not_sent(self):
+        self.server.run_command.side_effect = ServerNotRunningException
+
+        self._check(NOW + 60)
+
+        assert self.health.probe_sent_at is None
+
+    def test_cpu_stalled(self):
+        series = self.sampler.series['survival']
+        series.append(ProcessSample(NOW - 30, 100.0, 0, 1, 0, 0, 0, 0))
+        series.append(ProcessSample(NOW, 100.01, 0, 1, 0, 0, 0, 0))
+
+        report = self._check()
+
+        assert report.score == 80
+        assert report.problems == ['0.0% cpu usage']
+
+    def test_cpu_busy(self):
+        series = self.sampler.series['survival']
+        series.append(ProcessSample(NOW - 30, 100.0, 0, 1, 0, 0, 0, 0))
+        series.append(ProcessSample(NOW, 130.0, 0, 1, 0, 0, 0, 0))
+
+        assert self._check().score == 100
+
+    def test_lag_warnings(self):
+        self.server.lag_warnings = [(NOW - 600, 9000), (NOW - 60, 2000), (NOW - 30, 5000)]
+
+        report = self._check()
+
+        assert report.score == 90
+        assert report.problems == ['2 lag warnings, up to 5000ms behind']
+
+    def test_lag_warnings_capped(self):
+        self.server.lag_warnings = [(NOW - i, 2000) for i in range(20)]
+
+        assert self._check().score == 70
+
+    def test_check_restarts_unhealthy(self):
+        self.watchdog.health['survival'].probe_sent_at = time.time() - 60
+        self.server.last_output_at = time.time() - 600
+
+        with mock.patch('mcrunner.health.threading.Thread') as MockThread:
+            self.watchdog.check()
+
+        health = self.watchdog.health['survival']
+
+        assert health.report.score == 35
+        assert health.recovering
+        assert MockThread.call_args[1]['args'] == (self.server, health)
+
+    def test_check_skips_disabled(self):
+        self.server.health_check = False
+
+        self.watchdog.check()
+
+        assert self.watchdog.health['survival'].report is None
+
+    def test_check_skips_not_running(self):
+        self.server.get_status.return_value = ServerStatus.STARTING
+        self.watchdog.health['survival'].probe_sent_at = NOW
+
+        self.watchdog.check()
+
+        assert self.watchdog.health['survival'].probe_sent_at is None
+
+    @mock.patch('mcrunner.health.time.sleep')
+    def test_recover(self, mock_sleep):
+        def dump(signum):
+            self.server.output.append(b'Full thread dump OpenJDK 64-Bit Server VM')
+            self.server.output.append(b'"Server thread" #20 prio=5 BLOCKED')
+
+        self.server.output.append(b'line before')
+        self.server.pipe.send_signal.side_effect = dump
+
+        health = self.watchdog.health['survival']
+        health.report = self._check(NOW + 300)
+        health.recovering = True
+
+        self.watchdog.recover(self.server, health)
+
+        assert self.server.pipe.send_signal.call_args[0] == (signal.SIGQUIT,)
+        assert health.diagnostics == [b'Full thread dump OpenJDK 64-Bit Server VM', b'"Server thread" #20 prio=5 BLOCKED']
+        assert health.diagnostics_at
+        assert self.restart_handler.call_args[0] == ('survival',)
+        assert not health.recovering
+        assert health.report is None
+
+    def test_recover_not_running(self):
+        self.server.pipe = None
+
+        health = self.watchdog.health['survival']
+        health.report = self._check(NOW + 300)
+
+        self.watchdog.recover(self.server, health)
+
+        assert health.diagnostics == []
+        assert self.restart_handler.call_count == 1
+
+    def test_recover_error(self):
+        self.server.pipe.send_signal.side_effect = OSError('No such process')
+        self.restart_handler.side_effect = RuntimeError
+
+        health = self.watchdog.health['survival']
+        health.report = self._check(NOW + 300)
+        health.recovering = True
+
+        with mock.patch('mcrunner.health.logger') as mock_logger:
+            self.watchdog.recover(self.server, health)
+
+        assert mock_logger.exception.call_count == 1
+        assert not health.recovering
@@ -1,12 +1,14 @@
+import json
 import mock
 import socket
+import subprocess
 import sys
 import tempfile
 import unittest
 
 from mcrunner import mcrunner
 from mcrunner.mcrunner import Controller
-from mcrunner.mcrunnerd import MCRUNNERD_COMMAND_DELIMITER
+from mcrunner.protocol import RESPONSE_DATA, RESPONSE_END, RESPONSE_MESSAGE, ResponseStatus
 
 
 TEST_CONFIG = b"""
@@ -49,41 +51,93 @@ class MCRunnerControllerTestCase(unittest.TestCase):
 
         assert controller.sock_file == None
 
-    def test_send_mcrunnerd_package(self):
+    def test_client_does_not_import_daemon(self):
+        code = 'import sys, mcrunner.mcrunner; sys.exit("mcrunner.mcrunnerd" in sys.modules)'
+
+        assert subprocess.call([sys.executable, '-c', code]) == 0
+
+    def _end(self, request_id, status='ok'):
+        return {'v': 1, 'id': request_id, 'type': RESPONSE_END, 'status': status, 'result': None}
+
+    def _message(self, request_id, message):
+        return {'v': 1, 'id': request_id, 'type': RESPONSE_MESSAGE, 'message': message}
+
+    def _data(self, request_id, data):
+        return {'v': 1, 'id': request_id, 'type': RESPONSE_DATA, 'data': data}
+
+    def test_send_request(self):
         controller = Controller(config_file=self.config_file.name)
 
         controller.socket_client = mock.MagicMock()
 
         mock_connection = mock.MagicMock()
-        mock_connection.receive_message = mock.MagicMock(side_effect=[
-            'some sample response message',
-            None  # socket closed
+        mock_connection.receive_response = mock.MagicMock(side_effect=[
+            self._message(1, 'some sample response message'),
+            self._data(1, {'lines': ['line 1', 'line 2'], 'dropped': 3}),
+            self._end(1, 'not_running'),
         ])
 
         with mock.patch('mcrunner.mcrunner._output') as mock_print:
             with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
-                controller.send_mcrunnerd_package('some_package')
+                status = controller.send_request('some_action', server='server_1')
 
-        assert mock_connection.send_message.call_count == 1
-        assert mock_connection.send_message.call_args[0] == ('some_package',)
+        assert status == ResponseStatus.NOT_RUNNING
 
-        assert mock_print.call_count == 1
-        assert mock_print.call_args[0] == ('some sample response message',)
+        assert mock_connection.send_request.call_count == 1
+        assert mock_connection.send_request.call_args == (('some_action',), {'server': 'server_1'})
+
+        assert mock_print.call_args_list == [
+            mock.call('some sample response message'),
+            mock.call('line 1'),
+            mock.call('line 2'),
+            mock.call('[3 lines dropped]'),
+        ]
+
+        assert mock_connection.close.call_count == 1
+
+    def test_send_request_json_output(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.json_output = True
+
+        controller.socket_client = mock.MagicMock()
+
+        mock_connection = mock.MagicMock()
+        mock_connection.receive_response = mock.MagicMock(side_effect=[self._end(1)])
+
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
+                status = controller.send_request('status')
+
+        assert status == ResponseStatus.OK
+        assert json.loads(mock_print.call_args[0][0]) == self._end(1)
+
+    def test_send_request_connection_closed(self):
+        controller = Controller(config_file=self.config_file.name)
+
+        controller.socket_client = mock.MagicMock()
+
+        mock_connection = mock.MagicMock()
+        mock_connection.receive_response = mock.MagicMock(return_value=None)
 
+        with mock.patch('mcrunner.mcrunner._output'):
+            with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
+                status = controller.send_request('status')
+
+        assert status is None
         assert mock_connection.close.call_count == 1
 
-    def test_send_mcrunnerd_package_with_socket_error(self):
+    def test_send_request_with_socket_error(self):
         controller = Controller(config_file=self.config_file.name)
 
         controller.socket_client = mock.MagicMock(side_effect=socket.error)
 
         with mock.patch('mcrunner.mcrunner._output') as mock_print:
-            controller.send_mcrunnerd_package('some_package')
+            assert controller.send_request('status') is None
 
         assert mock_print.call_count == 1
         assert mock_print.call_args[0] == ('Could not connect to socket - is mcrunnerd running?',)
 
-    def test_send_mcrunnerd_package_with_sendall_error(self):
+    def test_send_request_with_sendall_error(self):
         controller = Controller(config_file=self.config_file.name)
 
         controller.socket_client = mock.MagicMock()
@@ -91,54 +145,305 @@ class MCRunnerControllerTestCase(unittest.TestCase):
         socket_error = socket.error('bad send')
 
         mock_connection = mock.MagicMock()
-        mock_connection.send_message = mock.MagicMock(side_effect=socket_error)
+        mock_connection.send_request = mock.MagicMock(side_effect=socket_error)
 
         with mock.patch('mcrunner.mcrunner._output') as mock_print:
             with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
-                controller.send_mcrunnerd_package('some_package')
+                controller.send_request('status')
 
-        assert mock_connection.send_message.call_count == 1
-        assert mock_connection.send_message.call_args[0] == ('some_package',)
+        assert mock_connection.send_request.call_count == 1
 
         assert mock_print.call_count == 1
-        assert mock_print.call_args[0] == ('Error sending mcrunnerd package: %s' % str(socket_error),)
+        assert mock_print.call_args[0] == ('Error sending mcrunnerd request: %s' % str(socket_error),)
+
+        assert mock_connection.close.call_count == 1
+
+    def test_send_request_interrupted(self):
+        controller = Controller(config_file=self.config_file.name)
+
+        controller.socket_client = mock.MagicMock()
+
+        mock_connection = mock.MagicMock()
+        mock_connection.receive_response = mock.MagicMock(side_effect=[
+            self._data(1, {'lines': ['some line']}),
+            KeyboardInterrupt
+        ])
 
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
+                controller.send_request('tail', server='server_1', follow=True)
+
+        assert mock_print.call_count == 1
         assert mock_connection.close.call_count == 1
 
     def test_handle_mcrunnerd_action(self):
         controller = Controller(config_file=self.config_file.name)
-        controller.send_mcrunnerd_package = mock.MagicMock()
+        controller.send_request = mock.MagicMock()
 
         controller.handle_mcrunnerd_action('package')
 
-        assert controller.send_mcrunnerd_package.call_count == 1
-        assert controller.send_mcrunnerd_package.call_args[0] == ('package',)
+        assert controller.send_request.call_count == 1
+        assert controller.send_request.call_args == (('package',), {})
 
     def test_handle_server_action(self):
         controller = Controller(config_file=self.config_file.name)
-        controller.send_mcrunnerd_package = mock.MagicMock()
+        controller.send_request = mock.MagicMock()
 
         controller.handle_server_action('action', 'server_1')
 
-        assert controller.send_mcrunnerd_package.call_count == 1
-        assert controller.send_mcrunnerd_package.call_args[0] == (
-            'action{delim}server_1'.format(delim=MCRUNNERD_COMMAND_DELIMITER),
-        )
+        assert controller.send_request.call_count == 1
+        assert controller.send_request.call_args == (('action',), {'server': 'server_1'})
 
     def test_handle_server_action_with_command(self):
         controller = Controller(config_file=self.config_file.name)
-        controller.send_mcrunnerd_package = mock.MagicMock()
+        controller.send_request = mock.MagicMock()
 
         controller.handle_server_action('action', 'server_1', command='some command')
 
-        assert controller.send_mcrunnerd_package.call_count == 1
-        assert controller.send_mcrunnerd_package.call_args[0] == (
-            'action{delim}server_1{delim}some command'.format(delim=MCRUNNERD_COMMAND_DELIMITER),
+        assert controller.send_request.call_count == 1
+        assert controller.send_request.call_args == (
+            ('action',),
+            {'server': 'server_1', 'command': 'some command'}
+        )
+
+    def test_run_command(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.run_command('server_1', 'list', capture=True, terminator='online', quiet_period=1.0)
+
+        assert controller.send_request.call_args == (('command',), {
+            'server': 'server_1',
+            'command': 'list',
+            'capture': True,
+            'terminator': 'online',
+            'quiet_period': 1.0,
+        })
+
+    def test_run_commands(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.run_commands(['lobby-*'], ['say hi', 'save-all'])
+
+        assert controller.send_request.call_args == (('command',), {
+            'servers': ['lobby-*'],
+            'commands': ['say hi', 'save-all'],
+        })
+        assert controller.label_lines
+
+    def test_output_response_labelled(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.label_lines = True
+
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            controller.output_response({'type': RESPONSE_DATA, 'data': {'server': 'lobby-1', 'lines': ['0 players']}})
+
+        assert mock_print.call_args_list == [mock.call('[lobby-1] 0 players')]
+
+    def test_get_plugins(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.get_plugins(['*'])
+
+        assert controller.send_request.call_args == (('plugins',), {'servers': ['*']})
+
+    def test_handle_lifecycle_action(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.handle_lifecycle_action('restart', servers=['lobby-*'])
+
+        assert controller.send_request.call_args == (('restart',), {'servers': ['lobby-*']})
+
+    def test_handle_lifecycle_action_all(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.handle_lifecycle_action('stop', all_servers=True)
+
+        assert controller.send_request.call_args == (('stop',), {'all': True})
+
+    def test_tail_console(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.tail_console('server_1', lines=20, follow=True)
+
+        assert controller.send_request.call_args == (
+            ('tail',),
+            {'server': 'server_1', 'lines': 20, 'follow': True}
         )
 
+    def test_get_stats(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.get_stats('server_1')
+        assert controller.send_request.call_args == (('stats',), {'server': 'server_1'})
+
+        controller.get_stats('server_1', since=7200)
+        assert controller.send_request.call_args == (('stats',), {'server': 'server_1', 'since': 7200})
+
+    def test_get_logs(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.get_logs('server_1')
+        assert controller.send_request.call_args == (('logs',), {'server': 'server_1'})
+
+        controller.get_logs('server_1', since=7200, until=3600)
+        assert controller.send_request.call_args == (
+            ('logs',), {'server': 'server_1', 'since': 7200, 'until': 3600}
+        )
+
+    def test_search_logs(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.search_logs(['lobby-*'], ['Steve', 'joined'], since=7200)
+
+        assert controller.send_request.call_args == (
+            ('grep',), {'servers': ['lobby-*'], 'terms': ['Steve', 'joined'], 'since': 7200}
+        )
+        assert controller.label_lines
+
+    def test_get_events(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.send_request = mock.MagicMock()
+
+        controller.get_events('server_1')
+        assert controller.send_request.call_args == (('events',), {'server': 'server_1'})
+
+        controller.get_events('server_1', types=['join', 'leave'], count=5)
+        assert controller.send_request.call_args == (
+            ('events',), {'server': 'server_1', 'types': ['join', 'leave'], 'count': 5}
+        )
+
+    def test_parse_duration(self):
+        assert mcrunner.parse_duration('90') == 90
+        assert mcrunner.parse_duration('30m') == 1800
+        assert mcrunner.parse_duration('1.5h') == 5400
+        assert mcrunner.parse_duration('2d') == 172800
+        assert mcrunner.parse_duration('1w') == 604800
+        assert mcrunner.parse_duration('soon') is None
+        assert mcrunner.parse_duration('-1h') is None
+
+    def _attach(self, select_results, responses=(), stdin_data=(), buffered=None):
+        controller = Controller(config_file=self.config_file.name)
+
+        sock = mock.MagicMock()
+        controller.socket_client = mock.MagicMock(return_value=sock)
+
+        mock_connection = mock.MagicMock(sock_conn=sock)
+        mock_connection.has_buffered_frame = mock.MagicMock(return_value=False)
+        if buffered:
+            mock_connection.has_buffered_frame.side_effect = buffered
+        mock_connection.send_request = mock.MagicMock(side_effect=[1, 2, 3, 4])
+        mock_connection.receive_response = mock.MagicMock(side_effect=list(responses))
+
+        mock_stdin = mock.MagicMock()
+        mock_stdin.fileno = mock.MagicMock(return_value=0)
+
+        select_results = [([sock if r == 'sock' else 0], [], []) for r in select_results]
+
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with mock.patch('mcrunner.mcrunner.ClientSocketConnection', return_value=mock_connection):
+                with mock.patch('select.select', side_effect=select_results):
+                    with mock.patch('os.read', side_effect=list(stdin_data)):
+                        with mock.patch.object(sys, 'stdin', mock_stdin):
+                            status = controller.attach('server_1')
+
+        return controller, mock_connection, mock_print, status
+
+    def test_attach(self):
+        controller, mock_connection, mock_print, status = self._attach(
+            ['sock', 'stdin', 'stdin', 'sock', 'sock', 'sock', 'sock', 'sock'],
+            responses=[
+                self._data(1, {'lines': ['console line']}),
+                self._message(2, 'Sent command to Minecraft server "server_1": "say hi"'),
+                self._end(2),
+                self._message(3, 'Minecraft server "server_1" not running'),
+                self._end(3, 'not_running'),
+                None,
+            ],
+            stdin_data=[b'say hi\nli', b'st\n\n'],
+        )
+
+        assert mock_connection.send_request.call_args_list == [
+            mock.call('tail', server='server_1', lines=10, follow=True),
+            mock.call('command', server='server_1', command='say hi'),
+            mock.call('command', server='server_1', command='list'),
+        ]
+        assert mock_print.call_args_list == [
+            mock.call('console line'),
+            mock.call('Minecraft server "server_1" not running'),
+        ]
+        assert mock_connection.close.call_count == 1
+        assert controller.attached is False
+        assert status == ResponseStatus.OK
+
+    def test_attach_buffered_frames(self):
+        controller, mock_connection, mock_print, status = self._attach(
+            ['sock', 'sock'],
+            responses=[
+                self._data(1, {'lines': ['line 1']}),
+                self._data(1, {'lines': ['line 2']}),
+                None,
+            ],
+            buffered=[False, True, False],
+        )
+
+        # the second frame was already buffered, so select is skipped for it
+        assert mock_print.call_args_list == [mock.call('line 1'), mock.call('line 2')]
+
+    def test_attach_invalid_server(self):
+        controller, mock_connection, mock_print, status = self._attach(
+            ['sock', 'sock'],
+            responses=[
+                self._message(1, 'Minecraft server "server_1" not defined'),
+                self._end(1, 'not_found'),
+            ],
+        )
+
+        assert mock_print.call_args_list == [mock.call('Minecraft server "server_1" not defined')]
+        assert status == ResponseStatus.NOT_FOUND
+
+    def test_attach_stdin_closed(self):
+        controller, mock_connection, mock_print, status = self._attach(['stdin'], stdin_data=[b''])
+
+        assert mock_connection.send_request.call_count == 1
+        assert mock_connection.close.call_count == 1
+
+    def test_attach_interrupted(self):
+        controller, mock_connection, mock_print, status = self._attach(['sock'], responses=[KeyboardInterrupt])
+
+        assert mock_connection.close.call_count == 1
+        assert controller.attached is False
+
+    def test_attach_socket_error(self):
+        controller = Controller(config_file=self.config_file.name)
+        controller.socket_client = mock.MagicMock(side_effect=socket.error)
+
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            assert controller.attach('server_1') is None
+
+        assert mock_print.call_args[0] == ('Could not connect to socket - is mcrunnerd running?',)
+
 
 class MCRunnerMainTestCase(unittest.TestCase):
 
+    def _mock_controller(self):
+        mock_controller = mock.MagicMock()
+
+        for method in ['handle_mcrunnerd_action', 'handle_server_action', 'handle_lifecycle_action',
+                       'tail_console', 'attach', 'get_stats', 'run_command', 'run_commands',
+                       'get_plugins', 'get_logs', 'search_logs', 'get_events']:
+            getattr(mock_controller, method).return_value = ResponseStatus.OK
+
+        return mock_controller
+
     def test_output(self):
         with mock.patch.object(sys.stdout, 'write') as mock_write:
             mcrunner._output('test')
@@ -153,11 +458,11 @@ class MCRunnerMainTestCase(unittest.TestCase):
                 mcrunner.main()
 
         assert mock_print.call_count == 1
-        assert mock_print.call_args[0] == ('Usage: mcrunner <command> [arguments]',)
+        assert mock_print.call_args[0] == ('Usage: mcrunner [--json] <command> [arguments]',)
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'status'])
     def test_status(self):
-        mock_controller = mock.MagicMock()
+        mock_controller = self._mock_controller()
 
         with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
             mcrunner.main()
@@ -165,6 +470,33 @@ class MCRunnerMainTestCase(unittest.TestCase):
         assert mock_controller.handle_mcrunnerd_action.call_count == 1
         assert mock_controller.handle_mcrunnerd_action.call_args[0] == ('status',)
 
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'crashes', 'survival'])
+    def test_crashes(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.handle_server_action.call_args[0] == ('crashes', 'survival')
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'health'])
+    def test_health(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.handle_mcrunnerd_action.call_args[0] == ('health',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'metrics'])
+    def test_metrics(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.handle_mcrunnerd_action.call_args[0] == ('metrics',)
+
     @mock.patch.object(sys, 'argv', ['mcrunner', 'start'])
     def test_start_too_few_args(self):
         with mock.patch('mcrunner.mcrunner._output') as mock_print:
@@ -172,17 +504,46 @@ class MCRunnerMainTestCase(unittest.TestCase):
                 mcrunner.main()
 
         assert mock_print.call_count == 1
-        assert mock_print.call_args[0] == ('Usage: mcrunner start <server_name>',)
+        assert mock_print.call_args[0] == ('Usage: mcrunner start <server_name|pattern>... | --all',)
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'start', 'server_1'])
     def test_start(self):
-        mock_controller = mock.MagicMock()
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.handle_lifecycle_action.call_count == 1
+        assert mock_controller.handle_lifecycle_action.call_args == (('start',), {'servers': ['server_1']})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'restart', 'lobby-*', 'survival'])
+    def test_restart_multiple(self):
+        mock_controller = self._mock_controller()
 
         with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
             mcrunner.main()
 
-        assert mock_controller.handle_server_action.call_count == 1
-        assert mock_controller.handle_server_action.call_args[0] == ('start', 'server_1')
+        assert mock_controller.handle_lifecycle_action.call_args == (
+            ('restart',),
+            {'servers': ['lobby-*', 'survival']}
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'stop', '--all'])
+    def test_stop_all(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.handle_lifecycle_action.call_args == (('stop',), {'all_servers': True})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'stop', '--all', 'survival'])
+    def test_stop_all_with_names(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner stop <server_name|pattern>... | --all',)
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'command'])
     def test_command_too_few_args_no_server(self):
@@ -191,7 +552,11 @@ class MCRunnerMainTestCase(unittest.TestCase):
                 mcrunner.main()
 
         assert mock_print.call_count == 1
-        assert mock_print.call_args[0] == ('Usage: mcrunner command <server_name> <command>',)
+        assert mock_print.call_args[0] == (
+            'Usage: mcrunner command [--no-output] [--until <pattern>] [--wait <seconds>] '
+            '<server_name|pattern> <command>... | -s <server_name|pattern> [-s ...] <command>... '
+            '| --file <path|-> <server_name|pattern>...',
+        )
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'command', 'server_1'])
     def test_command_too_few_args(self):
@@ -204,18 +569,139 @@ class MCRunnerMainTestCase(unittest.TestCase):
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'command', 'server_1', 'say something'])
     def test_command(self):
-        mock_controller = mock.MagicMock()
+        mock_controller = self._mock_controller()
 
         with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
             mcrunner.main()
 
-        assert mock_controller.handle_server_action.call_count == 1
-        assert mock_controller.handle_server_action.call_args == ((
-            'command',
-            'server_1',
-        ), {
-            'command': 'say something'
-        })
+        assert mock_controller.run_command.call_count == 1
+        assert mock_controller.run_command.call_args == (
+            ('server_1', 'say something'),
+            {'capture': True, 'terminator': None, 'quiet_period': None}
+        )
+
+    @mock.patch.object(sys, 'argv', [
+        'mcrunner', 'command', '--until', 'players online', '--wait', '2', 'server_1', 'list'
+    ])
+    def test_command_capture_options(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.run_command.call_args == (
+            ('server_1', 'list'),
+            {'capture': True, 'terminator': 'players online', 'quiet_period': 2.0}
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '--no-output', 'server_1', 'save-all'])
+    def test_command_no_output(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.run_command.call_args[1]['capture'] is False
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', 'server_1', 'say', 'hello'])
+    def test_command_words(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.run_command.call_args[0] == ('server_1', 'say hello')
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '-s', 'lobby-*', '-s', 'survival', 'say restarting'])
+    def test_command_broadcast(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.run_command.call_count == 0
+        assert mock_controller.run_commands.call_args == (
+            (['lobby-*', 'survival'], ['say restarting']),
+            {'capture': True, 'terminator': None, 'quiet_period': None}
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', 'lobby-*', 'say', 'restarting'])
+    def test_command_pattern(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.run_commands.call_args[0] == (['lobby-*'], ['say restarting'])
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '-s', 'survival'])
+    def test_command_broadcast_no_command(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0][0].startswith('Usage: mcrunner command')
+
+    def test_command_file(self):
+        mock_controller = self._mock_controller()
+
+        with tempfile.NamedTemporaryFile('w') as command_file:
+            command_file.write('# announcement\nsay restarting\n\nsave-all\n')
+            command_file.flush()
+
+            with mock.patch.object(sys, 'argv', ['mcrunner', 'command', '--file', command_file.name, '*']):
+                with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+                    mcrunner.main()
+
+        assert mock_controller.run_commands.call_args[0] == (['*'], ['say restarting', 'save-all'])
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '--no-output', '--file', '-', 'server_1'])
+    def test_command_file_stdin(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch.object(sys, 'stdin') as mock_stdin:
+            mock_stdin.readlines.return_value = ['whitelist reload\n', 'save-all\n']
+
+            with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+                mcrunner.main()
+
+        assert mock_controller.run_commands.call_args == (
+            (['server_1'], ['whitelist reload', 'save-all']),
+            {'capture': False, 'terminator': None, 'quiet_period': None}
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '--file', '/nonexistent/commands.txt', 'server_1'])
+    def test_command_file_missing(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0][0].startswith('Could not read commands from /nonexistent/commands.txt: ')
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'command', '--wait', 'soon', 'server_1', 'list'])
+    def test_command_bad_option(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0][0].startswith('Usage: mcrunner command')
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'plugins', 'lobby-*', 'survival'])
+    def test_plugins(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.get_plugins.call_args[0] == (['lobby-*', 'survival'],)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'plugins'])
+    def test_plugins_too_few_args(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner plugins <server_name|pattern>...',)
 
     @mock.patch.object(sys, 'argv', ['mcrunner', 'bad_command'])
     def test_bad_arguments(self):
@@ -225,3 +711,159 @@ class MCRunnerMainTestCase(unittest.TestCase):
 
         assert mock_print.call_count == 1
         assert mock_print.call_args[0] == ('Unknown command: bad_command',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'stats', '--since', '2h', 'server_1'])
+    def test_stats(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.get_stats.call_args == (('server_1',), {'since': 7200})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'stats', '--since', 'yesterday', 'server_1'])
+    def test_stats_bad_since(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner stats [--since <duration>] <server_name>',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'logs', '--since', '2h', '--until', '1h', 'server_1'])
+    def test_logs(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.get_logs.call_args == (('server_1',), {'since': 7200, 'until': 3600})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'logs', 'server_1'])
+    def test_logs_all(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.get_logs.call_args == (('server_1',), {})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'logs', '--until', 'later', 'server_1'])
+    def test_logs_bad_until(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == (
+            'Usage: mcrunner logs [--since <duration>] [--until <duration>] <server_name>',
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'grep', '--since', '1d', '*', 'NullPointerException'])
+    def test_grep(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.search_logs.call_args == (
+            (['*'], ['NullPointerException']), {'since': 86400}
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'grep', 'server_1'])
+    def test_grep_no_terms(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == (
+            'Usage: mcrunner grep [--since <duration>] <server_name|pattern> <term>...',
+        )
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'events', '-n', '5', '--type', 'join', '--type', 'leave', 'server_1'])
+    def test_events(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.get_events.call_args == (('server_1',), {'types': ['join', 'leave'], 'count': 5})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'events', '-n', 'all', 'server_1'])
+    def test_events_bad_count(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner events [-n <count>] [--type <type>]... <server_name>',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'tail', 'server_1'])
+    def test_tail(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.tail_console.call_args == (('server_1',), {'lines': 10, 'follow': False})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'tail', '-f', '-n', '50', 'server_1'])
+    def test_tail_follow(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.tail_console.call_args == (('server_1',), {'lines': 50, 'follow': True})
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'tail', '-x', 'server_1'])
+    def test_tail_bad_option(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner tail [-f] [-n <lines>] <server_name>',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'tail'])
+    def test_tail_too_few_args(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner tail [-f] [-n <lines>] <server_name>',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'attach', 'server_1'])
+    def test_attach(self):
+        mock_controller = self._mock_controller()
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.attach.call_args[0] == ('server_1',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'attach'])
+    def test_attach_too_few_args(self):
+        with mock.patch('mcrunner.mcrunner._output') as mock_print:
+            with self.assertRaises(SystemExit):
+                mcrunner.main()
+
+        assert mock_print.call_args[0] == ('Usage: mcrunner attach <server_name>',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', '--json', 'status'])
+    def test_json_output(self):
+        mock_controller = mock.MagicMock()
+        mock_controller.handle_mcrunnerd_action.return_value = ResponseStatus.OK
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            mcrunner.main()
+
+        assert mock_controller.json_output is True
+        assert mock_controller.handle_mcrunnerd_action.call_args[0] == ('status',)
+
+    @mock.patch.object(sys, 'argv', ['mcrunner', 'stop', 'server_1'])
+    def test_request_failed(self):
+        mock_controller = mock.MagicMock()
+        mock_controller.handle_lifecycle_action.return_value = ResponseStatus.NOT_RUNNING
+
+        with mock.patch('mcrunner.mcrunner.Controller', return_value=mock_controller):
+            with self.assertRaises(SystemExit) as exc:
+                mcrunner.main()
+
+        assert exc.exception.code == 1
@@ -1,16 +1,33 @@
 import logging
 import mock
+import multiprocessing
 import os
+import shutil
+import signal
 import socket
 import sys
 import tempfile
+import threading
+import time
 import unittest
+import zipfile
 
 
 from mcrunner import mcrunnerd
-from mcrunner.exceptions import ServerNotRunningException, ServerStartException
-from mcrunner.mcrunnerd import MCRunner, MCRUNNERD_COMMAND_DELIMITER
-from mcrunner.server import MinecraftServer
+from mcrunner.connection import RequestConnection
+from mcrunner.exceptions import (
+    CommandNotDeliveredException,
+    CommandQueueFullException,
+    ProtocolException,
+    ServerNotRunningException,
+    ServerStartException,
+)
+from mcrunner.health import HealthReport
+from mcrunner.mcrunnerd import MCRunner
+from mcrunner.protocol import RESPONSE_DATA, RESPONSE_END, RESPONSE_MESSAGE, Request, ResponseStatus
+from mcrunner.sampler import ProcessSample
+from mcrunner.scheduler import MB
+from mcrunner.server import CrashRecord, MinecraftServer, SERVER_TERMINATE_TIMEOUT_SEC
 from mcrunner.server_status import ServerStatus
 
 TEST_CONFIG = b"""
@@ -36,6 +53,25 @@ restart_on_plugin_update=true
 """
 
 
+class SynchronousThread(object):
+
+    """
+    Stand-in for threading.Thread that runs its target inline on start().
+    """
+
+    def __init__(self, target=None, args=(), kwargs=None):
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.daemon = False
+
+    def start(self):
+        self.target(*self.args, **self.kwargs)
+
+    def join(self, timeout=None):
+        pass
+
+
 class MCRunnerTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -47,6 +83,10 @@ class MCRunnerTestCase(unittest.TestCase):
 
         self.sock_file = tempfile.NamedTemporaryFile()
 
+        # on_exit ignores the exit signals
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
     def tearDown(self):
         self.config_file.close()
         self.pid_file.close()
@@ -73,18 +113,70 @@ class MCRunnerTestCase(unittest.TestCase):
         ))
 
         self.daemon.socket_server = mock.MagicMock(return_value=mock_sock)
+        self.daemon.sampler = mock.MagicMock()
+        self.daemon.health = mock.MagicMock()
+
+        self.mock_watcher = mock.MagicMock()
+        watcher_patcher = mock.patch('mcrunner.mcrunnerd.create_watcher', return_value=self.mock_watcher)
+        watcher_patcher.start()
+        self.addCleanup(watcher_patcher.stop)
+
+        thread_patcher = mock.patch('mcrunner.mcrunnerd.threading.Thread', SynchronousThread)
+        thread_patcher.start()
+        self.addCleanup(thread_patcher.stop)
 
         self.mock_connection = mock.MagicMock()
-        self.mock_connection.receive_message = mock.MagicMock(side_effect=recv_list)
+        self.mock_connection.receive_request = mock.MagicMock(side_effect=recv_list)
+
+    def _patch_start_jar(self, ready=True):
+        """
+        Patch launching of the server jar. A started server immediately logs
+        its readiness line unless ``ready`` is False.
+        """
+        def start_jar(server, args):
+            if ready:
+                server._handle_output_line(b'[12:00:00 INFO]: Done (1.234s)! For help, type "help"')
+
+        return mock.patch.object(MinecraftServer, '_start_jar', autospec=True, side_effect=start_jar)
+
+    def _generate_request(self, action, **args):
+        return Request(1, action, args)
+
+    def _responses(self, response_type, connection=None):
+        connection = connection or self.mock_connection
+
+        return [
+            c for c in connection.send_response.call_args_list
+            if c[0][1] == response_type
+        ]
+
+    def _messages(self, connection=None):
+        return [c[1]['message'] for c in self._responses(RESPONSE_MESSAGE, connection)]
+
+    def _end_status(self, connection=None):
+        ends = self._responses(RESPONSE_END, connection)
 
-    def _generate_mcrunnerd_patckage(self, *args):
-        return MCRUNNERD_COMMAND_DELIMITER.join(args)
+        assert len(ends) == 1
+
+        return ends[0][1]['status']
 
     def test_load_config(self):
         daemon = self._set_up_daemon()
 
         assert daemon.log_file == '/var/log/mcrunner/mcrunnerd.log'
         assert daemon.sock_file == '/tmp/mcrunner.sock'
+        assert daemon.backlog == 16
+        assert daemon.shutdown_timeout == 75
+        assert daemon.max_parallel_operations == 4
+        assert daemon.memory_reserve == 1024
+        assert daemon.sample_interval == 5
+        assert daemon.sample_retention == 604800
+        assert daemon.sampler.series['survival'].capacity == 120960
+        assert daemon.metrics_port == 0
+        assert daemon.health_check_interval == 10
+        assert daemon.health.interval == 10
+        assert daemon.data_dir is None
+        assert daemon.metrics.servers is daemon.servers
 
         assert len(daemon.servers) == 2
 
@@ -119,7 +211,7 @@ class MCRunnerTestCase(unittest.TestCase):
         assert mock_sock.bind.call_count == 1
         assert mock_sock.bind.call_args[0] == (self.sock_file.name,)
         assert mock_sock.listen.call_count == 1
-        assert mock_sock.listen.call_args[0] == (1,)
+        assert mock_sock.listen.call_args[0] == (16,)
 
     def test_socket_server_os_error(self):
         daemon = self._set_up_daemon()
@@ -139,7 +231,21 @@ class MCRunnerTestCase(unittest.TestCase):
         assert mock_sock.bind.call_count == 1
         assert mock_sock.bind.call_args[0] == (self.sock_file.name,)
         assert mock_sock.listen.call_count == 1
-        assert mock_sock.listen.call_args[0] == (1,)
+        assert mock_sock.listen.call_args[0] == (16,)
+
+    def test_socket_server_backlog(self):
+        daemon = self._set_up_daemon()
+
+        daemon.sock_file = self.sock_file.name
+        daemon.backlog = 128
+
+        mock_sock = mock.MagicMock()
+
+        with mock.patch.object(os, 'unlink'):
+            with mock.patch('socket.socket', return_value=mock_sock):
+                daemon.socket_server()
+
+        assert mock_sock.listen.call_args[0] == (128,)
 
     def test_setup_logger(self):
         daemon = self._set_up_daemon()
@@ -168,291 +274,1713 @@ class MCRunnerTestCase(unittest.TestCase):
         assert 'survival: Running' in status
         assert 'creative: Stopped' in status
 
-    def test_start_minecraft_server_exception(self):
+    def test_get_status_startup_time(self):
         daemon = self._set_up_daemon()
 
-        with mock.patch.object(MinecraftServer, 'start', side_effect=ServerStartException):
-            daemon.start_minecraft_server('survival')
+        survival = daemon.servers['survival']
+        survival.status = ServerStatus.RUNNING
+        survival.startup_time = 93.47
 
-    def test_start_minecraft_server_invalid(self):
+        mock_connection = mock.MagicMock()
+
+        daemon.get_status(mock_connection)
+
+        assert 'survival: Running (started in 93.5 seconds)' in mock_connection.send_message.call_args[0][0]
+        assert mock_connection.set_result.call_args[0][0]['servers'][0] == {
+            'name': 'survival',
+            'status': 'Running',
+            'startup_time': 93.5,
+        }
+
+    def test_get_status_crashed(self):
         daemon = self._set_up_daemon()
 
-        daemon.start_minecraft_server('bad_server')
+        survival = daemon.servers['survival']
+        survival.launched_at = time.time() - 60
+        survival.crashes.append(CrashRecord(time.time(), 1, 60.0, []))
 
-    def test_stop_minecraft_server(self):
+        state = daemon.supervisor.servers['survival']
+        state.restart_at = time.time() + 10.5
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_status(mock_connection)
+
+        assert 'survival: Stopped (exited with code 1, restarting in 10 seconds)' in \
+            mock_connection.send_message.call_args[0][0]
+
+        result = mock_connection.set_result.call_args[0][0]['servers'][0]
+        assert result['exit_code'] == 1
+        assert 9 < result['restart_in'] <= 10.5
+
+    def test_get_status_crash_loop(self):
         daemon = self._set_up_daemon()
 
-        daemon.stop_minecraft_server('survival')
+        survival = daemon.servers['survival']
+        survival.crashes.append(CrashRecord(time.time(), 1, 60.0, []))
+        daemon.supervisor.servers['survival'].crash_loop = True
 
-    def test_stop_minecraft_server_invalid(self):
+        mock_connection = mock.MagicMock()
+
+        daemon.get_status(mock_connection)
+
+        assert 'survival: Stopped (exited with code 1, crash loop, not restarting)' in \
+            mock_connection.send_message.call_args[0][0]
+        assert mock_connection.set_result.call_args[0][0]['servers'][0]['crash_loop'] is True
+
+    def test_get_status_started_after_crash(self):
         daemon = self._set_up_daemon()
 
-        daemon.stop_minecraft_server('bad_server')
+        survival = daemon.servers['survival']
+        survival.crashes.append(CrashRecord(time.time() - 60, 1, 60.0, []))
+        survival.launched_at = time.time()
 
-    def test_on_exit(self):
+        mock_connection = mock.MagicMock()
+
+        daemon.get_status(mock_connection)
+
+        assert 'survival: Stopped\n' in mock_connection.send_message.call_args[0][0]
+
+    def test_get_status_queued(self):
         daemon = self._set_up_daemon()
 
-        daemon.servers['survival'].get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
-        daemon.servers['survival'].stop = mock.MagicMock()
-        daemon.servers['creative'].get_status = mock.MagicMock(return_value=ServerStatus.STOPPED)
-        daemon.servers['creative'].stop = mock.MagicMock()
+        daemon.servers['survival'].get_status = mock.MagicMock(return_value=ServerStatus.STOPPED)
+        daemon.scheduler.get_queue_status = mock.MagicMock(side_effect=lambda name: {
+            'survival': (2, 12.34),
+        }.get(name))
 
-        daemon.on_exit()
+        mock_connection = mock.MagicMock()
 
-        assert daemon.servers['survival'].stop.call_count == 1
-        assert daemon.servers['creative'].stop.call_count == 0
+        daemon.get_status(mock_connection)
 
-    def test_set_uid(self):
+        assert 'survival: Queued (position 2, waiting 12 seconds)' in mock_connection.send_message.call_args[0][0]
+        assert mock_connection.set_result.call_args[0][0]['servers'][0] == {
+            'name': 'survival',
+            'status': 'Queued',
+            'queue_position': 2,
+            'queue_wait': 12.3,
+        }
+
+    def test_handle_server_status(self):
         daemon = self._set_up_daemon()
+        server = daemon.servers['survival']
+        daemon.scheduler.committed['survival'] = 8 * 1024 * MB
 
-        daemon.user = 'test_user'
+        daemon.scheduler.starting.add('survival')
 
-        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
-            with mock.patch('os.getuid', return_value=0):
-                with mock.patch('os.setuid') as mock_setuid:
-                    daemon.set_uid()
+        server._set_status(ServerStatus.RUNNING)
+        assert 'survival' in daemon.scheduler.committed
+        assert 'survival' not in daemon.scheduler.starting
 
-        assert mock_setuid.call_count == 1
-        assert mock_setuid.call_args[0] == (1001,)
+        server._set_status(ServerStatus.STOPPED)
+        assert 'survival' not in daemon.scheduler.committed
 
-    def test_set_uid_self(self):
+    def test_handle_plugin_update(self):
         daemon = self._set_up_daemon()
+        server = daemon.servers['survival']
+        server.pipe = mock.MagicMock()
+        server.status = ServerStatus.RUNNING
+        daemon.scheduler.committed['survival'] = 8 * 1024 * MB
 
-        daemon.user = 'test_user'
+        with mock.patch.object(MinecraftServer, 'run_command'):
+            with self._patch_start_jar() as mock_start_jar:
+                with mock.patch.object(daemon.scheduler, 'acquire', wraps=daemon.scheduler.acquire) as acquire:
+                    server.handle_plugin_update()
 
-        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
-            with mock.patch('os.getuid', return_value=1001):
-                with mock.patch('os.setuid') as mock_setuid:
-                    daemon.set_uid()
+        assert mock_start_jar.call_count == 1
+        assert acquire.call_args[0] == ('survival', 8 * 1024 * MB)
+        assert daemon.scheduler.committed == {'survival': 8 * 1024 * MB}
 
-        assert mock_setuid.call_count == 0
+    def test_handle_crash(self):
+        daemon = self._set_up_daemon()
+        daemon.supervisor = mock.MagicMock()
 
-    def test_set_uid_user_not_found(self):
+        server = daemon.servers['survival']
+        server.pipe = pipe = mock.MagicMock()
+        pipe.wait.return_value = 1
+        server.status = ServerStatus.RUNNING
+        server.output.append(b'java.lang.OutOfMemoryError')
+
+        server._handle_exit(pipe)
+
+        crash = daemon.supervisor.handle_crash.call_args[0][1]
+
+        assert daemon.supervisor.handle_crash.call_args[0][0] is server
+        assert crash.returncode == 1
+        assert crash.lines == [b'java.lang.OutOfMemoryError']
+
+    def test_handle_clean_exit(self):
         daemon = self._set_up_daemon()
+        daemon.supervisor = mock.MagicMock()
 
-        daemon.user = 'test_user'
+        server = daemon.servers['survival']
+        server.pipe = pipe = mock.MagicMock()
+        pipe.wait.return_value = 0
+        server.status = ServerStatus.RUNNING
 
-        with mock.patch('pwd.getpwnam', side_effect=KeyError):
-            with self.assertRaises(SystemExit):
-                daemon.set_uid()
+        server._handle_exit(pipe)
 
-    def test_set_uid_user_not_root(self):
+        assert daemon.supervisor.handle_crash.call_count == 0
+        assert daemon.supervisor.handle_clean_exit.call_args[0][0] is server
+
+    def test_crash_restart(self):
         daemon = self._set_up_daemon()
 
-        daemon.user = 'test_user'
+        server = daemon.servers['survival']
+        server.restart_policy = 'on-failure'
+        server.restart_delay = 0.01
+        server.pipe = pipe = mock.MagicMock()
+        pipe.wait.return_value = 1
+        server.status = ServerStatus.RUNNING
+        daemon.scheduler.committed['survival'] = 8 * 1024 * MB
 
-        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
-            with mock.patch('os.getuid', return_value=1002):
-                with self.assertRaises(SystemExit):
-                    daemon.set_uid()
+        with self._patch_start_jar() as mock_start_jar:
+            server._handle_exit(pipe)
 
-    def test_set_uid_failure(self):
+            while mock_start_jar.call_count == 0:
+                time.sleep(0.001)
+
+        assert server.crash_count == 1
+        assert daemon.scheduler.committed == {'survival': 8 * 1024 * MB}
+
+    def test_get_memory_budget(self):
         daemon = self._set_up_daemon()
 
-        daemon.user = 'test_user'
+        with mock.patch('mcrunner.mcrunnerd.read_memory_total', return_value=16 * 1024 * MB):
+            assert daemon.get_memory_budget() == 15 * 1024 * MB
 
-        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
-            with mock.patch('os.getuid', return_value=0):
-                with mock.patch('os.setuid', side_effect=OSError):
-                    with self.assertRaises(SystemExit):
-                        daemon.set_uid()
+        with mock.patch('mcrunner.mcrunnerd.read_memory_total', return_value=None):
+            assert daemon.get_memory_budget() is None
 
-    @mock.patch('mcrunner.mcrunnerd.logger')
-    def test_run_startup_socket_error(self, logger):
-        self._set_up_daemon()
+    def test_get_stats(self):
+        daemon = self._set_up_daemon()
 
-        self.daemon.socket_server = mock.MagicMock(side_effect=OSError)
+        now = time.time()
+        series = daemon.sampler.series['survival']
+        series.append(ProcessSample(now - 7200, 10.0, 2 * 1024 * MB, 40, 0, 0, 0, 0))
+        series.append(ProcessSample(now - 10, 100.0, 3 * 1024 * MB, 80, 1000, 100, 0, 1024 * MB))
+        series.append(ProcessSample(now, 105.0, 4 * 1024 * MB, 87, 1500, 150, 0, 1034 * MB))
 
-        self.daemon.run()
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
 
-        assert logger.exception.call_count == 1
-        assert logger.exception.call_args[0] == ('Could not start mcrunnerd: ',)
+        daemon.get_stats('survival', 3600, connection)
 
-    def test_run_no_message(self):
-        self._set_up_daemon_with_recv([
-            'some data',
-            SystemExit
-        ])
+        assert connection.send_message.call_args[0][0].split('\n')[1:] == [
+            'cpu: 50.0% average, 50.0% peak',
+            'rss: 4.0 GB current, 4.0 GB peak',
+            'threads: 87',
+            'context switches: 50.0/s voluntary, 5.0/s involuntary',
+            'io: 0.0 B/s read, 1.0 MB/s write',
+        ]
+        assert connection.result['fields'][:3] == ['time', 'cpu_time', 'rss']
+        assert [sample[1] for sample in connection.result['samples']] == [100.0, 105.0]
 
-        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-            self.daemon.run()
+    def test_get_stats_no_samples(self):
+        daemon = self._set_up_daemon()
 
-        assert self.mock_connection.receive_message.call_count == 2
-        assert self.mock_connection.send_message.call_count == 0
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
 
-    @mock.patch('mcrunner.mcrunnerd.logger')
-    def test_run_socket_error(self, logger):
-        self._set_up_daemon_with_recv([
-            socket.error,
-            SystemExit
+        daemon.get_stats('survival', None, connection)
+
+        assert connection.send_message.call_args[0] == ('No resource usage samples of Minecraft server "survival"',)
+        assert connection.result['samples'] == []
+
+    def test_get_stats_invalid(self):
+        daemon = self._set_up_daemon()
+
+        connection = RequestConnection(mock.MagicMock(), 1)
+
+        daemon.get_stats('bad_server', None, connection)
+
+        assert connection.status == ResponseStatus.NOT_FOUND
+
+    def test_get_health(self):
+        daemon = self._set_up_daemon()
+
+        survival = daemon.servers['survival']
+        survival.health_check = True
+        survival.status = ServerStatus.RUNNING
+        daemon.health.health['survival'].report = HealthReport(time.time(), 35, [
+            'no console output for 320 seconds',
+            'no response to "list" for 31 seconds',
         ])
 
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
+
+        daemon.get_health(connection)
+
+        assert connection.send_message.call_args[0][0].splitlines() == [
+            'survival: 35 (no console output for 320 seconds, no response to "list" for 31 seconds)',
+            'creative: not checked',
+        ]
+        assert connection.result['servers'][0]['score'] == 35
+        assert connection.result['servers'][1]['score'] is None
+
+    def test_get_health_not_running(self):
+        daemon = self._set_up_daemon()
+        daemon.servers['survival'].health_check = True
+
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
+
+        daemon.get_health(connection)
+
+        assert connection.send_message.call_args[0][0].splitlines()[0] == 'survival: Stopped'
+
+    def test_run_health_check(self):
+        self._set_up_daemon_with_recv([SystemExit])
+
         with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
             self.daemon.run()
 
-        assert logger.exception.call_count == 1
-        assert logger.exception.call_args[0] == ('Error during socket connection',)
+        assert self.daemon.health.start.call_count == 1
 
-    def test_run_status(self):
-        self._set_up_daemon_with_recv([
-            'status',
-            SystemExit
-        ])
+    def test_run_plugin_watcher(self):
+        self._set_up_daemon_with_recv([SystemExit])
 
         with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
             self.daemon.run()
 
-        assert self.mock_connection.send_message.call_count == 1
+        creative = self.daemon.servers['creative']
 
-        status = self.mock_connection.send_message.call_args[0][0]
+        assert self.mock_watcher.watch.call_args_list == [
+            mock.call('/path/to/server2/plugins', creative.plugin_monitor.file_changed)
+        ]
+        assert self.mock_watcher.start.call_count == 1
 
-        assert 'survival: Stopped' in status
-        assert 'creative: Stopped' in status
+    def test_load_config_data_dir(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
 
-        assert self.mock_connection.close.call_count == 2
+        self.config_file.seek(0)
+        self.config_file.write(TEST_CONFIG.replace(
+            b'[mcrunnerd]\n', b'[mcrunnerd]\ndata_dir=%s\n' % data_dir.encode('utf8')
+        ))
+        self.config_file.flush()
 
-    def test_run_with_start_server(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('start', 'survival'),
-            SystemExit
-        ])
+        daemon = self._set_up_daemon()
 
-        with mock.patch.object(MinecraftServer, '_start_jar') as mock_start:
-            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                self.daemon.run()
+        assert daemon.data_dir == data_dir
+        assert daemon.servers['survival'].plugin_manifest.store_path == os.path.join(
+            data_dir, 'survival', 'plugins.json'
+        )
 
-        assert mock_start.call_count == 1
+    def test_get_plugins(self):
+        daemon = self._set_up_daemon()
 
-        assert self.mock_connection.send_message.call_count == 2
-        assert self.mock_connection.send_message.call_args_list[0][0] == ('Starting Minecraft server "survival"...',)
-        assert self.mock_connection.send_message.call_args_list[1][0] == ('Minecraft server "survival" started.',)
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
 
-    def test_run_with_start_invalid_server(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('start', 'bad_server_name'),
-            SystemExit
-        ])
+        os.mkdir(os.path.join(path, 'plugins'))
+        for name, version in (('Essentials.jar', '2.18.2'), ('WorldEdit.jar', '7.2.15')):
+            with zipfile.ZipFile(os.path.join(path, 'plugins', name), 'w') as jar:
+                jar.writestr('plugin.yml', 'version: %s\n' % version)
 
-        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-            self.daemon.run()
+        manifest = daemon.servers['survival'].plugin_manifest
+        manifest.path = os.path.join(path, 'plugins')
+        manifest.mark_started()
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Minecraft server "bad_server_name" not defined.',)
+        with zipfile.ZipFile(os.path.join(path, 'plugins', 'Essentials.jar'), 'w') as jar:
+            jar.writestr('plugin.yml', 'version: 2.19.0\n')
 
-    def test_run_with_start_server_running(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('start', 'survival'),
-            SystemExit
-        ])
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
 
-        with mock.patch.object(MinecraftServer, '_start_jar', side_effect=OSError('reason')) as mock_start_jar:
-            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                self.daemon.run()
+        daemon.get_plugins(['survival', 'bad_server'], connection)
 
-        assert mock_start_jar.call_count == 1
+        result = connection.result['servers'][0]
+        assert result['name'] == 'survival'
+        assert [(p['name'], p['version'], p['started_version'], p['state']) for p in result['plugins']] == [
+            ('Essentials.jar', '2.19.0', '2.18.2', 'changed'),
+            ('WorldEdit.jar', '7.2.15', '7.2.15', 'unchanged'),
+        ]
 
-        assert self.mock_connection.send_message.called
-        assert self.mock_connection.send_message.call_args[0] == ('Could not start server "survival"! Reason: reason',)
+        message = connection.send_message.call_args_list[0][0][0].splitlines()
+        assert message[0].startswith('Plugins of Minecraft server "survival", 1 changed since start at ')
+        assert message[1].split() == ['Essentials.jar', '2.19.0', result['plugins'][0]['digest'][:12],
+                                      'changed', 'from', '2.18.2']
+        assert message[2].split() == ['WorldEdit.jar', '7.2.15', result['plugins'][1]['digest'][:12]]
 
-    def test_run_with_restart_server(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('restart', 'survival'),
-            SystemExit
-        ])
+        assert connection.send_message.call_args_list[1][0] == ('Minecraft server "bad_server" not defined',)
+        assert connection.status == ResponseStatus.NOT_FOUND
 
-        with mock.patch.object(MinecraftServer, 'pipe'):
-            with mock.patch.object(MinecraftServer, 'run_command') as mock_run_command:
-                with mock.patch.object(MinecraftServer, '_start_jar') as mock_start:
-                    with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                        self.daemon.run()
+    def test_get_crashes(self):
+        daemon = self._set_up_daemon()
 
-        assert mock_start.call_count == 1
-        assert mock_run_command.call_count == 1
+        daemon.servers['survival'].crashes.append(CrashRecord(1500000000.0, 137, 3600.0, [b'line 1', b'line 2']))
 
-        assert self.mock_connection.send_message.call_count == 4
-        assert self.mock_connection.send_message.call_args_list[0][0] == ('Stopping Minecraft server "survival"...',)
-        assert self.mock_connection.send_message.call_args_list[1][0] == ('Minecraft server "survival" stopped.',)
-        assert self.mock_connection.send_message.call_args_list[2][0] == ('Starting Minecraft server "survival"...',)
-        assert self.mock_connection.send_message.call_args_list[3][0] == ('Minecraft server "survival" started.',)
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
 
-    def test_run_with_stop_server(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('stop', 'survival'),
-            SystemExit
-        ])
+        daemon.get_crashes('survival', connection)
 
-        with mock.patch.object(MinecraftServer, 'pipe'):
-            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                self.daemon.run()
+        assert connection.result == {'server': 'survival', 'crashes': [{
+            'time': 1500000000.0,
+            'exit_code': 137,
+            'uptime': 3600.0,
+            'lines': ['line 1', 'line 2'],
+        }]}
 
-        assert self.mock_connection.send_message.call_count == 2
-        assert self.mock_connection.send_message.call_args_list[0][0] == ('Stopping Minecraft server "survival"...',)
-        assert self.mock_connection.send_message.call_args_list[1][0] == ('Minecraft server "survival" stopped.',)
+        message = connection.send_message.call_args[0][0].splitlines()
+        assert message[0] == 'Recent crashes of Minecraft server "survival":'
+        assert message[1].endswith(': exited with code 137 after 3600.0 seconds')
+        assert message[2:] == ['    line 1', '    line 2']
 
-    def test_run_with_stop_invalid_server(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('stop', 'bad_server_name'),
-            SystemExit
-        ])
+    def test_get_crashes_none(self):
+        daemon = self._set_up_daemon()
 
-        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-            self.daemon.run()
+        connection = RequestConnection(mock.MagicMock(), 1)
+        connection.send_message = mock.MagicMock()
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Minecraft server "bad_server_name" not defined',)
+        daemon.get_crashes('survival', connection)
 
-    def test_run_with_stop_server_not_running(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('stop', 'survival'),
-            SystemExit
-        ])
+        assert connection.result == {'server': 'survival', 'crashes': []}
+        assert connection.send_message.call_args[0] == ('No crashes of Minecraft server "survival"',)
 
-        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-            self.daemon.run()
+    def test_get_crashes_invalid(self):
+        daemon = self._set_up_daemon()
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Minecraft server "survival" not running.',)
+        connection = RequestConnection(mock.MagicMock(), 1)
 
-    def test_run_with_command(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('command', 'survival', 'say test'),
-            SystemExit
-        ])
+        daemon.get_crashes('bad_server', connection)
 
-        with mock.patch.object(MinecraftServer, 'pipe'):
-            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                self.daemon.run()
+        assert connection.status == ResponseStatus.NOT_FOUND
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Sent command to Minecraft server "survival": "say test"',)
+    def test_start_minecraft_server_scheduled(self):
+        daemon = self._set_up_daemon()
+        daemon.scheduler = mock.MagicMock()
+        daemon.scheduler.get_queue_status.return_value = None
 
-    def test_run_with_command_invalid_server(self):
-        self._set_up_daemon_with_recv([
-            'command{delim}bad_server_name{delim}say test'.format(delim=MCRUNNERD_COMMAND_DELIMITER),
-            SystemExit
-        ])
+        mock_connection = mock.MagicMock()
 
-        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-            self.daemon.run()
+        with mock.patch.object(MinecraftServer, 'start') as mock_start:
+            daemon.start_minecraft_server('survival', connection=mock_connection)
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Minecraft server "bad_server_name" not defined',)
+        assert daemon.scheduler.acquire.call_args == (
+            ('survival', 8 * 1024 * MB),
+            {'connection': mock_connection}
+        )
+        assert mock_start.call_count == 1
+        assert daemon.scheduler.release.call_count == 0
 
-    def test_run_with_command_not_running(self):
-        self._set_up_daemon_with_recv([
-            self._generate_mcrunnerd_patckage('command', 'survival', 'say test'),
-            SystemExit
-        ])
+    def test_start_minecraft_server_already_running(self):
+        daemon = self._set_up_daemon()
 
-        with mock.patch.object(MinecraftServer, 'run_command', side_effect=ServerNotRunningException) as mock_command:
-            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
-                self.daemon.run()
+        connection = RequestConnection(mock.MagicMock(), 1)
 
-        assert mock_command.call_count == 1
-        assert mock_command.call_args[0] == ('say test',)
+        with self._patch_start_jar() as mock_start_jar:
+            daemon.start_minecraft_server('survival')
+            daemon.start_minecraft_server('survival', connection=connection)
+
+        assert mock_start_jar.call_count == 1
+        assert connection.status == ResponseStatus.ALREADY_RUNNING
+        assert daemon.scheduler.committed == {'survival': 8 * 1024 * MB}
+
+    def test_start_minecraft_server_uncommitted_running(self):
+        daemon = self._set_up_daemon()
+        daemon.servers['survival'].status = ServerStatus.STOPPING
+
+        connection = RequestConnection(mock.MagicMock(), 1)
+
+        with mock.patch.object(MinecraftServer, '_start_jar') as mock_start_jar:
+            daemon.start_minecraft_server('survival', connection=connection)
+
+        assert mock_start_jar.call_count == 0
+        assert connection.status == ResponseStatus.ALREADY_RUNNING
+        # kept until the server stops
+        assert daemon.scheduler.committed == {'survival': 8 * 1024 * MB}
+        assert daemon.scheduler.starting == set()
+
+    def test_start_minecraft_server_queued(self):
+        daemon = self._set_up_daemon()
+        daemon.scheduler.get_queue_status = mock.MagicMock(return_value=(1, 10.0))
+        daemon.scheduler.acquire = mock.MagicMock()
+
+        connection = RequestConnection(mock.MagicMock(), 1)
+
+        daemon.start_minecraft_server('survival', connection=connection)
+
+        assert daemon.scheduler.acquire.call_count == 0
+        assert connection.status == ResponseStatus.ALREADY_RUNNING
+
+    def test_start_minecraft_server_cancelled(self):
+        daemon = self._set_up_daemon()
+        daemon.scheduler.acquire = mock.MagicMock(return_value=False)
+
+        mock_connection = mock.MagicMock()
+
+        with mock.patch.object(MinecraftServer, 'start') as mock_start:
+            daemon.start_minecraft_server('survival', connection=mock_connection)
+
+        assert mock_start.call_count == 0
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.NOT_RUNNING,)
+        assert mock_connection.send_message.call_args[0] == ('Start of Minecraft server "survival" cancelled.',)
+
+    def test_start_minecraft_server_exception(self):
+        daemon = self._set_up_daemon()
+
+        with mock.patch.object(MinecraftServer, 'start', side_effect=ServerStartException):
+            daemon.start_minecraft_server('survival')
+
+        assert 'survival' not in daemon.scheduler.committed
+
+    def test_start_minecraft_server_invalid(self):
+        daemon = self._set_up_daemon()
+
+        daemon.start_minecraft_server('bad_server')
+
+    def test_stop_minecraft_server(self):
+        daemon = self._set_up_daemon()
+        daemon.scheduler.committed['survival'] = 8 * 1024 * MB
+
+        daemon.stop_minecraft_server('survival')
+
+        assert daemon.scheduler.committed == {}
+
+    def test_stop_minecraft_server_queued(self):
+        daemon = self._set_up_daemon()
+        daemon.scheduler.cancel = mock.MagicMock(return_value=True)
+        daemon.servers['survival'].stop = mock.MagicMock()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.stop_minecraft_server('survival', connection=mock_connection)
+
+        assert daemon.scheduler.cancel.call_args[0] == ('survival',)
+        assert daemon.servers['survival'].stop.call_count == 0
+        assert mock_connection.send_message.call_args[0] == (
+            'Queued start of Minecraft server "survival" cancelled.',
+        )
+
+    def test_stop_minecraft_server_invalid(self):
+        daemon = self._set_up_daemon()
+
+        daemon.stop_minecraft_server('bad_server')
+
+    def test_on_exit(self):
+        daemon = self._set_up_daemon()
+
+        daemon.servers['survival'].get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+        daemon.servers['survival'].stop = mock.MagicMock()
+        daemon.servers['creative'].get_status = mock.MagicMock(return_value=ServerStatus.STOPPED)
+        daemon.servers['creative'].stop = mock.MagicMock()
+
+        daemon.supervisor = mock.MagicMock()
+        daemon.watcher = mock.MagicMock()
+        daemon.console_log_writer = mock.MagicMock()
+
+        daemon.on_exit()
+
+        assert daemon.servers['survival'].stop.call_count == 1
+        assert daemon.servers['creative'].stop.call_count == 0
+        assert daemon.supervisor.stop.call_count == 1
+        assert daemon.watcher.stop.call_count == 1
+        assert daemon.console_log_writer.stop.call_count == 1
+
+    def test_on_exit_watcher_error(self):
+        daemon = self._set_up_daemon()
+
+        daemon.servers['survival'].get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+        daemon.servers['survival'].stop = mock.MagicMock()
+        daemon.watcher = mock.MagicMock()
+        daemon.watcher.stop.side_effect = OSError(9, 'Bad file descriptor')
+
+        with mock.patch('mcrunner.mcrunnerd.logger') as logger:
+            daemon.on_exit()
+
+        assert logger.exception.call_args[0] == ('Error stopping the plugin watcher',)
+        assert daemon.servers['survival'].stop.call_count == 1
+
+    def test_on_exit_parallel(self):
+        daemon = self._set_up_daemon()
+        daemon.shutdown_timeout = 30
+
+        barrier = threading.Event()
+        stopping = []
+
+        def stop(timeout=None):
+            stopping.append(timeout)
+            if len(stopping) == 2:
+                barrier.set()
+
+            # each stop only returns once both servers are being stopped
+            assert barrier.wait(5)
+
+        for server in daemon.servers.values():
+            server.get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+            server.stop = mock.MagicMock(side_effect=stop)
+
+        with mock.patch('mcrunner.mcrunnerd.logger') as logger:
+            daemon.on_exit()
+
+        assert len(stopping) == 2
+        assert all(0 < timeout <= 30 - SERVER_TERMINATE_TIMEOUT_SEC for timeout in stopping)
+
+        progress = [c[0][3:] for c in logger.info.call_args_list if 'shut down in' in c[0][0]]
+        assert sorted(progress) == [(1, 2), (2, 2)]
+        assert logger.info.call_args[0] == ('All Minecraft servers stopped.',)
+
+    def test_on_exit_second_signal(self):
+        daemon = self._set_up_daemon()
+
+        def sigtermhandler(signum, frame):
+            sys.exit()
+
+        signal.signal(signal.SIGTERM, sigtermhandler)
+
+        def stop(timeout=None):
+            # sent again by an impatient "mcrunnerd stop"
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.1)
+
+        for server in daemon.servers.values():
+            server.get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+            server.stop = mock.MagicMock(side_effect=stop)
+
+        daemon.console_log_writer = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd.logger') as logger:
+            daemon.on_exit()
+
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_IGN
+        assert logger.info.call_args[0] == ('All Minecraft servers stopped.',)
+        assert daemon.console_log_writer.stop.call_count == 1
+
+    def test_stop(self):
+        daemon = self._set_up_daemon()
+        daemon.shutdown_timeout = 30
+
+        with open(self.pid_file.name, 'w') as f:
+            f.write('1234\n')
+
+        kills = []
+
+        def kill(pid, signum):
+            kills.append(signum)
+            if len(kills) == 4:
+                raise OSError(3, 'No such process')
+
+        with mock.patch('os.kill', side_effect=kill), mock.patch('time.sleep'):
+            daemon.stop()
+
+        assert kills == [signal.SIGTERM, 0, 0, 0]
+        assert not os.path.exists(self.pid_file.name)
+
+        # removed with the temporary file
+        open(self.pid_file.name, 'w').close()
+
+    def test_stop_timeout(self):
+        daemon = self._set_up_daemon()
+        daemon.shutdown_timeout = 30
+
+        with open(self.pid_file.name, 'w') as f:
+            f.write('1234\n')
+
+        times = iter(range(0, 1000, 10))
+
+        with mock.patch('os.kill') as kill, mock.patch('time.sleep'), \
+                mock.patch('time.time', side_effect=lambda: next(times)):
+            with mock.patch.object(sys, 'stderr'):
+                with self.assertRaises(SystemExit):
+                    daemon.stop()
+
+        assert kill.call_args_list[0] == mock.call(1234, signal.SIGTERM)
+        # polled until the shutdown timeout, the terminate timeout and a margin passed
+        assert kill.call_count == 1 + (30 + SERVER_TERMINATE_TIMEOUT_SEC + mcrunnerd.DAEMON_STOP_MARGIN_SEC) // 10
+
+    def test_on_exit_server_still_running(self):
+        daemon = self._set_up_daemon()
+
+        survival = daemon.servers['survival']
+        survival.get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+        survival.stop = mock.MagicMock(side_effect=RuntimeError)
+        survival.pipe = mock.MagicMock()
+        daemon.servers['creative'].get_status = mock.MagicMock(return_value=ServerStatus.STOPPED)
+
+        with mock.patch('mcrunner.mcrunnerd.logger') as logger:
+            daemon.on_exit()
+
+        assert logger.error.call_args[0] == ('Minecraft servers still running after shutdown: %s', 'survival')
+
+    def test_set_uid(self):
+        daemon = self._set_up_daemon()
+
+        daemon.user = 'test_user'
+
+        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
+            with mock.patch('os.getuid', return_value=0):
+                with mock.patch('os.setuid') as mock_setuid:
+                    daemon.set_uid()
+
+        assert mock_setuid.call_count == 1
+        assert mock_setuid.call_args[0] == (1001,)
+
+    def test_set_uid_self(self):
+        daemon = self._set_up_daemon()
+
+        daemon.user = 'test_user'
+
+        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
+            with mock.patch('os.getuid', return_value=1001):
+                with mock.patch('os.setuid') as mock_setuid:
+                    daemon.set_uid()
+
+        assert mock_setuid.call_count == 0
+
+    def test_set_uid_user_not_found(self):
+        daemon = self._set_up_daemon()
+
+        daemon.user = 'test_user'
+
+        with mock.patch('pwd.getpwnam', side_effect=KeyError):
+            with self.assertRaises(SystemExit):
+                daemon.set_uid()
+
+    def test_set_uid_user_not_root(self):
+        daemon = self._set_up_daemon()
+
+        daemon.user = 'test_user'
+
+        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
+            with mock.patch('os.getuid', return_value=1002):
+                with self.assertRaises(SystemExit):
+                    daemon.set_uid()
+
+    def test_set_uid_failure(self):
+        daemon = self._set_up_daemon()
+
+        daemon.user = 'test_user'
+
+        with mock.patch('pwd.getpwnam', return_value=mock.MagicMock(pw_uid=1001)):
+            with mock.patch('os.getuid', return_value=0):
+                with mock.patch('os.setuid', side_effect=OSError):
+                    with self.assertRaises(SystemExit):
+                        daemon.set_uid()
+
+    @mock.patch('mcrunner.mcrunnerd.logger')
+    def test_run_startup_socket_error(self, logger):
+        self._set_up_daemon()
+
+        self.daemon.socket_server = mock.MagicMock(side_effect=OSError)
+
+        self.daemon.run()
+
+        assert logger.exception.call_count == 1
+        assert logger.exception.call_args[0] == ('Could not start mcrunnerd: ',)
+
+    def test_run_unknown_action(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('some data'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self.mock_connection.receive_request.call_count == 2
+        assert self._messages() == ['Unknown action: some data']
+        assert self._end_status() == 'bad_request'
+        assert 'some data' not in self.daemon.metrics.request_latency
+
+    def test_request_actions(self):
+        daemon = self._set_up_daemon()
+
+        for action in mcrunnerd.REQUEST_ACTIONS:
+            mock_connection = mock.MagicMock()
+
+            with mock.patch.multiple(
+                daemon, get_status=mock.DEFAULT, run_lifecycle_action=mock.DEFAULT, send_command=mock.DEFAULT,
+                get_stats=mock.DEFAULT, get_health=mock.DEFAULT, get_crashes=mock.DEFAULT, get_events=mock.DEFAULT,
+                get_plugins=mock.DEFAULT, get_logs=mock.DEFAULT, search_logs=mock.DEFAULT,
+                tail_console=mock.DEFAULT
+            ):
+                daemon.handle_request(action, {'server': 'survival', 'command': 'list', 'servers': ['survival'],
+                                               'terms': ['steve']}, mock_connection)
+
+            assert mock.call('Unknown action: %s' % action) not in mock_connection.send_message.call_args_list
+
+    def test_run_missing_argument(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('start'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self._messages() == ['Invalid arguments for action "start": \'server\'']
+        assert self._end_status() == 'bad_request'
+
+    def test_run_invalid_request(self):
+        self._set_up_daemon_with_recv([
+            ProtocolException('Unsupported protocol version: 2', 5),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self._messages() == ['Unsupported protocol version: 2']
+        assert self._end_status() == 'bad_request'
+        assert self.mock_connection.send_response.call_args[0][0] == 5
+
+    @mock.patch('mcrunner.mcrunnerd.logger')
+    def test_run_handler_error(self, logger):
+        self._set_up_daemon_with_recv([
+            self._generate_request('status'),
+            SystemExit
+        ])
+        self.daemon.get_status = mock.MagicMock(side_effect=RuntimeError)
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert logger.exception.call_count == 1
+        assert self._end_status() == 'error'
+
+    @mock.patch('mcrunner.mcrunnerd.logger')
+    def test_run_socket_error(self, logger):
+        self._set_up_daemon_with_recv([
+            socket.error,
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert logger.exception.call_count == 1
+        assert logger.exception.call_args[0] == ('Error during socket connection',)
+
+    def test_run_status(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('status'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert len(self._messages()) == 1
+
+        status = self._messages()[-1]
+
+        assert 'survival: Stopped' in status
+        assert 'creative: Stopped' in status
+
+        assert self._end_status() == 'ok'
+        assert self.mock_connection.send_response.call_args[1]['result'] == {'servers': [
+            {'name': 'survival', 'status': 'Stopped'},
+            {'name': 'creative', 'status': 'Stopped'},
+        ]}
+        assert self.mock_connection.close.call_count == 1
+
+    def test_run_with_start_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('start', server='survival'),
+            SystemExit
+        ])
+
+        with self._patch_start_jar() as mock_start:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert mock_start.call_count == 1
+
+        assert len(self._messages()) == 2
+        assert self._messages()[0] == 'Starting Minecraft server "survival"...'
+        assert self._messages()[1].startswith('Minecraft server "survival" started in ')
+        assert self._end_status() == 'ok'
+
+    def test_run_with_start_server_timeout(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('start', server='survival'),
+            SystemExit
+        ])
+        self.daemon.servers['survival'].start_timeout = 0.01
+
+        with self._patch_start_jar(ready=False):
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert self._messages()[-1] == 'Minecraft server "survival" did not finish starting within 0.01 seconds.'
+        assert self._end_status() == 'error'
+        assert self.daemon.servers['survival'].get_status() == ServerStatus.STARTING
+
+        # queued starts are no longer held back by the server
+        assert self.daemon.scheduler.committed == {'survival': 8 * 1024 * MB}
+        assert self.daemon.scheduler.starting == set()
+
+    def test_run_with_start_invalid_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('start', server='bad_server_name'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Minecraft server "bad_server_name" not defined.'
+        assert self._end_status() == 'not_found'
+
+    def test_run_with_start_server_running(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('start', server='survival'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, '_start_jar', side_effect=OSError('reason')) as mock_start_jar:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert mock_start_jar.call_count == 1
+
+        assert self._messages()
+        assert self._messages()[-1] == 'Could not start server "survival"! Reason: reason'
+        assert self._end_status() == 'error'
+
+    def test_run_with_restart_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('restart', server='survival'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'pipe'):
+            with mock.patch.object(MinecraftServer, 'run_command') as mock_run_command:
+                with self._patch_start_jar() as mock_start:
+                    with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                        self.daemon.run()
+
+        assert mock_start.call_count == 1
+        assert mock_run_command.call_count == 1
+
+        assert len(self._messages()) == 4
+        assert self._messages()[0] == 'Stopping Minecraft server "survival"...'
+        assert self._messages()[1] == 'Minecraft server "survival" stopped.'
+        assert self._messages()[2] == 'Starting Minecraft server "survival"...'
+        assert self._messages()[3].startswith('Minecraft server "survival" started in ')
+
+    def test_run_with_stop_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('stop', server='survival'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'pipe'):
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert len(self._messages()) == 2
+        assert self._messages()[0] == 'Stopping Minecraft server "survival"...'
+        assert self._messages()[1] == 'Minecraft server "survival" stopped.'
+
+    def test_run_with_stop_invalid_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('stop', server='bad_server_name'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Minecraft server "bad_server_name" not defined'
+
+    def test_run_with_stop_server_not_running(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('stop', server='survival'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Minecraft server "survival" not running.'
+        assert self._end_status() == 'not_running'
+
+    def test_resolve_servers(self):
+        daemon = self._set_up_daemon()
+
+        assert daemon.resolve_servers(['*']) == ['survival', 'creative']
+        assert daemon.resolve_servers(['cre*', 'creative', 'survival']) == ['creative', 'survival']
+        assert daemon.resolve_servers(['lobby-*', 'survival']) == ['lobby-*', 'survival']
+
+    def test_run_lifecycle_action(self):
+        daemon = self._set_up_daemon()
+        daemon.max_parallel_operations = 2
+
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def stop(name, connection=None):
+            with lock:
+                running.append(name)
+                max_running.append(len(running))
+
+            time.sleep(0.05)
+
+            with lock:
+                running.remove(name)
+
+            if name == 'creative':
+                connection.set_status(ResponseStatus.NOT_RUNNING)
+
+        daemon.stop_minecraft_server = mock.MagicMock(side_effect=stop)
+        daemon.supervisor = mock.MagicMock()
+
+        mock_server_connection = mock.MagicMock()
+        connection = RequestConnection(mock_server_connection, 1)
+
+        daemon.run_lifecycle_action('stop', ['survival', 'creative', 'survival_2'], connection)
+
+        assert daemon.stop_minecraft_server.call_count == 3
+        assert sorted(c[0][0] for c in daemon.supervisor.reset.call_args_list) == [
+            'creative', 'survival', 'survival_2'
+        ]
+        assert max(max_running) == 2
+
+        data = [c[1]['data'] for c in mock_server_connection.send_response.call_args_list]
+        assert sorted(d['server'] for d in data) == ['creative', 'survival', 'survival_2']
+
+        assert connection.status == ResponseStatus.NOT_RUNNING
+        assert connection.result == {'servers': [
+            {'name': 'survival', 'status': 'ok'},
+            {'name': 'creative', 'status': 'not_running'},
+            {'name': 'survival_2', 'status': 'ok'},
+        ]}
+
+    def test_run_lifecycle_action_mixed_failures(self):
+        daemon = self._set_up_daemon()
+
+        def start(name, connection=None):
+            if name == 'survival':
+                connection.set_status(ResponseStatus.NOT_FOUND)
+            else:
+                raise Exception('failure')
+
+        daemon.start_minecraft_server = mock.MagicMock(side_effect=start)
+
+        connection = RequestConnection(mock.MagicMock(), 1)
+
+        daemon.run_lifecycle_action('start', ['survival', 'creative'], connection)
+
+        assert connection.status == ResponseStatus.ERROR
+        assert connection.result == {'servers': [
+            {'name': 'survival', 'status': 'not_found'},
+            {'name': 'creative', 'status': 'error'},
+        ]}
+
+    def test_run_with_stop_pattern(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('stop', servers=['surv*', 'creative']),
+            SystemExit
+        ])
+        self.daemon.run_lifecycle_action = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self.daemon.run_lifecycle_action.call_args[0][:2] == ('stop', ['survival', 'creative'])
+
+    def test_run_with_restart_all(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('restart', all=True),
+            SystemExit
+        ])
+        self.daemon.run_lifecycle_action = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self.daemon.run_lifecycle_action.call_args[0][:2] == ('restart', ['survival', 'creative'])
+
+    def test_run_with_command(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', command='say test'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'pipe'):
+            with mock.patch.object(MinecraftServer, 'command_writer') as mock_writer:
+                with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                    self.daemon.run()
+
+        assert mock_writer.put.call_args[0] == (b'say test\n',)
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Sent command to Minecraft server "survival": "say test"'
+
+    def test_run_with_command_queue_full(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', command='say test'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', side_effect=CommandQueueFullException):
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert self._messages() == ['Too many commands waiting for Minecraft server "survival", command not sent']
+        assert self._end_status() == 'error'
+
+    def test_run_with_command_not_delivered(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', command='say test'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', side_effect=CommandNotDeliveredException):
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert self._messages() == [
+            'Minecraft server "survival" did not read command within 10.0 seconds, it is still queued'
+        ]
+        assert self._end_status() == 'error'
+
+    def test_run_with_command_capture(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request(
+                'command', server='survival', command='list', capture=True, terminator='online', quiet_period='1'
+            ),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', return_value=[b'1 players online']) as mock_command:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert mock_command.call_args[1]['capture'] is True
+        assert mock_command.call_args[1]['quiet_period'] == 1.0
+        assert mock_command.call_args[1]['terminator'].pattern == b'online'
+
+        assert self._messages() == []
+        assert self._responses(RESPONSE_DATA)[0][1]['data'] == {'server': 'survival', 'lines': ['1 players online']}
+        assert self.mock_connection.send_response.call_args[1]['result'] == {
+            'server': 'survival', 'commands': ['list'], 'lines': ['1 players online']
+        }
+
+    def test_run_with_commands(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', commands=['say restarting', 'save-all']),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'pipe'):
+            with mock.patch.object(MinecraftServer, 'command_writer') as mock_writer:
+                with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                    self.daemon.run()
+
+        assert mock_writer.put.call_args_list == [mock.call(b'say restarting\nsave-all\n', priority=False)]
+        assert self._messages() == ['Sent 2 commands to Minecraft server "survival"']
+
+    def test_run_with_no_commands(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', commands=[]),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self._messages() == ['No commands given']
+        assert self._end_status() == 'bad_request'
+
+    def test_run_with_command_broadcast(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', servers=['*'], commands=['say hi', 'save-all']),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', return_value=None) as mock_command:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert mock_command.call_count == 2
+        assert mock_command.call_args[0] == (['say hi', 'save-all'],)
+
+        assert sorted(self._messages()) == [
+            'Sent 2 commands to Minecraft server "creative"',
+            'Sent 2 commands to Minecraft server "survival"',
+        ]
+        assert self._end_status() == 'ok'
+        assert self.mock_connection.send_response.call_args[1]['result'] == {'servers': [
+            {'name': 'survival', 'status': 'ok'},
+            {'name': 'creative', 'status': 'ok'},
+        ]}
+
+    def test_run_with_command_broadcast_capture(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', servers=['survival', 'creative'], commands=['list'], capture=True),
+            SystemExit
+        ])
+
+        def run_commands(server, commands, **kwargs):
+            if server.name == 'survival':
+                raise ServerNotRunningException
+
+            return [b'0 players online']
+
+        with mock.patch.object(MinecraftServer, 'run_commands', autospec=True, side_effect=run_commands):
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert self._responses(RESPONSE_DATA)[0][1]['data'] == {'server': 'creative', 'lines': ['0 players online']}
+        assert self._end_status() == 'not_running'
+        assert self.mock_connection.send_response.call_args[1]['result'] == {'servers': [
+            {'name': 'survival', 'status': 'not_running', 'lines': []},
+            {'name': 'creative', 'status': 'ok', 'lines': ['0 players online']},
+        ]}
+
+    def test_run_with_command_broadcast_undefined(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', servers=['survival', 'say', 'lobby-*'], commands=['hello']),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', return_value=None) as mock_command:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        # an unmatched glob pattern alone doesn't refuse the request
+        assert mock_command.call_count == 0
+        assert self._messages() == ['Minecraft server "say" not defined', 'No commands sent']
+        assert self._end_status() == 'not_found'
+
+    def test_run_with_command_bad_terminator(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', command='list', capture=True, terminator='('),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self._messages()[0].startswith('Invalid output terminator "(": ')
+        assert self._end_status() == 'bad_request'
+
+    def test_run_with_command_invalid_server(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='bad_server_name', command='say test'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Minecraft server "bad_server_name" not defined'
+
+    def test_run_with_command_not_running(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('command', server='survival', command='say test'),
+            SystemExit
+        ])
+
+        with mock.patch.object(MinecraftServer, 'run_commands', side_effect=ServerNotRunningException) as mock_command:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert mock_command.call_count == 1
+        assert mock_command.call_args[0] == (['say test'],)
+
+        assert len(self._messages()) == 1
+        assert self._messages()[-1] == 'Minecraft server "survival" not running'
+        assert self._end_status() == 'not_running'
+
+    def test_start_connection_thread(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd.threading.Thread') as MockThread:
+            thread = daemon.start_connection_thread(mock_connection)
+
+        assert thread == MockThread.return_value
+        assert MockThread.call_args[1] == dict(target=daemon.handle_connection, args=(mock_connection,))
+        assert thread.daemon is True
+        assert thread.start.call_count == 1
+
+    def test_handle_connection_no_data(self):
+        daemon = self._set_up_daemon()
+        daemon.start_request_thread = mock.MagicMock()
+
+        mock_connection = mock.MagicMock()
+        mock_connection.receive_request = mock.MagicMock(return_value=None)
+
+        daemon.handle_connection(mock_connection)
+
+        assert daemon.start_request_thread.call_count == 0
+        assert mock_connection.close.call_count == 1
+
+    def test_handle_connection_pipelined(self):
+        daemon = self._set_up_daemon()
+        daemon.start_request_thread = mock.MagicMock()
+
+        requests = [Request(1, 'status', {}), Request(2, 'stop', {'server': 'survival'})]
+
+        mock_connection = mock.MagicMock()
+        mock_connection.receive_request = mock.MagicMock(side_effect=requests + [None])
+
+        daemon.handle_connection(mock_connection)
+
+        assert daemon.start_request_thread.call_args_list == [
+            mock.call(requests[0], mock_connection),
+            mock.call(requests[1], mock_connection),
+        ]
+
+    def test_handle_connection_concurrent(self):
+        daemon = self._set_up_daemon()
+
+        stop_started = threading.Event()
+        release_stop = threading.Event()
+        status_finished = threading.Event()
+
+        def slow_stop(connection=None):
+            stop_started.set()
+            release_stop.wait(5)
+
+        def send_response(request_id, response_type, **fields):
+            if request_id == 2 and response_type == RESPONSE_END:
+                status_finished.set()
+
+        daemon.servers['survival'].stop = slow_stop
+        daemon.servers['creative'].get_status = mock.MagicMock(return_value=ServerStatus.STOPPED)
+        daemon.servers['survival'].get_status = mock.MagicMock(return_value=ServerStatus.RUNNING)
+
+        mock_connection = mock.MagicMock(closed=False)
+        mock_connection.send_response = mock.MagicMock(side_effect=send_response)
+        mock_connection.receive_request = mock.MagicMock(side_effect=[
+            Request(1, 'stop', {'server': 'survival'}),
+            Request(2, 'status', {}),
+            None,
+        ])
+
+        original_start_request_thread = daemon.start_request_thread
+        threads = []
+
+        def start_request_thread(request, connection):
+            thread = original_start_request_thread(request, connection)
+            threads.append(thread)
+
+            if request.id == 1:
+                assert stop_started.wait(5)
+
+            return thread
+
+        daemon.start_request_thread = start_request_thread
+
+        try:
+            daemon.handle_connection(mock_connection)
+
+            # the status response completes while the stop request is still in progress
+            assert status_finished.wait(5)
+            assert threads[0].is_alive()
+        finally:
+            release_stop.set()
+            for thread in threads:
+                thread.join(5)
+
+        end_ids = [c[0][0] for c in self._responses(RESPONSE_END, mock_connection)]
+        assert end_ids == [2, 1]
+
+    def _set_up_console_log(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+        self.config_file.seek(0)
+        self.config_file.write(TEST_CONFIG.replace(
+            b'[mcrunnerd]\n', b'[mcrunnerd]\ndata_dir=%s\n' % self.data_dir.encode('utf8')
+        ))
+        self.config_file.flush()
+
+        daemon = self._set_up_daemon()
+        self.addCleanup(daemon.close_console_logs)
+
+        return daemon
+
+    def test_get_logs(self):
+        daemon = self._set_up_console_log()
+
+        now = time.time()
+        console_log = daemon.servers['survival'].console_log
+        for i in range(5):
+            console_log.append(('line %d' % i).encode('utf8'), now - 3600 * (4 - i))
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_logs('survival', 3 * 3600 + 60, 3600 - 60, mock_connection)
+
+        assert mock_connection.send_data.call_args_list == [mock.call({'lines': ['line 1', 'line 2', 'line 3']})]
+        assert mock_connection.set_result.call_args[0] == ({'server': 'survival', 'lines': 3},)
+
+    @mock.patch('mcrunner.mcrunnerd.LOGS_CHUNK_LINES', 2)
+    def test_get_logs_chunked(self):
+        daemon = self._set_up_console_log()
+
+        console_log = daemon.servers['survival'].console_log
+        for i in range(5):
+            console_log.append(('line %d' % i).encode('utf8'), time.time())
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_logs('survival', None, None, mock_connection)
+
+        assert [c[0][0]['lines'] for c in mock_connection.send_data.call_args_list] == [
+            ['line 0', 'line 1'], ['line 2', 'line 3'], ['line 4']
+        ]
+
+    def test_get_logs_empty(self):
+        daemon = self._set_up_console_log()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_logs('survival', 3600, None, mock_connection)
+
+        assert mock_connection.send_data.call_count == 0
+        assert mock_connection.send_message.call_args[0] == (
+            'No console output of Minecraft server "survival" in that time range',
+        )
+
+    def test_get_logs_not_stored(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_logs('survival', None, None, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.ERROR,)
+
+    def test_get_logs_invalid_server(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_logs('bad_server', None, None, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.NOT_FOUND,)
+
+    def _append_console_lines(self, daemon):
+        now = time.time()
+
+        for name in ('survival', 'creative'):
+            console_log = daemon.servers[name].console_log
+            console_log.append(b'[INFO]: Steve joined the game', now - 7200)
+            console_log.append(b'[INFO]: Alex joined the game', now - 60)
+            console_log.append(('[INFO]: Steve joined %s' % name).encode('utf8'), now - 30)
+
+    def test_search_logs(self):
+        daemon = self._set_up_console_log()
+        self._append_console_lines(daemon)
+
+        mock_connection = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd._format_match', side_effect=lambda when, line: line.decode('utf8')):
+            daemon.search_logs(['survival', 'creative'], ['steve', 'joined'], 3600, mock_connection)
+
+        assert mock_connection.send_data.call_args_list == [
+            mock.call({'server': 'survival', 'lines': ['[INFO]: Steve joined survival']}),
+            mock.call({'server': 'creative', 'lines': ['[INFO]: Steve joined creative']}),
+        ]
+        assert mock_connection.set_result.call_args[0] == (
+            {'terms': ['steve', 'joined'], 'matches': {'survival': 1, 'creative': 1}},
+        )
+
+    def test_search_logs_pool(self):
+        daemon = self._set_up_console_log()
+        self._append_console_lines(daemon)
+
+        daemon.search_pool = mock.MagicMock()
+        daemon.search_pool.apply_async.side_effect = lambda function, args: mock.MagicMock(
+            get=mock.MagicMock(return_value=function(*args))
+        )
+
+        mock_connection = mock.MagicMock()
+
+        daemon.search_logs(['survival', 'creative'], ['alex'], None, mock_connection)
+
+        assert daemon.search_pool.apply_async.call_count == 2
+        assert mock_connection.set_result.call_args[0][0]['matches'] == {'survival': 1, 'creative': 1}
+
+    def test_search_logs_worker_processes(self):
+        daemon = self._set_up_console_log()
+        self._append_console_lines(daemon)
+
+        daemon.search_pool = multiprocessing.Pool(2)
+        self.addCleanup(daemon.search_pool.terminate)
+
+        mock_connection = mock.MagicMock()
+
+        daemon.search_logs(['survival', 'creative'], ['steve'], None, mock_connection)
+
+        assert mock_connection.set_result.call_args[0][0]['matches'] == {'survival': 2, 'creative': 2}
+
+    @mock.patch('mcrunner.mcrunnerd.GREP_MAX_MATCHES', 1)
+    def test_search_logs_limit(self):
+        daemon = self._set_up_console_log()
+        self._append_console_lines(daemon)
+
+        mock_connection = mock.MagicMock()
+
+        daemon.search_logs(['survival'], ['steve'], None, mock_connection)
+
+        assert mock_connection.send_message.call_args[0] == (
+            'Showing the first 1 matches in the console output of Minecraft server "survival"',
+        )
+
+    def test_search_logs_no_matches(self):
+        daemon = self._set_up_console_log()
+        self._append_console_lines(daemon)
+
+        mock_connection = mock.MagicMock()
+
+        daemon.search_logs(['survival', 'bad_server'], ['herobrine'], None, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.NOT_FOUND,)
+        assert mock_connection.send_message.call_args_list == [
+            mock.call('Minecraft server "bad_server" not defined'),
+            mock.call('No console output matching "herobrine"'),
+        ]
+
+    def test_search_logs_not_stored(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.search_logs(['survival'], ['steve'], None, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.ERROR,)
+
+    def test_get_events(self):
+        daemon = self._set_up_daemon()
+
+        server = daemon.servers['survival']
+        with mock.patch('mcrunner.server.time.time', return_value=1500000000.0):
+            server._handle_output_line(b'[12:00:00 INFO]: Steve joined the game')
+            server._handle_output_line(b'[12:00:01 INFO]: <Steve> hello')
+            server._handle_output_line(b'[12:00:02 INFO]: Steve left the game')
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_events('survival', ['join', 'chat'], 1, mock_connection)
+
+        result = mock_connection.set_result.call_args[0][0]
+
+        assert result['server'] == 'survival'
+        assert result['counts']['join'] == 1
+        assert result['counts']['leave'] == 1
+        assert result['events'] == [{
+            'time': 1500000000.0,
+            'type': 'chat',
+            'data': {'player': 'Steve', 'message': 'hello'},
+            'lines': ['[12:00:01 INFO]: <Steve> hello'],
+        }]
+
+        message = mock_connection.send_message.call_args[0][0].splitlines()
+
+        assert message[0].startswith('Console events of Minecraft server "survival": 1 join, 1 leave, 1 chat, 0 lag')
+        assert message[1].endswith(' chat <Steve> hello')
+
+    def test_get_events_exception(self):
+        daemon = self._set_up_daemon()
+
+        server = daemon.servers['survival']
+        server._handle_output_line(b'[12:00:00 WARN]: java.io.IOException: Broken pipe')
+        server._handle_output_line(b'\tat java.io.FileOutputStream.write(FileOutputStream.java:1)')
+        server._handle_output_line(b'[12:00:01 INFO]: Saving chunks')
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_events('survival', None, 20, mock_connection)
+
+        assert mock_connection.send_message.call_args[0][0].splitlines()[1].endswith(
+            ' exception java.io.IOException: Broken pipe (1 more lines)'
+        )
+
+    def test_get_events_unknown_type(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_events('survival', ['join', 'death'], 20, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.BAD_REQUEST,)
+        assert mock_connection.send_message.call_args[0][0].startswith('Unknown event types: death (known: join, ')
+
+    def test_get_events_invalid_server(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.get_events('bad_server', None, 20, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.NOT_FOUND,)
+
+    def test_console_log_output(self):
+        daemon = self._set_up_console_log()
+
+        server = daemon.servers['survival']
+        server._handle_output_line(b'[12:00:00 INFO]: Hello')
+
+        assert server.console_log.path == os.path.join(self.data_dir, 'survival', 'console')
+        assert [line for _, line in server.console_log.read()] == []
+
+        daemon.console_log_writer.flush()
+
+        assert [line for _, line in server.console_log.read()] == [b'[12:00:00 INFO]: Hello']
+
+    def test_tail_console(self):
+        daemon = self._set_up_daemon()
+
+        for line in [b'line 1', b'line 2', b'line 3']:
+            daemon.servers['survival'].output.append(line)
+
+        mock_connection = mock.MagicMock()
+
+        daemon.tail_console('survival', 2, False, mock_connection)
+
+        assert mock_connection.send_data.call_count == 1
+        assert mock_connection.send_data.call_args[0] == ({'lines': ['line 2', 'line 3']},)
+
+    def test_tail_console_empty(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.tail_console('survival', 10, False, mock_connection)
+
+        assert mock_connection.send_data.call_count == 0
+
+    def test_tail_console_invalid_server(self):
+        daemon = self._set_up_daemon()
+
+        mock_connection = mock.MagicMock()
+
+        daemon.tail_console('bad_server', 10, True, mock_connection)
+
+        assert mock_connection.set_status.call_args[0] == (ResponseStatus.NOT_FOUND,)
+        assert mock_connection.send_message.call_args[0] == ('Minecraft server "bad_server" not defined',)
+
+    @mock.patch('mcrunner.mcrunnerd.TAIL_POLL_INTERVAL_SEC', 0.01)
+    def test_tail_console_follow(self):
+        daemon = self._set_up_daemon()
+        output = daemon.servers['survival'].output
+
+        output.append(b'old')
+
+        mock_connection = mock.MagicMock(closed=False)
+
+        def send_data(data):
+            if data == {'lines': ['old']}:
+                output.append(b'new 1')
+                output.append(b'new 2')
+            else:
+                mock_connection.closed = True
+
+        mock_connection.send_data = mock.MagicMock(side_effect=send_data)
+
+        daemon.tail_console('survival', 10, True, mock_connection)
+
+        assert mock_connection.send_data.call_args_list == [
+            mock.call({'lines': ['old']}),
+            mock.call({'lines': ['new 1', 'new 2']}),
+        ]
+        assert output.subscriptions == []
+
+    @mock.patch('mcrunner.mcrunnerd.TAIL_POLL_INTERVAL_SEC', 0.01)
+    def test_tail_console_follow_dropped(self):
+        daemon = self._set_up_daemon()
+        output = daemon.servers['survival'].output
+
+        mock_connection = mock.MagicMock(closed=False)
+
+        def send_data(data):
+            if 'lines' in data:
+                mock_connection.closed = True
+
+        mock_connection.send_data = mock.MagicMock(side_effect=send_data)
+
+        original_subscribe = output.subscribe
+
+        def subscribe(count):
+            lines, subscription = original_subscribe(count, maxlen=1)
+            subscription.put(b'dropped')
+            subscription.put(b'kept')
+            return lines, subscription
+
+        with mock.patch.object(output, 'subscribe', side_effect=subscribe):
+            daemon.tail_console('survival', 0, True, mock_connection)
+
+        assert mock_connection.send_data.call_args_list == [
+            mock.call({'dropped': 1}),
+            mock.call({'lines': ['kept']}),
+        ]
+
+    def test_tail_console_follow_disconnect(self):
+        daemon = self._set_up_daemon()
+        output = daemon.servers['survival'].output
+
+        output.append(b'line')
+
+        mock_connection = mock.MagicMock(closed=False)
+        mock_connection.send_data = mock.MagicMock(side_effect=socket.error)
+
+        daemon.tail_console('survival', 10, True, mock_connection)
+
+        assert output.subscriptions == []
+
+    def test_run_with_tail(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('tail', server='survival', lines='5'),
+            SystemExit
+        ])
+        self.daemon.tail_console = mock.MagicMock()
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        assert self.daemon.tail_console.call_args[0][:3] == ('survival', 5, False)
+
+    def test_run_metrics(self):
+        self._set_up_daemon_with_recv([
+            self._generate_request('status'),
+            self._generate_request('metrics'),
+            SystemExit
+        ])
+
+        with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+            self.daemon.run()
+
+        metrics = self._messages()[-1].splitlines()
+
+        assert 'mcrunner_server_status{server="survival",status="stopped"} 1' in metrics
+        assert 'mcrunner_request_duration_seconds_count{action="status"} 1' in metrics
+
+    def test_run_metrics_server(self):
+        self._set_up_daemon_with_recv([SystemExit])
+        self.daemon.metrics_port = 9225
+
+        with mock.patch('mcrunner.mcrunnerd.MetricsHTTPServer') as MockMetricsHTTPServer:
+            with mock.patch('mcrunner.mcrunnerd.ServerSocketConnection', return_value=self.mock_connection):
+                self.daemon.run()
+
+        assert MockMetricsHTTPServer.call_args[0] == (('127.0.0.1', 9225), self.daemon.metrics)
+        assert MockMetricsHTTPServer.return_value.start.call_count == 1
+
+    @mock.patch('mcrunner.mcrunnerd.logger')
+    def test_start_metrics_server_error(self, logger):
+        self._set_up_daemon()
+        self.daemon.metrics_port = 9225
+
+        with mock.patch('mcrunner.mcrunnerd.MetricsHTTPServer', side_effect=socket.error('in use')):
+            assert self.daemon.start_metrics_server() is None
 
-        assert self.mock_connection.send_message.call_count == 1
-        assert self.mock_connection.send_message.call_args[0] == ('Minecraft server "survival" not running',)
+        assert logger.error.call_args[0] == ('Could not start metrics listener on port 9225: in use',)
 
     def test_log_debug(self):
         self._set_up_daemon()
@@ -0,0 +1,177 @@
+import socket
+import time
+import unittest
+
+try:
+    # Python 2.x
+    from urllib2 import HTTPError, urlopen
+except ImportError:
+    # Python 3.x
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+import mock
+
+from mcrunner.console import CommandLimiter, ConsoleBuffer
+from mcrunner.events import ConsoleEvent, EventCounters
+from mcrunner.metrics import CONTENT_TYPE, Histogram, MetricsCollector, MetricsHTTPServer
+from mcrunner.sampler import ProcessSample, ResourceSampler
+from mcrunner.server_status import ServerStatus
+
+
+def _server(status=ServerStatus.STOPPED, pipe=None, launched_at=None, startup_time=None):
+    server = mock.MagicMock()
+    server.get_status.return_value = status
+    server.pipe = pipe
+    server.launched_at = launched_at
+    server.startup_time = startup_time
+    server.start_count = 3
+    server.restart_count = 1
+    server.crash_count = 2
+    server.output = ConsoleBuffer(1024)
+    server.command_limiter = CommandLimiter()
+    server.get_command_queue_depth.return_value = 0
+    server.events = EventCounters()
+
+    return server
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1))
+
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(2)
+
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert abs(histogram.sum - 2.65) < 1e-9
+
+    def test_render(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(2)
+
+        assert histogram.render('latency', 'action="status"').splitlines() == [
+            'latency_bucket{action="status",le="0.1"} 1',
+            'latency_bucket{action="status",le="1"} 1',
+            'latency_bucket{action="status",le="+Inf"} 2',
+            'latency_sum{action="status"} 2.05',
+            'latency_count{action="status"} 2',
+        ]
+
+    def test_render_cached(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        histogram.observe(0.05)
+
+        rendered = histogram.render('latency', 'action="status"')
+        assert histogram.render('latency', 'action="status"') is rendered
+
+        histogram.observe(0.05)
+        assert histogram.render('latency', 'action="status"').endswith('latency_count{action="status"} 2')
+
+
+class MetricsCollectorTestCase(unittest.TestCase):
+
+    def test_render_stopped(self):
+        servers = {'survival': _server()}
+        collector = MetricsCollector(servers, ResourceSampler(servers, 5, 60))
+
+        lines = collector.render().splitlines()
+
+        assert '# TYPE mcrunner_server_status gauge' in lines
+        assert 'mcrunner_server_status{server="survival",status="stopped"} 1' in lines
+        assert 'mcrunner_server_status{server="survival",status="running"} 0' in lines
+        assert 'mcrunner_server_starts_total{server="survival"} 3' in lines
+        assert 'mcrunner_server_restarts_total{server="survival"} 1' in lines
+        assert 'mcrunner_server_crashes_total{server="survival"} 2' in lines
+        assert 'mcrunner_server_console_lines_total{server="survival"} 0' in lines
+        assert not [line for line in lines if line.startswith('mcrunner_server_uptime_seconds')]
+        assert not [line for line in lines if line.startswith('mcrunner_server_resident_memory_bytes')]
+
+    def test_render_running(self):
+        servers = {'survival': _server(ServerStatus.RUNNING, mock.MagicMock(), time.time() - 60, 12.5)}
+        servers['survival'].output.append(b'line')
+        servers['survival'].get_command_queue_depth.return_value = 4
+        servers['survival'].command_limiter.dropped = 2
+        servers['survival'].command_limiter.coalesced = 5
+        servers['survival'].events.add(ConsoleEvent(time.time(), 'join', {'player': 'Steve'}, [b'line']))
+
+        sampler = ResourceSampler(servers, 5, 60)
+        sampler.series['survival'].append(ProcessSample(time.time(), 42.5, 1048576, 87, 0, 0, 0, 0))
+
+        collector = MetricsCollector(servers, sampler)
+        lines = collector.render().splitlines()
+
+        assert 'mcrunner_server_status{server="survival",status="running"} 1' in lines
+        assert 'mcrunner_server_startup_seconds{server="survival"} 12.5' in lines
+        assert 'mcrunner_server_console_lines_total{server="survival"} 1' in lines
+        assert 'mcrunner_server_command_queue_depth{server="survival"} 4' in lines
+        assert 'mcrunner_server_commands_dropped_total{server="survival"} 2' in lines
+        assert 'mcrunner_server_commands_coalesced_total{server="survival"} 5' in lines
+        assert 'mcrunner_server_console_events_total{server="survival",type="join"} 1' in lines
+        assert 'mcrunner_server_console_events_total{server="survival",type="chat"} 0' in lines
+        assert 'mcrunner_server_cpu_seconds_total{server="survival"} 42.5' in lines
+        assert 'mcrunner_server_resident_memory_bytes{server="survival"} 1048576' in lines
+        assert 'mcrunner_server_threads{server="survival"} 87' in lines
+
+        uptime = [line for line in lines if line.startswith('mcrunner_server_uptime_seconds')]
+        assert len(uptime) == 1
+        assert 59 < float(uptime[0].split()[1]) < 61
+
+    def test_render_request_latency(self):
+        collector = MetricsCollector({}, ResourceSampler({}, 5, 60))
+
+        collector.observe_request('status', 0.002)
+        collector.observe_request('status', 0.004)
+        collector.observe_request('start', 20)
+
+        lines = collector.render().splitlines()
+
+        assert '# TYPE mcrunner_request_duration_seconds histogram' in lines
+        assert 'mcrunner_request_duration_seconds_bucket{action="status",le="0.005"} 2' in lines
+        assert 'mcrunner_request_duration_seconds_count{action="status"} 2' in lines
+        assert 'mcrunner_request_duration_seconds_bucket{action="start",le="10"} 0' in lines
+        assert 'mcrunner_request_duration_seconds_bucket{action="start",le="30"} 1' in lines
+
+    def test_render_escapes_labels(self):
+        servers = {'my "server"': _server()}
+        collector = MetricsCollector(servers, ResourceSampler(servers, 5, 60))
+
+        assert 'mcrunner_server_starts_total{server="my \\"server\\""} 3' in collector.render().splitlines()
+
+
+class MetricsHTTPServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        collector = mock.MagicMock()
+        collector.render.return_value = 'mcrunner_server_threads{server="survival"} 87\n'
+
+        self.metrics_server = MetricsHTTPServer(('127.0.0.1', 0), collector)
+        self.metrics_server.start()
+        self.addCleanup(self.metrics_server.server_close)
+        self.addCleanup(self.metrics_server.shutdown)
+
+        self.url = 'http://127.0.0.1:%d' % self.metrics_server.server_address[1]
+
+    def test_get_metrics(self):
+        response = urlopen(self.url + '/metrics', timeout=5)
+
+        assert response.getcode() == 200
+        assert response.headers['Content-Type'] == CONTENT_TYPE
+        assert response.read() == b'mcrunner_server_threads{server="survival"} 87\n'
+
+    def test_get_not_found(self):
+        try:
+            urlopen(self.url + '/', timeout=5)
+        except HTTPError as e:
+            assert e.code == 404
+        else:
+            raise AssertionError('Expected HTTP 404')
+
+    def test_bind_loopback(self):
+        assert self.metrics_server.socket.getsockname()[0] == '127.0.0.1'
+        assert self.metrics_server.socket.family == socket.AF_INET
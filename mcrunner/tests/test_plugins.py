@@ -0,0 +1,312 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+import mock
+
+from mcrunner.plugins import (
+    PluginManifest,
+    PluginUpdateMonitor,
+    digest_file,
+    is_complete_jar,
+    list_jars,
+    read_plugin_version,
+)
+from mcrunner.server_status import ServerStatus
+
+
+def _write_jar(path, content, mtime=None):
+    with zipfile.ZipFile(path, 'w') as jar:
+        jar.writestr('plugin.yml', content)
+
+    # old enough to count as settled
+    mtime = mtime or time.time() - 3600
+    os.utime(path, (mtime, mtime))
+
+
+class PluginsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        os.mkdir(os.path.join(self.path, 'plugins'))
+
+    def _jar(self, name):
+        return os.path.join(self.path, 'plugins', name)
+
+    def test_digest_file(self):
+        with open(self._jar('a.jar'), 'wb') as f:
+            f.write(b'abc')
+
+        assert digest_file(self._jar('a.jar')) == 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
+
+    def test_is_complete_jar(self):
+        _write_jar(self._jar('a.jar'), 'name: A')
+
+        with open(self._jar('a.jar'), 'rb') as f:
+            data = f.read()
+
+        # upload still in progress
+        with open(self._jar('b.jar'), 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        assert is_complete_jar(self._jar('a.jar'))
+        assert not is_complete_jar(self._jar('b.jar'))
+        assert not is_complete_jar(self._jar('missing.jar'))
+
+    def test_list_jars(self):
+        _write_jar(self._jar('b.jar'), 'name: B')
+        _write_jar(self._jar('a.jar'), 'name: A')
+        open(self._jar('config.yml'), 'w').close()
+
+        assert list_jars(os.path.join(self.path, 'plugins')) == [self._jar('a.jar'), self._jar('b.jar')]
+        assert list_jars(os.path.join(self.path, 'missing')) == []
+
+
+class PluginManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.plugins_path = os.path.join(self.path, 'plugins')
+        self.store_path = os.path.join(self.path, 'data', 'survival', 'plugins.json')
+
+        os.mkdir(self.plugins_path)
+        _write_jar(self._jar('a.jar'), 'name: A\nversion: "1.0"\n')
+        _write_jar(self._jar('b.jar'), 'name: B\n')
+
+        self.manifest = PluginManifest(self.plugins_path, store_path=self.store_path)
+
+    def _jar(self, name):
+        return os.path.join(self.plugins_path, name)
+
+    def test_read_plugin_version(self):
+        assert read_plugin_version(self._jar('a.jar')) == '1.0'
+        assert read_plugin_version(self._jar('b.jar')) is None
+        assert read_plugin_version(self._jar('missing.jar')) is None
+
+    def test_refresh(self):
+        self.manifest.refresh()
+
+        entry = self.manifest.plugins['a.jar']
+        stat = os.stat(self._jar('a.jar'))
+
+        assert sorted(self.manifest.plugins) == ['a.jar', 'b.jar']
+        assert (entry.size, entry.mtime, entry.inode) == (stat.st_size, stat.st_mtime, stat.st_ino)
+        assert entry.digest == digest_file(self._jar('a.jar'))
+        assert entry.version == '1.0'
+
+    def test_refresh_digest_cached(self):
+        self.manifest.refresh()
+
+        with mock.patch('mcrunner.plugins.digest_file', return_value='0' * 64) as mock_digest:
+            self.manifest.refresh()
+
+            assert mock_digest.call_count == 0
+
+            os.utime(self._jar('b.jar'), None)
+            self.manifest.refresh()
+
+            assert mock_digest.call_args_list == [mock.call(self._jar('b.jar'))]
+
+    def test_refresh_removed(self):
+        self.manifest.refresh()
+        os.remove(self._jar('b.jar'))
+
+        self.manifest.refresh()
+
+        assert sorted(self.manifest.plugins) == ['a.jar']
+
+    def test_save_and_load(self):
+        self.manifest.mark_started()
+
+        manifest = PluginManifest(self.plugins_path, store_path=self.store_path)
+        manifest.load()
+
+        assert manifest.plugins == self.manifest.plugins
+        assert manifest.started == self.manifest.started
+        assert manifest.started_at == self.manifest.started_at
+
+        # loaded entries are not digested again
+        with mock.patch('mcrunner.plugins.digest_file') as mock_digest:
+            manifest.refresh()
+
+        assert mock_digest.call_count == 0
+
+    def test_load_invalid(self):
+        os.makedirs(os.path.dirname(self.store_path))
+        with open(self.store_path, 'w') as f:
+            f.write('{"plugins": ')
+
+        with mock.patch('mcrunner.plugins.logger') as mock_logger:
+            self.manifest.load()
+
+        assert mock_logger.warning.call_count == 1
+        assert self.manifest.plugins == {}
+
+    def test_save_error(self):
+        open(os.path.join(self.path, 'data'), 'w').close()
+
+        with mock.patch('mcrunner.plugins.logger') as mock_logger:
+            self.manifest.refresh()
+
+        assert mock_logger.warning.call_count == 1
+        assert self.manifest.dirty
+
+    def test_diff(self):
+        assert [state for _, _, _, state in (self.manifest.refresh() or self.manifest.diff())] == [None, None]
+
+        self.manifest.mark_started()
+
+        _write_jar(self._jar('a.jar'), 'name: A\nversion: 1.1\n')
+        _write_jar(self._jar('c.jar'), 'name: C\n')
+        os.remove(self._jar('b.jar'))
+        self.manifest.refresh()
+
+        diff = self.manifest.diff()
+
+        assert [(name, state) for name, _, _, state in diff] == [
+            ('a.jar', 'changed'), ('b.jar', 'removed'), ('c.jar', 'added')
+        ]
+        assert diff[0][1].version == '1.1'
+        assert diff[0][2].version == '1.0'
+
+
+class PluginUpdateMonitorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        os.mkdir(os.path.join(self.path, 'plugins'))
+        _write_jar(self._jar('a.jar'), 'version: 1')
+        _write_jar(self._jar('b.jar'), 'version: 1')
+
+        timer_patcher = mock.patch('mcrunner.plugins.threading.Timer')
+        self.MockTimer = timer_patcher.start()
+        self.addCleanup(timer_patcher.stop)
+
+        self.server = mock.MagicMock()
+        self.server.name = 'survival'
+        self.server.path = self.path
+        self.server.plugin_quiet_period = 10
+        self.server.get_status.return_value = ServerStatus.RUNNING
+        self.server.plugin_manifest = PluginManifest(os.path.join(self.path, 'plugins'))
+        self.server.plugin_manifest.mark_started()
+
+        self.monitor = PluginUpdateMonitor(self.server)
+
+    def _jar(self, name):
+        return os.path.join(self.path, 'plugins', name)
+
+    def _fire(self):
+        self.MockTimer.call_args[0][1]()
+
+    def test_file_changed(self):
+        self.monitor.file_changed(self._jar('a.jar'))
+        self.monitor.file_changed(self._jar('a.jar'))
+        self.monitor.file_changed(self._jar('b.jar'))
+        self.monitor.file_changed(self._jar('config.yml'))
+
+        assert self.MockTimer.call_count == 1
+        assert self.MockTimer.call_args[0][0] == 10
+        assert self.monitor.pending == set([self._jar('a.jar'), self._jar('b.jar')])
+
+    def test_quiet_period_extended(self):
+        self.monitor.file_changed(self._jar('a.jar'))
+        self.monitor.deadline = time.time() + 5
+
+        self._fire()
+
+        assert self.MockTimer.call_count == 2
+        assert 4 < self.MockTimer.call_args[0][0] <= 5
+        assert self.monitor.pending == set([self._jar('a.jar')])
+
+    def test_deploy_restarts_once(self):
+        _write_jar(self._jar('a.jar'), 'version: 2')
+        _write_jar(self._jar('b.jar'), 'version: 2')
+        _write_jar(self._jar('c.jar'), 'version: 1')
+
+        for name in ('a.jar', 'b.jar', 'c.jar', 'a.jar'):
+            self.monitor.file_changed(self._jar(name))
+
+        self.monitor.deadline = time.time()
+        self._fire()
+
+        assert self.server.handle_plugin_update.call_count == 1
+        assert self.monitor.manifest.plugins['c.jar'].digest == digest_file(self._jar('c.jar'))
+
+    def test_content_unchanged(self):
+        # rewritten with the same content
+        os.utime(self._jar('a.jar'), None)
+
+        self.monitor.check([self._jar('a.jar')], now=time.time() + 60)
+
+        assert self.server.handle_plugin_update.call_count == 0
+
+    def test_unsettled(self):
+        _write_jar(self._jar('a.jar'), 'version: 2', mtime=time.time())
+        _write_jar(self._jar('b.jar'), 'version: 2')
+
+        self.monitor.check([self._jar('a.jar'), self._jar('b.jar')])
+
+        assert self.server.handle_plugin_update.call_count == 0
+        assert self.monitor.pending == set([self._jar('a.jar')])
+        assert self.MockTimer.call_count == 1
+
+        # both are picked up once the other one settled
+        settled_at = time.time() - 60
+        os.utime(self._jar('a.jar'), (settled_at, settled_at))
+
+        self.monitor.deadline = time.time()
+        self._fire()
+
+        assert self.server.handle_plugin_update.call_count == 1
+
+    def test_incomplete_jar(self):
+        with open(self._jar('a.jar'), 'wb') as f:
+            f.write(b'PK\x03\x04')
+
+        with mock.patch('mcrunner.plugins.logger') as mock_logger:
+            self.monitor.check([self._jar('a.jar')], now=time.time() + 60)
+
+        assert mock_logger.warning.call_count == 1
+        assert self.server.handle_plugin_update.call_count == 0
+
+    def test_deleted(self):
+        os.remove(self._jar('a.jar'))
+
+        self.monitor.check([self._jar('a.jar'), self._jar('missing.jar')])
+
+        assert self.server.handle_plugin_update.call_count == 1
+        assert 'a.jar' not in self.monitor.manifest.plugins
+
+    def test_changed_back(self):
+        # another jar is still being written
+        self.monitor.pending.add(self._jar('b.jar'))
+
+        _write_jar(self._jar('a.jar'), 'version: 2')
+        self.monitor.check([self._jar('a.jar')])
+
+        assert self.monitor.changed == set(['a.jar'])
+
+        _write_jar(self._jar('a.jar'), 'version: 1')
+
+        self.monitor.pending.clear()
+        self.monitor.check([self._jar('a.jar')])
+
+        assert self.server.handle_plugin_update.call_count == 0
+
+    def test_not_running(self):
+        self.server.get_status.return_value = ServerStatus.STOPPED
+        _write_jar(self._jar('a.jar'), 'version: 2')
+
+        self.monitor.check([self._jar('a.jar')])
+
+        assert self.server.handle_plugin_update.call_count == 0
+        assert self.monitor.changed == set()
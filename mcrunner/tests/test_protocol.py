@@ -0,0 +1,78 @@
+import json
+import unittest
+
+from mcrunner.exceptions import ProtocolException
+from mcrunner.protocol import (
+    PROTOCOL_VERSION,
+    RESPONSE_END,
+    RESPONSE_MESSAGE,
+    Request,
+    decode_request,
+    decode_response,
+    encode_request,
+    encode_response,
+)
+
+
+class ProtocolTestCase(unittest.TestCase):
+
+    def test_encode_decode_request(self):
+        frame = encode_request(1, 'command', server='survival', command='say hi')
+
+        assert decode_request(frame) == Request(1, 'command', {'server': 'survival', 'command': 'say hi'})
+
+    def test_decode_request_bytes(self):
+        frame = encode_request(2, 'status').encode('utf8')
+
+        assert decode_request(frame) == Request(2, 'status', {})
+
+    def test_decode_request_invalid_json(self):
+        with self.assertRaises(ProtocolException):
+            decode_request('status|+|survival')
+
+    def test_decode_request_empty(self):
+        with self.assertRaises(ProtocolException) as exc:
+            decode_request('')
+
+        assert str(exc.exception) == 'Empty frame'
+
+    def test_decode_request_not_object(self):
+        with self.assertRaises(ProtocolException):
+            decode_request('[1, 2]')
+
+    def test_decode_request_bad_version(self):
+        frame = json.dumps({'v': PROTOCOL_VERSION + 1, 'id': 3, 'action': 'status'})
+
+        with self.assertRaises(ProtocolException) as exc:
+            decode_request(frame)
+
+        assert exc.exception.request_id == 3
+
+    def test_decode_request_missing_action(self):
+        frame = json.dumps({'v': PROTOCOL_VERSION, 'id': 4})
+
+        with self.assertRaises(ProtocolException) as exc:
+            decode_request(frame)
+
+        assert exc.exception.request_id == 4
+
+    def test_encode_decode_response(self):
+        frame = encode_response(5, RESPONSE_MESSAGE, message='Starting...')
+
+        assert decode_response(frame) == {
+            'v': PROTOCOL_VERSION,
+            'id': 5,
+            'type': RESPONSE_MESSAGE,
+            'message': 'Starting...',
+        }
+
+    def test_decode_response_end(self):
+        frame = encode_response(5, RESPONSE_END, status='ok', result=None)
+
+        assert decode_response(frame)['status'] == 'ok'
+
+    def test_decode_response_bad_type(self):
+        frame = json.dumps({'v': PROTOCOL_VERSION, 'id': 6, 'type': 'other'})
+
+        with self.assertRaises(ProtocolException):
+            decode_response(frame)
@@ -0,0 +1,221 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from mcrunner.sampler import (
+    CLOCK_TICKS,
+    PAGE_SIZE,
+    ProcessSample,
+    ResourceSampler,
+    SampleSeries,
+    read_process_sample,
+    summarize_samples,
+)
+
+STAT = '4242 (java (main)) S 1 4242 4242 0 -1 4194560 1000 0 0 0 250 50 0 0 20 0 87 0 100 8000000000 262144 ' \
+       '18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 17 3 0 0 0 0 0\n'
+
+STATUS = """Name:\tjava
+State:\tS (sleeping)
+Threads:\t87
+voluntary_ctxt_switches:\t1200
+nonvoluntary_ctxt_switches:\t34
+"""
+
+IO = """rchar: 100
+wchar: 200
+read_bytes: 4096
+write_bytes: 8192
+"""
+
+
+def _sample(time, cpu_time=0.0, rss=0, threads=1, switches=0, read_bytes=0, write_bytes=0):
+    return ProcessSample(time, cpu_time, rss, threads, switches, switches // 2, read_bytes, write_bytes)
+
+
+class ReadProcessSampleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.proc_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.proc_path)
+
+        os.mkdir(os.path.join(self.proc_path, '4242'))
+
+    def _write(self, name, content):
+        with open(os.path.join(self.proc_path, '4242', name), 'w') as f:
+            f.write(content)
+
+    def test_read(self):
+        self._write('stat', STAT)
+        self._write('status', STATUS)
+        self._write('io', IO)
+
+        sample = read_process_sample(4242, proc_path=self.proc_path)
+
+        assert sample.cpu_time == 300.0 / CLOCK_TICKS
+        assert sample.rss == 262144 * PAGE_SIZE
+        assert sample.threads == 87
+        assert sample.voluntary_switches == 1200
+        assert sample.involuntary_switches == 34
+        assert sample.read_bytes == 4096
+        assert sample.write_bytes == 8192
+
+    def test_read_without_io(self):
+        self._write('stat', STAT)
+        self._write('status', STATUS)
+
+        sample = read_process_sample(4242, proc_path=self.proc_path)
+
+        assert sample.threads == 87
+        assert sample.read_bytes == 0
+        assert sample.write_bytes == 0
+
+    def test_read_process_gone(self):
+        assert read_process_sample(4243, proc_path=self.proc_path) is None
+
+    def test_read_own_process(self):
+        sample = read_process_sample(os.getpid())
+
+        assert sample.rss > 0
+        assert sample.threads >= 1
+
+
+class SampleSeriesTestCase(unittest.TestCase):
+
+    def test_append(self):
+        series = SampleSeries(10)
+
+        series.append(_sample(1.0, rss=100))
+        series.append(_sample(2.0, rss=200))
+
+        assert len(series) == 2
+        assert [sample.rss for sample in series.get_samples()] == [100, 200]
+
+    def test_append_wraps(self):
+        series = SampleSeries(3)
+
+        for i in range(5):
+            series.append(_sample(float(i), rss=i))
+
+        assert len(series) == 3
+        assert [sample.rss for sample in series.get_samples()] == [2, 3, 4]
+
+    def test_latest(self):
+        series = SampleSeries(3)
+
+        assert series.latest() is None
+
+        for i in range(5):
+            series.append(_sample(float(i), rss=i))
+            assert series.latest().rss == i
+
+    def test_nbytes_bounded(self):
+        series = SampleSeries(100)
+
+        for i in range(1000):
+            series.append(_sample(float(i)))
+
+        assert len(series) == 100
+        assert series.nbytes <= 100 * 64
+
+    def test_get_samples_since(self):
+        series = SampleSeries(4)
+
+        for i in range(6):
+            series.append(_sample(float(i * 5), rss=i))
+
+        assert [sample.rss for sample in series.get_samples(since=12)] == [3, 4, 5]
+        assert [sample.rss for sample in series.get_samples(since=0)] == [2, 3, 4, 5]
+        assert series.get_samples(since=30) == []
+
+    def test_get_samples_empty(self):
+        assert SampleSeries(4).get_samples(since=10) == []
+
+
+class ResourceSamplerTestCase(unittest.TestCase):
+
+    def test_sample(self):
+        running = mock.MagicMock()
+        running.pipe.pid = os.getpid()
+        running.check_exit.return_value = False
+        stopped = mock.MagicMock(pipe=None)
+
+        sampler = ResourceSampler({'survival': running, 'creative': stopped}, 5, 60)
+        sampler.sample()
+
+        assert sampler.series['survival'].capacity == 12
+        assert len(sampler.series['survival']) == 1
+        assert len(sampler.series['creative']) == 0
+
+    def test_sample_exited(self):
+        server = mock.MagicMock()
+        server.check_exit.return_value = True
+
+        sampler = ResourceSampler({'survival': server}, 5, 60)
+
+        with mock.patch('mcrunner.sampler.read_process_sample') as mock_read:
+            sampler.sample()
+
+        assert mock_read.call_count == 0
+
+    def test_sample_process_gone(self):
+        server = mock.MagicMock()
+        server.check_exit.return_value = False
+
+        sampler = ResourceSampler({'survival': server}, 5, 60)
+
+        with mock.patch('mcrunner.sampler.read_process_sample', return_value=None):
+            sampler.sample()
+
+        assert len(sampler.series['survival']) == 0
+
+    def test_run_stop(self):
+        sampler = ResourceSampler({}, 0.01, 60)
+        sampler.sample = mock.MagicMock(side_effect=[RuntimeError, None, None])
+
+        sampler.start()
+        while sampler.sample.call_count < 2:
+            time.sleep(0.001)
+        sampler.stop()
+        sampler.join(5)
+
+        assert not sampler.is_alive()
+
+
+class SummarizeSamplesTestCase(unittest.TestCase):
+
+    def test_summarize(self):
+        summary = summarize_samples([
+            _sample(0.0, cpu_time=10.0, rss=100, switches=0, read_bytes=0),
+            _sample(5.0, cpu_time=15.0, rss=300, switches=50, read_bytes=500),
+            _sample(10.0, cpu_time=17.5, rss=200, threads=3, switches=100, read_bytes=1000),
+        ])
+
+        assert summary['samples'] == 3
+        assert summary['rss'] == 200
+        assert summary['max_rss'] == 300
+        assert summary['threads'] == 3
+        assert summary['cpu_percent'] == 75.0
+        assert summary['max_cpu_percent'] == 100.0
+        assert summary['voluntary_switches_per_sec'] == 10.0
+        assert summary['read_bytes_per_sec'] == 100.0
+
+    def test_summarize_restart(self):
+        summary = summarize_samples([
+            _sample(0.0, cpu_time=100.0),
+            _sample(5.0, cpu_time=1.0),
+            _sample(10.0, cpu_time=6.0),
+        ])
+
+        # the interval with the restart is left out
+        assert summary['cpu_percent'] == 100.0
+
+    def test_summarize_single_sample(self):
+        summary = summarize_samples([_sample(0.0, rss=100)])
+
+        assert summary['rss'] == 100
+        assert summary['cpu_percent'] is None
@@ -0,0 +1,237 @@
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from mcrunner.scheduler import MB, StartScheduler, parse_heap_size, read_memory_total
+
+GB = 1024 * MB
+
+MEMINFO = b"""MemTotal:       16310904 kB
+MemFree:          412708 kB
+MemAvailable:    9321944 kB
+"""
+
+
+class ParseHeapSizeTestCase(unittest.TestCase):
+
+    def test_max_heap(self):
+        assert parse_heap_size('-Xms1G -Xmx8G') == 8 * GB
+
+    def test_units(self):
+        assert parse_heap_size('-Xmx512m') == 512 * MB
+        assert parse_heap_size('-Xmx2097152k') == 2 * GB
+        assert parse_heap_size('-Xmx1073741824') == GB
+        assert parse_heap_size('-Xmx1t') == 1024 * GB
+
+    def test_initial_heap_only(self):
+        assert parse_heap_size('-Xms2G -XX:+UseG1GC') == 2 * GB
+
+    def test_last_option_wins(self):
+        assert parse_heap_size('-Xmx2G -Xmx4G') == 4 * GB
+
+    def test_no_heap(self):
+        assert parse_heap_size('-XX:+UseG1GC -Xss1M') is None
+        assert parse_heap_size(None) is None
+
+
+class ReadMemoryTotalTestCase(unittest.TestCase):
+
+    def test_read(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(MEMINFO)
+            f.flush()
+
+            assert read_memory_total(f.name) == 16310904 * 1024
+
+    def test_missing(self):
+        assert read_memory_total('/nonexistent/meminfo') is None
+
+
+class StartSchedulerTestCase(unittest.TestCase):
+
+    def _acquire_in_thread(self, scheduler, name, heap_size):
+        thread = threading.Thread(target=scheduler.acquire, args=(name, heap_size))
+        thread.daemon = True
+        thread.start()
+
+        # wait for the start to be queued
+        while not scheduler.get_queue_status(name) and name not in scheduler.committed:
+            time.sleep(0.001)
+
+        return thread
+
+    def test_acquire_within_budget(self):
+        scheduler = StartScheduler(8 * GB)
+
+        assert scheduler.acquire('survival', 4 * GB)
+        assert scheduler.acquire('creative', 4 * GB)
+
+        assert scheduler.committed_size == 8 * GB
+
+    def test_acquire_committed(self):
+        scheduler = StartScheduler(8 * GB)
+
+        assert scheduler.acquire('survival', 4 * GB)
+        assert not scheduler.acquire('survival', 4 * GB)
+
+        assert scheduler.committed_size == 4 * GB
+
+    def test_acquire_queued_twice(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', 8 * GB)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(scheduler.acquire('creative', 4 * GB)))
+        thread.daemon = True
+        thread.start()
+
+        while not scheduler.get_queue_status('creative'):
+            time.sleep(0.001)
+
+        assert not scheduler.acquire('creative', 4 * GB)
+
+        scheduler.release('survival')
+        thread.join(5)
+        scheduler.ready('creative')
+
+        assert results == [True]
+        assert scheduler.committed == {'creative': 4 * GB}
+
+    def test_cancel(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', 8 * GB)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(scheduler.acquire('creative', 4 * GB)))
+        thread.daemon = True
+        thread.start()
+
+        while not scheduler.get_queue_status('creative'):
+            time.sleep(0.001)
+
+        assert scheduler.cancel('creative')
+        thread.join(5)
+
+        assert results == [False]
+        assert scheduler.queue == []
+        assert scheduler.committed == {'survival': 8 * GB}
+        assert not scheduler.cancel('creative')
+
+    def test_acquire_larger_than_budget(self):
+        scheduler = StartScheduler(GB)
+
+        assert scheduler.acquire('survival', 4 * GB)
+
+    def test_acquire_unknown_heap(self):
+        scheduler = StartScheduler(GB)
+        scheduler.acquire('survival', GB)
+
+        assert scheduler.acquire('creative', None)
+
+    def test_acquire_no_budget(self):
+        scheduler = StartScheduler(None)
+        scheduler.acquire('survival', 64 * GB)
+
+        assert scheduler.acquire('creative', 64 * GB)
+
+    def test_acquire_queued(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', 6 * GB)
+
+        mock_connection = mock.MagicMock()
+
+        thread = threading.Thread(target=scheduler.acquire, args=('creative', 4 * GB), kwargs={
+            'connection': mock_connection,
+        })
+        thread.daemon = True
+        thread.start()
+
+        while not scheduler.get_queue_status('creative'):
+            time.sleep(0.001)
+
+        assert 'creative' not in scheduler.committed
+
+        scheduler.release('survival')
+        thread.join(5)
+
+        assert scheduler.committed == {'creative': 4 * GB}
+        assert mock_connection.send_message.call_args[0] == (
+            'Minecraft server "creative" queued, waiting for 4096 MB of memory (6144 of 8192 MB committed)...',
+        )
+
+    def test_queue_order(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', 8 * GB)
+
+        creative = self._acquire_in_thread(scheduler, 'creative', 6 * GB)
+        lobby = self._acquire_in_thread(scheduler, 'lobby', GB)
+
+        assert scheduler.get_queue_status('creative')[0] == 1
+        assert scheduler.get_queue_status('lobby')[0] == 2
+        assert scheduler.get_queue_status('survival') is None
+
+        scheduler.release('survival')
+        creative.join(5)
+
+        # queued starts are staggered, lobby waits until creative is ready
+        assert scheduler.get_queue_status('lobby')[0] == 1
+
+        scheduler.ready('creative')
+        lobby.join(5)
+
+        assert scheduler.committed == {'creative': 6 * GB, 'lobby': GB}
+
+    def test_stagger_queued_starts(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', 8 * GB)
+        scheduler.ready('survival')
+
+        creative = self._acquire_in_thread(scheduler, 'creative', 4 * GB)
+        lobby = self._acquire_in_thread(scheduler, 'lobby', 4 * GB)
+
+        scheduler.release('survival')
+        creative.join(5)
+
+        # lobby fits into the budget, but waits for creative to be ready
+        assert scheduler.starting == {'creative'}
+        assert scheduler.get_queue_status('lobby')[0] == 1
+
+        scheduler.ready('creative')
+        lobby.join(5)
+
+        assert scheduler.committed == {'creative': 4 * GB, 'lobby': 4 * GB}
+        assert scheduler.starting == {'lobby'}
+
+    def test_not_staggered_if_admitted(self):
+        scheduler = StartScheduler(8 * GB)
+
+        assert scheduler.acquire('survival', GB)
+        assert scheduler.acquire('creative', GB)
+
+        assert scheduler.starting == {'survival', 'creative'}
+
+    def test_release_starting(self):
+        scheduler = StartScheduler(8 * GB)
+        scheduler.acquire('survival', GB)
+
+        scheduler.release('survival')
+
+        assert scheduler.starting == set()
+
+    def test_queue_wait_time(self):
+        scheduler = StartScheduler(GB)
+        scheduler.acquire('survival', GB)
+
+        thread = self._acquire_in_thread(scheduler, 'creative', GB)
+
+        with mock.patch('mcrunner.scheduler.time.time', return_value=time.time() + 30):
+            position, waited = scheduler.get_queue_status('creative')
+
+        assert position == 1
+        assert 29 < waited < 31
+
+        scheduler.release('survival')
+        thread.join(5)
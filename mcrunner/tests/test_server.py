@@ -5,12 +5,24 @@ try:
 except ImportError:
     # Python 3.x
     import subprocess
+import os
+import re
+import threading
+import time
 import unittest
 
-from mcrunner.exceptions import ServerStartException
+from mcrunner.console import PendingCommand
+from mcrunner.exceptions import (
+    CommandNotDeliveredException,
+    CommandQueueFullException,
+    ConfigException,
+    ServerAlreadyRunningException,
+    ServerStartException,
+)
 from mcrunner.server import (
     MinecraftServer,
     SERVER_STOP_TIMEOUT_SEC,
+    SERVER_TERMINATE_TIMEOUT_SEC,
     ServerNotRunningException,
     ServerStatus
 )
@@ -18,6 +30,15 @@ from mcrunner.server import (
 
 class MinecraftServerTestCase(unittest.TestCase):
 
+    def setUp(self):
+        output_pump_patcher = mock.patch('mcrunner.server.OutputPump')
+        self.MockOutputPump = output_pump_patcher.start()
+        self.addCleanup(output_pump_patcher.stop)
+
+        command_writer_patcher = mock.patch('mcrunner.server.CommandWriter')
+        self.MockCommandWriter = command_writer_patcher.start()
+        self.addCleanup(command_writer_patcher.stop)
+
     def _create_server(self):
         self.server = MinecraftServer(
             'name',
@@ -28,6 +49,13 @@ class MinecraftServerTestCase(unittest.TestCase):
             restart_on_plugin_update=False,
         )
 
+    def test_plugin_monitor(self):
+        self._create_server()
+
+        assert self.server.plugin_monitor.server is self.server
+        assert self.server.plugin_monitor.manifest is self.server.plugin_manifest
+        assert self.server.plugin_manifest.path == os.path.join('path/to/jar', 'plugins')
+
     def test_start(self):
         self._create_server()
 
@@ -53,41 +81,367 @@ class MinecraftServerTestCase(unittest.TestCase):
             stderr=subprocess.PIPE
         )
 
-    def test_start_os_error(self):
+    def test_start_already_running(self):
         self._create_server()
 
-        error = OSError('File not found')
+        subprocess.Popen = mock.MagicMock()
+        mock_connection = mock.MagicMock()
 
-        subprocess.Popen = mock.MagicMock(side_effect=error)
+        self.server.start()
+        pipe = self.server.pipe
 
-        with self.assertRaises(ServerStartException) as exc:
+        with self.assertRaises(ServerAlreadyRunningException):
+            self.server.start(connection=mock_connection)
+
+        assert subprocess.Popen.call_count == 1
+        assert self.server.pipe is pipe
+        assert mock_connection.send_message.call_args[0] == ('Minecraft server "name" already running.',)
+
+    def test_start_output_pump(self):
+        self._create_server()
+
+        subprocess.Popen = mock.MagicMock()
+
+        self.server.start()
+
+        pipe = subprocess.Popen.return_value
+
+        assert self.MockOutputPump.call_count == 1
+        assert self.MockOutputPump.call_args[0][:2] == (
+            [pipe.stdout, pipe.stderr],
+            self.server._handle_output_line
+        )
+        assert self.server.output_pump.start.call_count == 1
+
+        on_eof = self.MockOutputPump.call_args[0][2]
+        on_eof()
+
+        assert self.server.pipe is None
+        assert self.server.get_status() == ServerStatus.STOPPED
+
+    def test_start_immediate_exit(self):
+        self._create_server()
+
+        subprocess.Popen = mock.MagicMock()
+
+        # the process exits before start() returns
+        self.MockOutputPump.return_value.start.side_effect = lambda: self.MockOutputPump.call_args[0][2]()
+
+        self.server.start()
+
+        assert self.server.pipe is None
+        assert self.server.get_status() == ServerStatus.STOPPED
+
+    def test_handle_output_line(self):
+        self._create_server()
+
+        self.server._handle_output_line(b'[Server thread/INFO]: Done (1.234s)!')
+
+        assert self.server.output.get_lines() == [b'[Server thread/INFO]: Done (1.234s)!']
+
+    def test_handle_output_line_lag_warning(self):
+        self._create_server()
+
+        self.server._handle_output_line(b'[12:00:00 INFO]: Preparing spawn area: 97%')
+        self.server._handle_output_line(
+            b"[12:00:01 WARN]: Can't keep up! Is the server overloaded? Running 5120ms or 102 ticks behind"
+        )
+
+        assert self.server.last_output_at
+        assert [ms for _, ms in self.server.lag_warnings] == [5120]
+        assert self.server.events.get_counts()['lag'] == 1
+
+    def test_handle_output_line_ready(self):
+        self._create_server()
+        self.server.status = ServerStatus.STARTING
+
+        self.server._handle_output_line(b'[12:00:00 INFO]: Preparing spawn area: 83%')
+        assert self.server.get_status() == ServerStatus.STARTING
+
+        self.server._handle_output_line(b'[12:00:01 INFO]: Done (12.345s)! For help, type "help"')
+        assert self.server.get_status() == ServerStatus.RUNNING
+
+    def test_handle_output_line_ready_when_stopping(self):
+        self._create_server()
+        self.server.status = ServerStatus.STOPPING
+
+        self.server._handle_output_line(b'[12:00:01 INFO]: Done (12.345s)!')
+
+        assert self.server.get_status() == ServerStatus.STOPPING
+
+    def test_handle_output_line_ready_startup_time(self):
+        self._create_server()
+
+        subprocess.Popen = mock.MagicMock()
+
+        with mock.patch('mcrunner.server.time.time', return_value=1000.0):
             self.server.start()
 
-        assert str(exc.exception) == 'File not found'
+        assert self.server.startup_time is None
+
+        with mock.patch('mcrunner.server.time.time', return_value=1093.5):
+            self.server._handle_output_line(b'[12:00:01 INFO]: Done (92.345s)!')
+
+        assert self.server.get_status() == ServerStatus.RUNNING
+        assert self.server.startup_time == 93.5
+
+    def test_ready_patterns(self):
+        server = MinecraftServer('name', 'path', 'forge.jar', '', ready_patterns='\nDedicated server took [0-9.]+ seconds\n  ^Ready$')
+        server.status = ServerStatus.STARTING
+
+        server._handle_output_line(b'Done (1.0s)!')
+        assert server.get_status() == ServerStatus.STARTING
+
+        server._handle_output_line(b'Ready')
+        assert server.get_status() == ServerStatus.RUNNING
+
+    def test_ready_patterns_disabled(self):
+        server = MinecraftServer('name', 'path', 'spigot.jar', '', ready_patterns=False)
 
-    def test_start_with_plugin_change_observer(self):
+        subprocess.Popen = mock.MagicMock()
+
+        server.start()
+
+        assert server.ready_res == []
+        assert server.get_status() == ServerStatus.RUNNING
+        assert server.wait_until_ready(0)
+
+    def test_wait_until_ready(self):
         self._create_server()
-        self.server.restart_on_plugin_update = True
 
         subprocess.Popen = mock.MagicMock()
+        mock_connection = mock.MagicMock()
+
+        self.server.start()
+
+        timer = threading.Timer(0.05, self.server._handle_output_line, args=(b'Done (1.0s)!',))
+        timer.start()
 
-        observer = mock.MagicMock()
+        assert self.server.wait_until_ready(5, connection=mock_connection)
+        timer.join()
 
-        self.server._get_plugin_change_observer = mock.MagicMock(return_value=observer)
+        assert mock_connection.send_message.call_args[0][0].startswith('Minecraft server "name" started in ')
+
+    def test_wait_until_ready_timeout(self):
+        self._create_server()
+
+        subprocess.Popen = mock.MagicMock()
+        mock_connection = mock.MagicMock()
 
         self.server.start()
 
-        assert observer.start.call_count == 1
+        assert not self.server.wait_until_ready(0.01, connection=mock_connection)
+        assert mock_connection.send_message.call_args[0] == (
+            'Minecraft server "name" did not finish starting within 0.01 seconds.',
+        )
 
-    def test_start_with_plugin_change_observer_none(self):
+    def test_wait_until_ready_exited(self):
         self._create_server()
-        self.server.restart_on_plugin_update = True
 
         subprocess.Popen = mock.MagicMock()
+        mock_connection = mock.MagicMock()
+
+        self.server.start()
+        self.MockOutputPump.call_args[0][2]()
+
+        assert not self.server.wait_until_ready(5, connection=mock_connection)
+        assert mock_connection.send_message.call_args[0] == ('Minecraft server "name" exited while starting.',)
+
+    def test_handle_exit_unexpected(self):
+        self._create_server()
+
+        pipe = mock.MagicMock()
+        pipe.wait.return_value = 1
+        self.server.pipe = pipe
+        self.server.status = ServerStatus.RUNNING
+
+        with mock.patch('mcrunner.server.logger') as mock_logger:
+            self.server._handle_exit(pipe)
+
+        assert mock_logger.warning.call_args[0] == (
+            'Minecraft server "%s" exited unexpectedly with code %s', 'name', 1
+        )
+        assert self.server.pipe is None
+        assert self.server.get_status() == ServerStatus.STOPPED
+        assert self.server.crash_count == 1
+
+    def test_handle_exit_crash_record(self):
+        self._create_server()
+        self.server.crash_log_lines = 2
+        self.server.crash_handler = mock.MagicMock()
+
+        for line in (b'line 1', b'line 2', b'line 3'):
+            self.server.output.append(line)
+
+        pipe = mock.MagicMock()
+        pipe.wait.return_value = -9
+        self.server.pipe = pipe
+        self.server.status = ServerStatus.RUNNING
+        self.server.launched_at = 1000.0
+
+        with mock.patch('mcrunner.server.time.time', return_value=1060.0):
+            self.server._handle_exit(pipe)
+
+        crash = self.server.crashes[-1]
+
+        assert crash == (1060.0, -9, 60.0, [b'line 2', b'line 3'])
+        assert self.server.crash_handler.call_args[0] == (self.server, crash)
+
+    def test_handle_exit_clean(self):
+        self._create_server()
+        self.server.crash_handler = mock.MagicMock()
+        self.server.clean_exit_handler = mock.MagicMock()
+
+        pipe = mock.MagicMock()
+        pipe.wait.return_value = 0
+        self.server.pipe = pipe
+        self.server.status = ServerStatus.RUNNING
+
+        with mock.patch('mcrunner.server.time.time', return_value=1060.0):
+            self.server._handle_exit(pipe)
+
+        assert self.server.get_status() == ServerStatus.STOPPED
+        assert self.server.crash_count == 0
+        assert len(self.server.crashes) == 0
+        assert self.server.crash_handler.call_count == 0
+        assert self.server.clean_exit_handler.call_args[0] == (self.server, 1060.0)
+
+    def test_handle_exit_stopping(self):
+        self._create_server()
+        self.server.crash_handler = mock.MagicMock()
+
+        pipe = mock.MagicMock()
+        self.server.pipe = pipe
+        self.server.status = ServerStatus.STOPPING
 
-        self.server._get_plugin_change_observer = mock.MagicMock(return_value=None)
+        self.server._handle_exit(pipe)
+
+        assert self.server.crash_count == 0
+        assert len(self.server.crashes) == 0
+        assert self.server.crash_handler.call_count == 0
+
+    def test_handle_exit_stack_trace(self):
+        self._create_server()
+
+        self.server._handle_output_line(b'[12:00:00 ERROR]: java.lang.OutOfMemoryError: Java heap space')
+
+        pipe = mock.MagicMock()
+        self.server.pipe = pipe
+        self.server.status = ServerStatus.STOPPING
+
+        self.server._handle_exit(pipe)
+
+        assert [event.type for event in self.server.events.get_recent()] == ['exception']
+
+    def test_invalid_restart_policy(self):
+        with self.assertRaises(ConfigException):
+            MinecraftServer('name', 'path/to/jar', 'craftbukkit.jar', '-arg_1', restart_policy='sometimes')
+
+    def test_check_exit(self):
+        self._create_server()
+        self.server.crash_handler = mock.MagicMock()
+
+        pipe = mock.MagicMock()
+        pipe.poll.return_value = None
+        self.server.pipe = pipe
+        self.server.command_writer = command_writer = mock.MagicMock()
+        self.server.status = ServerStatus.RUNNING
+
+        assert not self.server.check_exit()
+        assert self.server.pipe is pipe
+
+        # exited, but a child process still holds its output open
+        pipe.poll.return_value = 137
+        pipe.wait.return_value = 137
+
+        assert self.server.check_exit()
+
+        assert self.server.pipe is None
+        assert self.server.get_status() == ServerStatus.STOPPED
+        assert command_writer.close.call_count == 1
+        assert self.server.crash_handler.call_args[0][1].returncode == 137
+
+        # the output pump reaching the end later doesn't count it twice
+        self.server._handle_exit(pipe, command_writer)
+
+        assert self.server.crash_count == 1
+
+    def test_check_exit_not_running(self):
+        self._create_server()
+
+        assert not self.server.check_exit()
+
+    def test_handle_exit_old_process(self):
+        self._create_server()
+
+        self.server.pipe = mock.MagicMock()
+        self.server.status = ServerStatus.STARTING
+
+        self.server._handle_exit(mock.MagicMock())
+
+        assert self.server.pipe
+        assert self.server.get_status() == ServerStatus.STARTING
+
+    def test_status_listener(self):
+        self._create_server()
+
+        listener = mock.MagicMock()
+        self.server.add_status_listener(listener)
+
+        subprocess.Popen = mock.MagicMock()
+        self.server.run_command = mock.MagicMock()
 
         self.server.start()
+        self.server._handle_output_line(b'Done (1.0s)!')
+        self.server.stop()
+
+        assert listener.call_args_list == [
+            mock.call(self.server, ServerStatus.STARTING),
+            mock.call(self.server, ServerStatus.RUNNING),
+            mock.call(self.server, ServerStatus.STOPPING),
+            mock.call(self.server, ServerStatus.STOPPED),
+        ]
+
+    def test_console_buffer_size(self):
+        server = MinecraftServer('name', 'path', 'spigot.jar', '', console_buffer_size='2048')
+
+        assert server.console_buffer_size == 2048
+        assert server.output.max_bytes == 2048
+
+    def test_command_limiter_options(self):
+        server = MinecraftServer(
+            'name', 'path', 'spigot.jar', '',
+            command_rate='20', command_burst='5', coalesce_commands='\nsave-all\n  whitelist reload'
+        )
+
+        assert server.command_limiter.rate == 20.0
+        assert server.command_limiter.burst == 5
+        assert server.command_limiter.coalesce == frozenset([b'save-all\n', b'whitelist reload\n'])
+
+        assert server.get_command_queue_depth() == 0
+
+        subprocess.Popen = mock.MagicMock()
+
+        server.start()
+        assert self.MockCommandWriter.call_args[1]['limiter'] is server.command_limiter
+
+    def test_heap_size(self):
+        server = MinecraftServer('name', 'path', 'spigot.jar', '-Xms1G -Xmx2G')
+
+        assert server.heap_size == 2 * 1024 ** 3
+
+    def test_start_os_error(self):
+        self._create_server()
+
+        error = OSError('File not found')
+
+        subprocess.Popen = mock.MagicMock(side_effect=error)
+
+        with self.assertRaises(ServerStartException) as exc:
+            self.server.start()
+
+        assert str(exc.exception) == 'File not found'
+        assert self.server.get_status() == ServerStatus.STOPPED
 
     def test_stop(self):
         self._create_server()
@@ -98,7 +452,20 @@ class MinecraftServerTestCase(unittest.TestCase):
         self.server.stop()
 
         assert self.server.run_command.call_count == 1
-        assert self.server.run_command.call_args[0] == ('stop',)
+        assert self.server.run_command.call_args == (('stop',), {'wait': False, 'priority': True})
+        assert self.server.pipe is None
+        assert self.server.get_status() == ServerStatus.STOPPED
+
+    def test_stop_command_not_sent(self):
+        self._create_server()
+
+        self.server.run_command = mock.MagicMock(side_effect=ServerNotRunningException)
+        self.server.pipe = pipe = mock.MagicMock()
+
+        self.server.stop()
+
+        assert pipe.wait.call_count == 1
+        assert self.server.get_status() == ServerStatus.STOPPED
 
     def test_stop_not_running(self):
         self._create_server()
@@ -112,11 +479,37 @@ class MinecraftServerTestCase(unittest.TestCase):
         self.server.run_command = mock.MagicMock()
         pipe = mock.MagicMock()
         self.server.pipe = pipe
-        self.server.pipe.wait = mock.MagicMock(side_effect=subprocess.TimeoutExpired('cmd', 1))
+        self.server.pipe.wait = mock.MagicMock(side_effect=[subprocess.TimeoutExpired('cmd', 1), None])
 
         self.server.stop()
 
         assert pipe.terminate.call_count == 1
+        assert pipe.kill.call_count == 0
+        assert pipe.wait.call_args_list == [
+            mock.call(timeout=SERVER_STOP_TIMEOUT_SEC),
+            mock.call(timeout=SERVER_TERMINATE_TIMEOUT_SEC),
+        ]
+        assert self.server.pipe is None
+
+    def test_stop_timeout_and_kill(self):
+        self._create_server()
+
+        self.server.run_command = mock.MagicMock()
+        pipe = mock.MagicMock()
+        self.server.pipe = pipe
+        self.server.pipe.wait = mock.MagicMock(side_effect=[
+            subprocess.TimeoutExpired('cmd', 1),
+            subprocess.TimeoutExpired('cmd', 1),
+            None
+        ])
+
+        self.server.stop(timeout=5)
+
+        assert pipe.terminate.call_count == 1
+        assert pipe.kill.call_count == 1
+        assert pipe.wait.call_count == 3
+        assert pipe.wait.call_args_list[0] == mock.call(timeout=5)
+        assert self.server.pipe is None
 
     def test_stop_timeout_and_terminate_with_connection(self):
         self._create_server()
@@ -124,7 +517,7 @@ class MinecraftServerTestCase(unittest.TestCase):
         self.server.run_command = mock.MagicMock()
         pipe = mock.MagicMock()
         self.server.pipe = pipe
-        self.server.pipe.wait = mock.MagicMock(side_effect=subprocess.TimeoutExpired('cmd', 1))
+        self.server.pipe.wait = mock.MagicMock(side_effect=[subprocess.TimeoutExpired('cmd', 1), None])
 
         mock_connection = mock.MagicMock()
 
@@ -148,19 +541,39 @@ class MinecraftServerTestCase(unittest.TestCase):
         self.server.restart(plugin_update=True)
 
         assert subprocess.Popen.call_count == 2
+        assert self.server.start_count == 2
+        assert self.server.restart_count == 2
+        assert self.server.crash_count == 0
 
-    def test_get_status(self):
+    def test_handle_plugin_update(self):
         self._create_server()
 
-        self.server.run_command = mock.MagicMock()
-        self.server.pipe = mock.MagicMock()
+        self.server.restart = mock.MagicMock()
 
-        status = self.server.get_status()
+        self.server.handle_plugin_update()
 
-        assert status == ServerStatus.RUNNING
+        assert self.server.restart.call_args == mock.call(plugin_update=True)
 
-        assert self.server.run_command.call_count == 1
-        assert self.server.run_command.call_args[0] == ('ping',)
+    def test_handle_plugin_update_restart_handler(self):
+        self._create_server()
+
+        self.server.restart = mock.MagicMock()
+        self.server.restart_handler = mock.MagicMock()
+
+        self.server.handle_plugin_update()
+
+        assert self.server.restart.call_count == 0
+        assert self.server.restart_handler.call_args == mock.call(self.server)
+
+    def test_get_status(self):
+        self._create_server()
+
+        subprocess.Popen = mock.MagicMock()
+
+        self.server.start()
+
+        assert self.server.get_status() == ServerStatus.STARTING
+        assert self.MockCommandWriter.return_value.put.call_count == 0
 
     def test_get_status_not_running(self):
         self._create_server()
@@ -169,40 +582,146 @@ class MinecraftServerTestCase(unittest.TestCase):
 
         assert status == ServerStatus.STOPPED
 
+    def _set_up_command_writer(self, on_write=None):
+        self.server.pipe = mock.MagicMock()
+        self.server.command_writer = mock.MagicMock()
+        self.written = []
+
+        def put(data, priority=False):
+            self.written.append(data)
+            if on_write:
+                on_write(data)
+
+            command = PendingCommand(data)
+            command._finish()
+
+            return command
+
+        self.server.command_writer.put.side_effect = put
+
     def test_run_command(self):
         self._create_server()
+        self._set_up_command_writer()
 
-        self.server.pipe = mock.MagicMock()
+        assert self.server.run_command('say caf\xe9') is None
 
-        self.server.run_command('some command')
+        assert self.written == [b'say caf\xc3\xa9\n']
+
+    def test_run_command_priority_while_capturing(self):
+        self._create_server()
+        self._set_up_command_writer()
 
-        assert self.server.pipe.stdin.write.call_count == 1
-        assert self.server.pipe.stdin.write.call_args[0] == ('some command\n',)
+        # a command whose output is being captured holds the lock
+        self.server.command_lock.acquire()
+        self.addCleanup(self.server.command_lock.release)
 
-    def test_run_command_exception(self):
+        self.server.run_command('stop', wait=False, priority=True)
+
+        assert self.written == [b'stop\n']
+        assert self.server.command_writer.put.call_args[1] == {'priority': True}
+
+    def test_run_commands(self):
         self._create_server()
+        self._set_up_command_writer()
+
+        self.server.run_commands(['say restarting soon', 'save-all'])
+
+        assert self.written == [b'say restarting soon\nsave-all\n']
+
+    def test_run_command_not_delivered(self):
+        self._create_server()
+        self.server.command_delivery_timeout = 0.01
+        self.server.pipe = mock.MagicMock()
+        self.server.command_writer = mock.MagicMock()
+        self.server.command_writer.put.return_value = PendingCommand(b'list\n')
 
+        with self.assertRaises(CommandNotDeliveredException):
+            self.server.run_command('list')
+
+        # doesn't wait if asked not to
+        self.server.run_command('list', wait=False)
+
+    def test_run_command_pipe_broken(self):
+        self._create_server()
         self.server.pipe = mock.MagicMock()
-        self.server.pipe.stdin.write.side_effect = Exception
+        self.server.command_writer = mock.MagicMock()
+
+        command = PendingCommand(b'list\n')
+        command._finish(ServerNotRunningException())
+        self.server.command_writer.put.return_value = command
 
         with self.assertRaises(ServerNotRunningException):
-            self.server.run_command('some command')
+            self.server.run_command('list')
+
+    def test_run_command_queue_full(self):
+        self._create_server()
+        self.server.pipe = mock.MagicMock()
+        self.server.command_writer = mock.MagicMock()
+        self.server.command_writer.put.side_effect = CommandQueueFullException
 
-    def test_get_plugin_change_observer(self):
+        with self.assertRaises(CommandQueueFullException):
+            self.server.run_command('list')
+
+    def test_run_command_capture(self):
+        self._create_server()
+        self._set_up_command_writer(
+            lambda data: self.server._handle_output_line(b'There are 1 of a max of 20 players online: Notch')
+        )
+
+        lines = self.server.run_command('list', capture=True, quiet_period=0.01)
+
+        assert lines == [b'There are 1 of a max of 20 players online: Notch']
+        assert self.server.output.subscriptions == []
+
+    def test_run_command_capture_terminator(self):
         self._create_server()
 
-        observer = mock.MagicMock()
+        def write(data):
+            for line in (b'Saving the game', b'Saved the game', b'unrelated'):
+                self.server._handle_output_line(line)
 
-        with mock.patch('watchdog.observers.Observer', return_value=observer):
-            assert self.server._get_plugin_change_observer()
+        self._set_up_command_writer(write)
 
-        assert observer.schedule.call_count == 1
+        lines = self.server.run_command('save-all', capture=True, terminator=re.compile(b'^Saved'), quiet_period=5)
 
-    def test_get_plugin_change_observer_error(self):
+        assert lines == [b'Saving the game', b'Saved the game']
+
+    def test_run_command_capture_no_output(self):
         self._create_server()
+        self._set_up_command_writer()
 
-        observer = mock.MagicMock()
-        observer.schedule = mock.MagicMock(side_effect=OSError('file not found'))
+        assert self.server.run_command('save-on', capture=True, timeout=0.01) == []
 
-        with mock.patch('watchdog.observers.Observer', return_value=observer):
-            assert self.server._get_plugin_change_observer() is None
+    def test_run_command_capture_not_running(self):
+        self._create_server()
+
+        with self.assertRaises(ServerNotRunningException):
+            self.server.run_command('list', capture=True)
+
+        assert self.server.output.subscriptions == []
+
+    def test_run_command_serialized(self):
+        self._create_server()
+        self._set_up_command_writer()
+
+        def capture():
+            self.server.run_command('list', capture=True, timeout=0.1)
+
+        thread = threading.Thread(target=capture)
+        thread.start()
+
+        while not self.written:
+            time.sleep(0.001)
+
+        # waits for the captured command to finish
+        self.server.run_command('say hi')
+        thread.join(5)
+
+        assert self.written == [b'list\n', b'say hi\n']
+        assert not thread.is_alive()
+
+    def test_run_command_not_running(self):
+        self._create_server()
+
+        with self.assertRaises(ServerNotRunningException):
+            self.server.run_command('some command')
@@ -0,0 +1,188 @@
+import threading
+import time
+import unittest
+
+import mock
+
+from mcrunner.server import CrashRecord
+from mcrunner.server_status import ServerStatus
+from mcrunner.supervisor import Supervisor, get_restart_delay
+
+
+def _server(restart_policy='on-failure', status=ServerStatus.STOPPED):
+    server = mock.MagicMock()
+    server.name = 'survival'
+    server.restart_policy = restart_policy
+    server.restart_delay = 5
+    server.restart_max_delay = 300
+    server.crash_loop_count = 3
+    server.crash_loop_window = 600
+    server.get_status.return_value = status
+
+    return server
+
+
+def _crash(returncode=1, crash_time=None):
+    return CrashRecord(crash_time or time.time(), returncode, 10.0, [])
+
+
+class GetRestartDelayTestCase(unittest.TestCase):
+
+    def test_backoff(self):
+        assert get_restart_delay(0, 5, 300, random=lambda: 1.0) == 5
+        assert get_restart_delay(1, 5, 300, random=lambda: 1.0) == 10
+        assert get_restart_delay(3, 5, 300, random=lambda: 1.0) == 40
+
+    def test_max_delay(self):
+        assert get_restart_delay(10, 5, 300, random=lambda: 1.0) == 300
+
+    def test_jitter(self):
+        assert get_restart_delay(1, 5, 300, random=lambda: 0.0) == 5
+        assert get_restart_delay(1, 5, 300, random=lambda: 0.5) == 7.5
+
+
+class SupervisorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        timer_patcher = mock.patch('mcrunner.supervisor.threading.Timer')
+        self.MockTimer = timer_patcher.start()
+        self.addCleanup(timer_patcher.stop)
+
+        self.start_handler = mock.MagicMock()
+        self.supervisor = Supervisor(self.start_handler, random=lambda: 1.0)
+
+    def _fire(self):
+        function = self.MockTimer.call_args[0][1]
+        args = self.MockTimer.call_args[1]['args']
+
+        function(*args)
+
+    def test_restart_never(self):
+        self.supervisor.handle_crash(_server('never'), _crash())
+
+        assert self.MockTimer.call_count == 0
+
+    def test_restart_on_failure_clean_exit(self):
+        self.supervisor.handle_clean_exit(_server('on-failure'), time.time())
+
+        assert self.MockTimer.call_count == 0
+
+    def test_restart_always_clean_exit(self):
+        self.supervisor.handle_clean_exit(_server('always'), time.time())
+
+        assert self.MockTimer.call_count == 1
+        assert self.MockTimer.call_args[0][0] == 5
+
+    def test_restart_always_clean_exit_loop(self):
+        server = _server('always')
+        now = time.time()
+
+        for i in range(3):
+            self.supervisor.handle_clean_exit(server, now + i)
+
+        assert self.MockTimer.call_count == 2
+        assert self.supervisor.servers['survival'].crash_loop
+
+    def test_restart(self):
+        server = _server()
+
+        self.supervisor.handle_crash(server, _crash())
+
+        assert self.MockTimer.call_args[0][0] == 5
+        assert self.MockTimer.return_value.start.call_count == 1
+        assert self.supervisor.get_state('survival').restart_at
+
+        self._fire()
+
+        assert self.start_handler.call_args[0] == ('survival',)
+        assert self.supervisor.get_state('survival').restart_at is None
+
+    def test_restart_backoff(self):
+        server = _server()
+        now = time.time()
+
+        self.supervisor.handle_crash(server, _crash(crash_time=now))
+        self.supervisor.handle_crash(server, _crash(crash_time=now + 10))
+
+        assert [c[0][0] for c in self.MockTimer.call_args_list] == [5, 10]
+
+    def test_restart_backoff_resets(self):
+        server = _server()
+        now = time.time()
+
+        self.supervisor.handle_crash(server, _crash(crash_time=now))
+        self.supervisor.handle_crash(server, _crash(crash_time=now + 3600))
+
+        assert [c[0][0] for c in self.MockTimer.call_args_list] == [5, 5]
+
+    def test_crash_loop(self):
+        server = _server()
+        now = time.time()
+
+        for i in range(3):
+            self.supervisor.handle_crash(server, _crash(crash_time=now + i))
+
+        assert self.MockTimer.call_count == 2
+        assert self.supervisor.get_state('survival').crash_loop
+        assert self.supervisor.get_state('survival').restart_at is None
+
+    def test_restart_already_started(self):
+        self.supervisor.handle_crash(_server(status=ServerStatus.RUNNING), _crash())
+
+        self._fire()
+
+        assert self.start_handler.call_count == 0
+
+    def test_restart_error(self):
+        self.start_handler.side_effect = RuntimeError
+
+        self.supervisor.handle_crash(_server(), _crash())
+
+        with mock.patch('mcrunner.supervisor.logger') as mock_logger:
+            self._fire()
+
+        assert mock_logger.exception.call_count == 1
+
+    def test_reset(self):
+        server = _server()
+        now = time.time()
+
+        for i in range(3):
+            self.supervisor.handle_crash(server, _crash(crash_time=now + i))
+
+        self.supervisor.reset('survival')
+
+        state = self.supervisor.get_state('survival')
+        assert not state.crash_loop
+        assert len(state.crash_times) == 0
+
+    def test_reset_cancels_restart(self):
+        self.supervisor.handle_crash(_server(), _crash())
+
+        self.supervisor.reset('survival')
+        self._fire()
+
+        assert self.MockTimer.return_value.cancel.call_count == 1
+        assert self.start_handler.call_count == 0
+
+    def test_stop(self):
+        self.supervisor.handle_crash(_server(), _crash())
+
+        self.supervisor.stop()
+        self._fire()
+
+        assert self.start_handler.call_count == 0
+
+
+class SupervisorTimerTestCase(unittest.TestCase):
+
+    def test_restart_after_delay(self):
+        restarted = threading.Event()
+
+        server = _server()
+        server.restart_delay = 0.01
+
+        supervisor = Supervisor(lambda name: restarted.set())
+        supervisor.handle_crash(server, _crash())
+
+        assert restarted.wait(5)
@@ -0,0 +1,211 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from mcrunner import watcher
+from mcrunner.watcher import (
+    IN_CREATE,
+    IN_IGNORED,
+    IN_ISDIR,
+    IN_Q_OVERFLOW,
+    InotifyWatcher,
+    PollingWatcher,
+    create_watcher,
+    parse_events,
+)
+
+
+def _event(wd, mask, name=b''):
+    # names are padded with null bytes like the kernel does
+    padded = name + b'\0' * (16 - len(name) % 16) if name else b''
+    return struct.pack('iIII', wd, mask, 0, len(padded)) + padded
+
+
+class WatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_parse_events(self):
+        data = _event(1, IN_CREATE, b'plugin.jar') + _event(2, IN_IGNORED)
+
+        assert parse_events(data) == [
+            (1, IN_CREATE, b'plugin.jar'),
+            (2, IN_IGNORED, b''),
+        ]
+
+    def test_create_watcher_without_inotify(self):
+        with mock.patch('mcrunner.watcher._load_inotify', return_value=None):
+            assert isinstance(create_watcher(), PollingWatcher)
+
+    def test_create_watcher_init_error(self):
+        libc = mock.MagicMock()
+        libc.inotify_init1.return_value = -1
+
+        with mock.patch('mcrunner.watcher._load_inotify', return_value=libc):
+            assert isinstance(create_watcher(), PollingWatcher)
+
+
+@unittest.skipUnless(watcher._load_inotify(), 'inotify not available')
+class InotifyWatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.watcher = create_watcher()
+        assert isinstance(self.watcher, InotifyWatcher)
+
+    def _stop(self):
+        self.watcher.stop()
+        self.watcher.join(5)
+
+    def _close(self):
+        # a stopped watcher closes its file descriptors when run
+        self.watcher.stop()
+        self.watcher.run()
+
+    def test_watch(self):
+        changed = []
+        event = threading.Event()
+
+        def handler(path):
+            changed.append(path)
+            event.set()
+
+        assert self.watcher.watch(self.path, handler)
+
+        self.watcher.start()
+        self.addCleanup(self._stop)
+
+        with open(os.path.join(self.path, 'plugin.jar'), 'w') as f:
+            f.write('jar')
+
+        assert event.wait(5)
+        assert changed[0] == os.path.join(self.path, 'plugin.jar')
+
+    def test_stop_after_exit(self):
+        self._close()
+
+        assert self.watcher.closed
+
+        # doesn't write to the closed file descriptors
+        with mock.patch('os.write') as mock_write:
+            self.watcher.stop()
+
+        assert mock_write.call_count == 0
+
+    def test_watch_missing_directory(self):
+        self.addCleanup(self._close)
+
+        assert not self.watcher.watch(os.path.join(self.path, 'missing'), mock.MagicMock())
+
+    def test_dispatch(self):
+        self.addCleanup(self._close)
+
+        handler = mock.MagicMock()
+        self.watcher.watch(self.path, handler)
+        wd = list(self.watcher.watches)[0]
+
+        self.watcher._dispatch([
+            (wd, IN_CREATE, b'plugin.jar'),
+            (wd, IN_CREATE, b'plugin.jar'),
+            (wd, IN_CREATE | IN_ISDIR, b'directory'),
+            (wd + 1, IN_CREATE, b'unknown.jar'),
+        ])
+
+        assert handler.call_args_list == [mock.call(os.path.join(self.path, 'plugin.jar'))]
+
+        self.watcher._dispatch([(wd, IN_IGNORED, b'')])
+
+        assert self.watcher.watches == {}
+
+    def test_dispatch_overflow(self):
+        self.addCleanup(self._close)
+
+        handler = mock.MagicMock()
+        self.watcher.watch(self.path, handler)
+
+        open(os.path.join(self.path, 'plugin.jar'), 'w').close()
+
+        self.watcher._dispatch([(-1, IN_Q_OVERFLOW, b'')])
+
+        assert handler.call_args_list == [mock.call(os.path.join(self.path, 'plugin.jar'))]
+
+
+class PollingWatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.watcher = PollingWatcher()
+        self.handler = mock.MagicMock()
+
+    def test_watch_missing_directory(self):
+        assert not self.watcher.watch(os.path.join(self.path, 'missing'), self.handler)
+
+    def test_poll(self):
+        jar = os.path.join(self.path, 'plugin.jar')
+
+        with open(jar, 'w') as f:
+            f.write('old')
+
+        assert self.watcher.watch(self.path, self.handler)
+
+        self.watcher.poll()
+
+        assert self.handler.call_count == 0
+
+        # modified
+        with open(jar, 'w') as f:
+            f.write('new content')
+
+        self.watcher.poll()
+
+        assert self.handler.call_args_list == [mock.call(jar)]
+
+        # created
+        self.handler.reset_mock()
+        other = os.path.join(self.path, 'other.jar')
+        open(other, 'w').close()
+
+        self.watcher.poll()
+
+        assert self.handler.call_args_list == [mock.call(other)]
+
+        # deleted
+        self.handler.reset_mock()
+        os.remove(jar)
+
+        self.watcher.poll()
+
+        assert self.handler.call_args_list == [mock.call(jar)]
+
+    def test_poll_touched(self):
+        jar = os.path.join(self.path, 'plugin.jar')
+        open(jar, 'w').close()
+
+        self.watcher.watch(self.path, self.handler)
+
+        mtime = time.time() + 10
+        os.utime(jar, (mtime, mtime))
+
+        self.watcher.poll()
+
+        assert self.handler.call_args_list == [mock.call(jar)]
+
+    def test_run(self):
+        self.watcher.interval = 0.01
+        self.watcher.poll = mock.MagicMock(side_effect=lambda: self.watcher.stop())
+
+        self.watcher.run()
+
+        assert self.watcher.poll.call_count == 1
@@ -0,0 +1,316 @@
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SEC = 5
+READ_SIZE = 65536
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+    try:
+        try:
+            libc = ctypes.CDLL('libc.so.6', use_errno=True)
+        except OSError:
+            # find_library runs ldconfig, so only look for other C libraries when needed
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        init = libc.inotify_init1
+        add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    init.argtypes = [ctypes.c_int]
+    add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+    return libc
+
+
+def parse_events(data):
+    """
+    Parse a buffer read from an inotify file descriptor into a list of
+    (watch descriptor, mask, name) tuples.
+    """
+    events = []
+    offset = 0
+
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+
+        events.append((wd, mask, name))
+
+    return events
+
+
+def create_watcher():
+    """
+    Return an InotifyWatcher, or a PollingWatcher where inotify is not
+    available.
+    """
+    libc = _load_inotify()
+    if libc:
+        try:
+            return InotifyWatcher(libc)
+        except OSError as e:
+            logger.warning('Could not initialize inotify, watching files by polling: %s', e)
+    else:
+        logger.info('inotify not available, watching files by polling')
+
+    return PollingWatcher()
+
+
+class InotifyWatcher(threading.Thread):
+
+    """
+    Thread watching any number of directories for changes to the files in
+    them with a single inotify instance.
+
+    Directories are added with ``watch(path, handler)``, and ``handler`` is
+    called with the path of every file created, modified, moved or deleted
+    in it. Changes to the same file reported together are passed on once.
+    If the kernel event queue overflowed, every file in the watched
+    directories is reported as changed.
+    """
+
+    def __init__(self, libc):
+        super(InotifyWatcher, self).__init__()
+        self.daemon = True
+
+        self.libc = libc
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        # wakes the thread up when stopped
+        self.wake_fds = os.pipe()
+
+        self.watches = {}
+        self.stopped = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def watch(self, path, handler):
+        """
+        Start watching the files in the directory ``path``. Returns False if
+        the directory can't be watched.
+        """
+        encoded = path.encode(sys.getfilesystemencoding()) if not isinstance(path, bytes) else path
+
+        with self.lock:
+            wd = self.libc.inotify_add_watch(self.fd, encoded, WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                logger.warning('Cannot watch %s for changes: %s', path, os.strerror(error))
+                return False
+
+            _, handlers = self.watches.setdefault(wd, (path, []))
+            handlers.append(handler)
+
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+
+            # the thread may have exited and closed its file descriptors
+            if not self.closed:
+                os.write(self.wake_fds[1], b'\0')
+
+    def run(self):
+        try:
+            while not self.stopped:
+                try:
+                    readable, _, _ = select.select([self.fd, self.wake_fds[0]], [], [])
+                except (OSError, select.error) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if self.fd not in readable:
+                    continue
+
+                try:
+                    data = os.read(self.fd, READ_SIZE)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+
+                self._dispatch(parse_events(data))
+        except Exception:
+            logger.exception('Error watching files')
+        finally:
+            with self.lock:
+                self.closed = True
+
+                os.close(self.fd)
+                os.close(self.wake_fds[0])
+                os.close(self.wake_fds[1])
+
+    def _dispatch(self, events):
+        changes = []
+
+        with self.lock:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning('Missed file changes, rescanning all watched directories')
+
+                    for path, handlers in self.watches.values():
+                        for file_name in _list_files(path):
+                            changes.append((handlers, os.path.join(path, file_name)))
+                    continue
+
+                watch = self.watches.get(wd)
+                if not watch:
+                    continue
+
+                if mask & IN_IGNORED:
+                    # the directory was removed
+                    del self.watches[wd]
+                    continue
+
+                if mask & IN_ISDIR or not name:
+                    continue
+
+                path, handlers = watch
+                changes.append((handlers, os.path.join(path, name.decode(sys.getfilesystemencoding()))))
+
+        _notify(changes)
+
+
+class PollingWatcher(threading.Thread):
+
+    """
+    Thread watching directories for changes to the files in them by listing
+    and stating them every ``interval`` seconds, for systems without inotify.
+
+    The stat results of the last poll are kept, so a file is reported to the
+    handlers only when its size, modification time or inode changed or it
+    was created or deleted.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL_SEC):
+        super(PollingWatcher, self).__init__()
+        self.daemon = True
+
+        self.interval = interval
+
+        self.watches = {}
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def watch(self, path, handler):
+        """
+        Start watching the files in the directory ``path``. Returns False if
+        the directory can't be watched.
+        """
+        if not os.path.isdir(path):
+            logger.warning('Cannot watch %s for changes: not a directory', path)
+            return False
+
+        with self.lock:
+            if path not in self.watches:
+                self.watches[path] = ([], _scan(path))
+
+            self.watches[path][0].append(handler)
+
+        return True
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Error watching files')
+
+    def poll(self):
+        """
+        Check every watched directory once, notifying the handlers of files
+        that changed since the last poll.
+        """
+        changes = []
+
+        with self.lock:
+            for path, (handlers, previous) in list(self.watches.items()):
+                current = _scan(path)
+
+                for name in set(previous) | set(current):
+                    if previous.get(name) != current.get(name):
+                        changes.append((handlers, os.path.join(path, name)))
+
+                self.watches[path] = (handlers, current)
+
+        _notify(changes)
+
+
+def _scan(path):
+    # (size, modification time, inode) of every file in a directory
+    stats = {}
+
+    for name in _list_files(path):
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+
+        stats[name] = (stat.st_size, stat.st_mtime, stat.st_ino)
+
+    return stats
+
+
+def _list_files(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _notify(changes):
+    notified = set()
+
+    for handlers, path in changes:
+        for handler in handlers:
+            if (handler, path) in notified:
+                continue
+
+            notified.add((handler, path))
+
+            try:
+                handler(path)
+            except Exception:
+                logger.exception('Error handling change of %s', path)